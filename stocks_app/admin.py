@@ -1,13 +1,31 @@
 from django.contrib import admin
 
 from stocks_app.models import *
+from stocks_app.prices import price_cache
+from stocks_app.routers import replica_reads
 
 
-class TransactionAdmin(admin.ModelAdmin):
+class ReplicaListAdmin(admin.ModelAdmin):
+    """ Serves the change list page from a replica. Actions posted from it and every other page use the primary."""
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method != 'GET':
+            return super().changelist_view(request, extra_context)
+        with replica_reads(request.user.id):
+            response = super().changelist_view(request, extra_context)
+            # The rows are fetched while the template renders, so render inside the block.
+            if hasattr(response, 'render'):
+                response.render()
+        return response
+
+
+class TransactionAdmin(ReplicaListAdmin):
     exclude = ('transaction_price',)
+    # Each row is shown through `__str__`, which reads the stock; join it instead of one query per row.
+    list_select_related = ('ticker',)
 
     def save_model(self, request, obj, form, change):
-        stock = Stock.objects.get(id=obj.ticker.id)
+        stock = price_cache.get(pk=obj.ticker_id)
         obj.transaction_price = stock.price * obj.transaction_volume
         super().save_model(request, obj, form, change)
 
@@ -16,3 +34,5 @@ class TransactionAdmin(admin.ModelAdmin):
 admin.site.register(Transaction, TransactionAdmin)
 admin.site.register(users)
 admin.site.register(Stock)
+admin.site.register(Position, ReplicaListAdmin, list_select_related=('user', 'stock'))
+admin.site.register(DailyRollup, ReplicaListAdmin, list_select_related=('stock',))
@@ -0,0 +1,182 @@
+from itertools import chain, islice
+
+from django.db.models import BooleanField, ExpressionWrapper, Q, Value
+
+from .archive import archived_transactions, reaches_archive
+from .models import Stock, Transaction
+from .money import SCALE, from_micros
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+COLUMNS = ['ticker_id', 'is_buy', 'in_window', 'transaction_volume', 'transaction_price']
+
+
+""" Pulls the ledger of a user as NumPy columns, fetched in chunks."""
+
+
+def load_ledger(user, start=None, end=None, chunk_size=20000):
+    """
+    Reads every transaction of the user up to `end` in index order with
+    `values_list`. The buy flag and the window flag are computed in SQL, so each
+    row arrives as five integers and is packed straight into an int64 array;
+    only the notional is turned into float whole units at the end.
+
+    Rows before `start` are still loaded because FIFO lots opened before the
+    window are needed to price the sells inside it, including archived months.
+
+    @:param user : the `users` row whose ledger is loaded
+    @:param start : aware datetime, first instant of the window, or None
+    @:param end : aware datetime, first instant after the window, or None
+    @:return : dict of column name to NumPy array, ordered by ticker then time
+    """
+    transactions = Transaction.objects.filter(user=user)
+    if end is not None:
+        transactions = transactions.filter(created_at__lt=end)
+
+    in_window = Q(created_at__gte=start) if start is not None else Value(True)
+    rows = transactions.annotate(
+        is_buy=ExpressionWrapper(Q(transaction_type=Transaction.BUY), output_field=BooleanField()),
+        in_window=ExpressionWrapper(in_window, output_field=BooleanField()),
+    ).order_by('created_at', 'id').values_list(*COLUMNS).iterator(chunk_size=chunk_size)
+    if reaches_archive(end=end, user_id=user.id):
+        rows = chain(((row.ticker_id, row.transaction_type == Transaction.BUY,
+                       start is None or row.created_at >= start, row.transaction_volume, row.transaction_price)
+                      for row in archived_transactions(user_id=user.id, end=end)), rows)
+
+    chunks = []
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        chunks.append(np.array(chunk, dtype=np.int64))
+    data = np.concatenate(chunks) if chunks else np.empty((0, len(COLUMNS)), dtype=np.int64)
+
+    # A stable sort by ticker keeps the time order inside each ticker.
+    data = data[np.argsort(data[:, 0], kind='stable')]
+    return {
+        'ticker_id': data[:, 0],
+        'is_buy': data[:, 1].astype(bool),
+        'in_window': data[:, 2].astype(bool),
+        'volume': data[:, 3].astype(np.float64),
+        'notional': data[:, 4] / SCALE,
+    }
+
+
+""" Computes per-ticker portfolio metrics from ledger columns."""
+
+
+def compute_metrics(ticker_id, is_buy, in_window, volume, notional, prices):
+    """
+    Computes VWAP, turnover, realized and unrealized gains per ticker with
+    grouped array operations.
+
+    FIFO matching is done on a cumulative "shares bought" axis: the cost of any
+    run of shares is the difference of the piecewise linear cumulative cost
+    curve at its two ends, so every sell is priced with one `np.interp`. A sell
+    larger than the shares held only consumes what is held.
+
+    @:param ticker_id, is_buy, in_window, volume, notional : ledger columns sorted
+            by ticker and then by time, as returned by `load_ledger`
+    @:param prices : dict of ticker id to current price, used for unrealized gains
+    @:return : dict of ticker id to a dict of metrics
+    """
+    keep = volume > 0
+    ticker_id, is_buy, in_window = ticker_id[keep], is_buy[keep], in_window[keep]
+    volume, notional = volume[keep], notional[keep]
+    n = len(ticker_id)
+    if n == 0:
+        return {}
+
+    starts = np.flatnonzero(np.r_[True, ticker_id[1:] != ticker_id[:-1]])
+    ends = np.r_[starts[1:], n]
+    group = np.repeat(np.arange(len(starts)), ends - starts)
+
+    buy_volume = np.where(is_buy, volume, 0.0)
+    sell_volume = volume - buy_volume
+    cum_buy = np.cumsum(buy_volume)
+    cum_cost = np.cumsum(np.where(is_buy, notional, 0.0))
+    cum_sell = np.cumsum(sell_volume)
+
+    buy_offset = (cum_buy - buy_volume)[starts]
+    sell_offset = (cum_sell - sell_volume)[starts]
+    local_buy = cum_buy - buy_offset[group]
+    local_sell = cum_sell - sell_offset[group]
+
+    # Shares actually sold so far: oversells are dropped by carrying the running
+    # minimum of (bought - sold) per ticker.
+    shortfall = np.minimum(local_buy - local_sell, 0.0)
+    for first, last in zip(starts, ends):
+        np.minimum.accumulate(shortfall[first:last], out=shortfall[first:last])
+    sold = local_sell + shortfall
+    sold_before = np.r_[0.0, sold[:-1]]
+    sold_before[starts] = 0.0
+
+    buy_axis = np.r_[0.0, cum_buy[is_buy]]
+    cost_curve = np.r_[0.0, cum_cost[is_buy]]
+
+    def cost_at(local_position):
+        return np.interp(buy_offset[group] + local_position, buy_axis, cost_curve)
+
+    matched = sold - sold_before
+    realized = np.where(is_buy, 0.0, notional * matched / volume - (cost_at(sold) - cost_at(sold_before)))
+
+    held = local_buy[ends - 1] - sold[ends - 1]
+    held_cost = (np.interp(buy_offset + local_buy[ends - 1], buy_axis, cost_curve)
+                 - np.interp(buy_offset + sold[ends - 1], buy_axis, cost_curve))
+
+    window_buy = np.bincount(group, weights=np.where(in_window, buy_volume, 0.0))
+    window_sell = np.bincount(group, weights=np.where(in_window, sell_volume, 0.0))
+    turnover = np.bincount(group, weights=np.where(in_window, notional, 0.0))
+    trades = np.bincount(group, weights=in_window.astype(np.float64))
+    window_realized = np.bincount(group, weights=np.where(in_window, realized, 0.0))
+
+    metrics = {}
+    for i, tid in enumerate(ticker_id[starts].tolist()):
+        traded = window_buy[i] + window_sell[i]
+        price = prices.get(tid)
+        unrealized = held[i] * price - held_cost[i] if price is not None else None
+        metrics[tid] = {
+            'trades': int(trades[i]),
+            'volume_bought': int(window_buy[i]),
+            'volume_sold': int(window_sell[i]),
+            'turnover': float(turnover[i]),
+            'vwap': float(turnover[i] / traded) if traded else None,
+            'realized_gain': float(window_realized[i]),
+            'held': int(held[i]),
+            'held_cost': float(held_cost[i]),
+            'unrealized_gain': float(unrealized) if unrealized is not None else None,
+        }
+    return metrics
+
+
+""" Builds the analytics report of a user over a date window."""
+
+
+def portfolio_analytics(user, start=None, end=None):
+    """
+    Loads the ledger, prices the open lots at the current `Stock.price` and
+    returns the per-ticker metrics together with the user's totals.
+    """
+    ledger = load_ledger(user, start, end)
+    ticker_ids = np.unique(ledger['ticker_id']).tolist()
+    stocks = {pk: (ticker, price) for pk, ticker, price in
+              Stock.objects.filter(pk__in=ticker_ids).values_list('id', 'ticker', 'price')}
+
+    metrics = compute_metrics(
+        ledger['ticker_id'], ledger['is_buy'], ledger['in_window'], ledger['volume'], ledger['notional'],
+        {pk: from_micros(price) for pk, (ticker, price) in stocks.items()},
+    )
+
+    tickers = [dict(ticker=stocks[pk][0], **values) for pk, values in metrics.items()]
+    realized = sum(values['realized_gain'] for values in tickers)
+    unrealized = sum(values['unrealized_gain'] or 0.0 for values in tickers)
+    return {
+        'turnover': sum(values['turnover'] for values in tickers),
+        'realized_gain': realized,
+        'unrealized_gain': unrealized,
+        'pnl': realized + unrealized,
+        'tickers': tickers,
+    }
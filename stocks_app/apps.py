@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class StocksAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'stocks_app'
+
+    def ready(self):
+        # Connects the token and price cache invalidation receivers, and the price stream.
+        from . import authentication, prices, streams  # noqa: F401
+        from .dbpool import install
+        install()
+        # Counts and times the queries of every request measured by MetricsMiddleware.
+        from django.db.backends.signals import connection_created
+        from .metrics import install_query_wrapper
+        connection_created.connect(install_query_wrapper, dispatch_uid='stocks_app.metrics')
+        # Counts the queries of the views and blocks under a query budget.
+        from . import querybudget
+        connection_created.connect(querybudget.install_query_wrapper, dispatch_uid='stocks_app.querybudget')
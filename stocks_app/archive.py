@@ -0,0 +1,228 @@
+import gzip
+import json
+import os
+from datetime import date, datetime, timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Transaction, TransactionArchive, TransactionArchiveUser
+
+FIELDS = ['id', 'user_id', 'ticker_id', 'transaction_type', 'transaction_volume', 'transaction_price', 'created_at']
+
+
+def month_start(moment):
+    """ Returns the aware datetime of midnight on the first day of the month of `moment` (a date or datetime)."""
+    if isinstance(moment, datetime) and timezone.is_aware(moment):
+        moment = timezone.localtime(moment)
+    return timezone.make_aware(datetime(moment.year, moment.month, 1))
+
+
+def next_month(moment):
+    return month_start(date(moment.year + moment.month // 12, moment.month % 12 + 1, 1))
+
+
+""" The first instant that is still in the `Transaction` table, or None if nothing was archived."""
+
+
+def horizon():
+    last = TransactionArchive.objects.order_by('-month').values_list('month', flat=True).first()
+    return next_month(last) if last is not None else None
+
+
+""" True when the `Transaction` table is range partitioned by month, see migration 0013."""
+
+
+def partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)',
+                       [Transaction._meta.db_table])
+        return cursor.fetchone() is not None
+
+
+def partition_name(month):
+    return f'{Transaction._meta.db_table}_{month_start(month):%Y_%m}'
+
+
+""" Creates the monthly partitions of `Transaction` that do not exist yet."""
+
+
+def create_partitions(first, months_ahead=None):
+    """
+    Adds one partition per month from the month of `first` to `months_ahead`
+    months after the current one, so new transactions never land in the
+    default partition. Months that already have rows in the default partition
+    are skipped, because Postgres refuses to attach a range they overlap.
+    Does nothing unless the table is partitioned.
+
+    @:param first : any date or datetime inside the first month
+    @:param months_ahead : defaults to `TRANSACTIONS_PARTITIONS_AHEAD`
+    @:return : names of the created partitions
+    """
+    if not partitioned():
+        return []
+    if months_ahead is None:
+        months_ahead = getattr(settings, 'TRANSACTIONS_PARTITIONS_AHEAD', 3)
+    table = Transaction._meta.db_table
+    last = month_start(timezone.now())
+    for _ in range(months_ahead):
+        last = next_month(last)
+
+    created = []
+    start = month_start(first)
+    with connection.cursor() as cursor:
+        while start <= last:
+            end, name = next_month(start), partition_name(start)
+            cursor.execute('SELECT to_regclass(%s) IS NULL', [name])
+            missing = cursor.fetchone()[0]
+            if missing:
+                cursor.execute(f'SELECT EXISTS (SELECT 1 FROM {table}_default '
+                               f'WHERE created_at >= %s AND created_at < %s)', [start, end])
+                if not cursor.fetchone()[0]:
+                    cursor.execute(f"CREATE TABLE {name} PARTITION OF {table} "
+                                   f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')")
+                    created.append(name)
+            start = end
+    return created
+
+
+""" Removes a month from the table: drops its partition when it has one, else deletes its rows."""
+
+
+def delete_month(start, end):
+    if partitioned():
+        name = partition_name(start)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [name])
+            if cursor.fetchone()[0]:
+                cursor.execute(f'SELECT count(*) FROM {name}')
+                deleted = cursor.fetchone()[0]
+                cursor.execute(f'ALTER TABLE {Transaction._meta.db_table} DETACH PARTITION {name}')
+                cursor.execute(f'DROP TABLE {name}')
+                return deleted
+    deleted, _ = Transaction.objects.filter(created_at__gte=start, created_at__lt=end).delete()
+    return deleted
+
+
+""" Moves one calendar month of transactions into a compressed file."""
+
+
+def archive_month(month, chunk_size=5000):
+    """
+    Writes every transaction of the month to `<TRANSACTIONS_ARCHIVE_DIR>/transactions-YYYY-MM.ndjson.gz`
+    in (created_at, id) order, fsyncs it, then records the `TransactionArchive`
+    row with the range of every user in it and removes the month from the
+    table in one database transaction.
+    Months must be archived oldest first, so everything before `horizon()` is
+    in files and everything after it is in the table.
+
+    @:param month : any date or datetime inside the month
+    @:return : the `TransactionArchive` row
+    """
+    start, end = month_start(month), next_month(month)
+    current = horizon()
+    if current is not None and start < current:
+        raise ValueError(f'{start:%Y-%m} is already archived.')
+    if Transaction.objects.filter(created_at__lt=start).exists():
+        raise ValueError(f'Archive the months before {start:%Y-%m} first.')
+
+    directory = str(getattr(settings, 'TRANSACTIONS_ARCHIVE_DIR', settings.BASE_DIR / 'archive'))
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'transactions-{start:%Y-%m}.ndjson.gz')
+
+    rows = Transaction.objects.filter(created_at__gte=start, created_at__lt=end).order_by(
+        'created_at', 'id').values_list(*FIELDS).iterator(chunk_size=chunk_size)
+    count, users = 0, {}
+    with open(path + '.tmp', 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as compressed:
+            for row in rows:
+                record = dict(zip(FIELDS, row))
+                created_at = record['created_at']
+                record['created_at'] = created_at.isoformat()
+                compressed.write(json.dumps(record, separators=(',', ':')).encode() + b'\n')
+                count += 1
+                entry = users.setdefault(record['user_id'], [0, created_at, created_at])
+                entry[0] += 1
+                entry[2] = created_at
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(path + '.tmp', path)
+
+    with transaction.atomic():
+        archived = TransactionArchive.objects.create(month=start.date(), path=path, row_count=count)
+        TransactionArchiveUser.objects.bulk_create(
+            TransactionArchiveUser(archive=archived, user_id=user_id, row_count=user_count,
+                                   first_at=first_at, last_at=last_at)
+            for user_id, (user_count, first_at, last_at) in users.items()
+        )
+        deleted = delete_month(start, end)
+        if deleted != count:
+            raise ValueError(f'{start:%Y-%m} changed while it was archived, nothing was deleted.')
+    return archived
+
+
+""" Reads archived transactions back, oldest first."""
+
+
+def archived_transactions(user_id=None, start=None, end=None, after=None):
+    """
+    Yields unsaved `Transaction` objects from the archive files whose month
+    overlaps `[start, end)`, in (created_at, id) order. Files of other months
+    are never opened, and nothing is read when the range starts after the
+    archive horizon. With `user_id`, only the files where that user's own
+    range overlaps the requested one are opened.
+
+    @:param user_id : only yield this user's transactions, or None for all users
+    @:param start : aware datetime, first instant included, or None
+    @:param end : aware datetime, first instant excluded, or None
+    @:param after : `(created_at, id)` of a cursor; only later rows are yielded
+    """
+    archives = TransactionArchive.objects.order_by('month')
+    if start is not None:
+        archives = archives.filter(month__gte=month_start(start).date())
+    if end is not None:
+        archives = archives.filter(month__lt=next_month(end - timedelta(microseconds=1)).date())
+    if after is not None:
+        archives = archives.filter(month__gte=month_start(after[0]).date())
+    if user_id is not None:
+        archives = archives.filter(pk__in=user_archives(user_id, start, end, after).values('archive'))
+
+    for archive in archives:
+        with gzip.open(archive.path, 'rb') as lines:
+            for line in lines:
+                record = json.loads(line)
+                if user_id is not None and record['user_id'] != user_id:
+                    continue
+                created_at = datetime.fromisoformat(record['created_at'])
+                if ((start is not None and created_at < start) or (end is not None and created_at >= end)
+                        or (after is not None and (created_at, record['id']) <= after)):
+                    continue
+                record['created_at'] = created_at
+                yield Transaction(**record)
+
+
+""" The index rows of the archive files holding transactions of `user_id` inside `[start, end)` after `after`."""
+
+
+def user_archives(user_id, start=None, end=None, after=None):
+    entries = TransactionArchiveUser.objects.filter(user_id=user_id)
+    if start is not None:
+        entries = entries.filter(last_at__gte=start)
+    if end is not None:
+        entries = entries.filter(first_at__lt=end)
+    if after is not None:
+        entries = entries.filter(last_at__gte=after[0])
+    return entries
+
+
+""" True when `[start, end)` reaches into archived months, or into the archived rows of `user_id` when given."""
+
+
+def reaches_archive(start=None, end=None, user_id=None, after=None):
+    if user_id is not None:
+        return user_archives(user_id, start, end, after).exists()
+    current = horizon()
+    return current is not None and (start is None or start < current)
@@ -0,0 +1,235 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+
+from .archive import archived_transactions, reaches_archive
+from .authentication import async_jwt_required
+from .idempotency import async_idempotent
+from .models import users, Stock, Transaction
+from .money import from_micros, rows_from_micros
+from .orders import clean_order, place_order, OrderError
+from .pagination import TransactionCursorPagination
+from .routers import pin_to_primary, read_from_replica
+from .querybudget import query_budget
+from .prices import price_cache
+from .sequencer import sequencer
+from .journal import journal
+from .serializers import usersSerializer, StockSerializer, TransactionSerializer
+from .streams import broker, events, sse
+
+"""
+Async counterparts of the read endpoints and the order endpoint, served under
+`async/`. Under ASGI they wait on the database without holding a worker thread:
+reads go through the async ORM, and only the atomic order fill, which Django
+cannot run in async code, is handed to a thread with `sync_to_async`.
+"""
+
+
+"""
+This async CBV GET a user from the database based on the provided username
+it returns the user data.
+"""
+
+
+class GetUser_ByUsernameView(View):
+
+    @method_decorator(query_budget(2))
+    @method_decorator(async_jwt_required)
+    async def get(self, request, username):
+        try:
+            fields = usersSerializer.requested_fields(request.GET)
+            user = await users.objects.only(*usersSerializer.columns(fields)).aget(username=username)
+        except ValidationError as e:
+            return JsonResponse(e.detail, status=status.HTTP_400_BAD_REQUEST)
+        except users.DoesNotExist:
+            return JsonResponse({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
+        return JsonResponse(usersSerializer(user, fields=fields).data, status=status.HTTP_200_OK)
+
+
+"""
+This async CBV GET a stock based on the provided ticker through the price cache.
+"""
+
+
+class Get_StockView(View):
+
+    @method_decorator(query_budget(2))
+    @method_decorator(async_jwt_required)
+    async def get(self, request, ticker):
+        try:
+            fields = StockSerializer.requested_fields(request.GET)
+            stock = await price_cache.aget(ticker=ticker)
+        except ValidationError as e:
+            return JsonResponse(e.detail, status=status.HTTP_400_BAD_REQUEST)
+        except Stock.DoesNotExist:
+            return JsonResponse({"error": "Stock not found"}, status=status.HTTP_404_NOT_FOUND)
+        return JsonResponse(StockSerializer(stock, fields=fields).data, status=status.HTTP_200_OK)
+
+
+"""
+This async CBV GET all stocks from the database and returns them.
+"""
+
+
+class Get_AllStocksView(View):
+
+    @method_decorator(query_budget(3))
+    @method_decorator(async_jwt_required)
+    async def get(self, request):
+        stocks = [stock async for stock in Stock.objects.order_by('id').values('ticker', 'price')]
+        return JsonResponse(rows_from_micros(stocks, ['price']), safe=False, status=status.HTTP_200_OK)
+
+
+"""
+This async CBV fetches one cursor page of the transactions of a user.
+Archived months are read in a thread, like the order fill, and only when the
+archive index has rows of the user after the cursor.
+"""
+
+
+class Get_TransactionsView(View):
+
+    @method_decorator(query_budget(5))
+    @method_decorator(async_jwt_required)
+    @method_decorator(read_from_replica)
+    async def get(self, request, username):
+        paginator = TransactionCursorPagination()
+        archived = None
+        user_id = await users.objects.filter(username=username).values_list('id', flat=True).afirst()
+        try:
+            position = paginator.get_position(request.GET)
+            if user_id is not None and await sync_to_async(reaches_archive)(user_id=user_id, after=position):
+                def archived(after=None):
+                    return archived_transactions(user_id=user_id, after=after)
+            fields = TransactionSerializer.requested_fields(request.GET)
+            transactions = Transaction.objects.filter(user__username=username).only(
+                *TransactionSerializer.columns(fields), 'created_at')
+            page = await paginator.apaginate_queryset(transactions, request.GET, archived=archived)
+        except ValidationError as e:
+            return JsonResponse(e.detail, status=status.HTTP_400_BAD_REQUEST)
+        serializer = TransactionSerializer(page, many=True, fields=fields)
+        return JsonResponse({'next_cursor': paginator.next_cursor, 'results': serializer.data},
+                            status=status.HTTP_200_OK)
+
+
+"""
+This async CBV handles the creation of a new transaction using the `POST` method.
+The order is queued on its sequencer shard and awaited without holding a thread,
+or, with the sequencer disabled, filled in one atomic block on a worker thread.
+"""
+
+
+class Add_TransactionView(View):
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Token authenticated like the DRF views, so no CSRF cookie is expected.
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    @method_decorator(query_budget(14))
+    @method_decorator(async_jwt_required)
+    @method_decorator(pin_to_primary)
+    @method_decorator(async_idempotent)
+    async def post(self, request):
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            return JsonResponse({"error": "A JSON object is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            order = clean_order(data)
+            if getattr(settings, 'ORDER_WRITE_BEHIND_ENABLED', False):
+                if journal.thread is None:
+                    # The first order replays the journal, which needs the database.
+                    await sync_to_async(journal.start)()
+                sequence = await asyncio.shield(asyncio.wrap_future(journal.submit(order)[0]))
+                return JsonResponse({"status": "journaled", "sequence": sequence}, status=status.HTTP_202_ACCEPTED)
+            if not getattr(settings, 'ORDER_SEQUENCER_ENABLED', True):
+                trade = await sync_to_async(place_order)(*order)
+            else:
+                shard, future = sequencer.submit(order)
+                if request.GET.get('wait', '').lower() in ('0', 'false', 'no'):
+                    return JsonResponse({"status": "queued", "shard": shard}, status=status.HTTP_202_ACCEPTED)
+                trade = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)),
+                                               getattr(settings, 'ORDER_SEQUENCER_TIMEOUT', 5.0))
+        except OrderError as e:
+            return JsonResponse({"error": e.message}, status=e.status_code)
+        except asyncio.TimeoutError:
+            return JsonResponse({"status": "queued", "shard": shard}, status=status.HTTP_202_ACCEPTED)
+        except OSError:
+            return JsonResponse({"error": "The order journal is not writable."},
+                                status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return JsonResponse(TransactionSerializer(trade).data, status=status.HTTP_201_CREATED)
+
+
+"""
+This async CBV streams server-sent events: the price of the stocks named in
+`?tickers=A,B` (or every stock with `?tickers=*`) each time one is saved,
+and the fills of `?username=` as they are committed. Prices are sent once on
+connect, then pushed with bursts coalesced to the latest tick. The stream
+ends after `?timeout=` seconds, at most `STREAM_MAX_AGE`, and the browser's
+`EventSource` reconnects by itself; the token may be passed as `?token=`.
+Under WSGI only the current prices are sent before the stream ends.
+"""
+
+
+class Get_StreamView(View):
+
+    @method_decorator(query_budget(3))
+    @method_decorator(async_jwt_required)
+    async def get(self, request):
+        if not getattr(settings, 'STREAMS_ENABLED', True):
+            return JsonResponse({"error": "Streaming is disabled."}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        tickers = {ticker for ticker in request.GET.get('tickers', '').split(',') if ticker}
+        all_tickers = tickers == {'*'}
+        username = request.GET.get('username')
+        if not tickers and not username:
+            return JsonResponse({"error": "Pass tickers, a username, or both."}, status=status.HTTP_400_BAD_REQUEST)
+        max_age = getattr(settings, 'STREAM_MAX_AGE', 3600.0)
+        try:
+            lifetime = min(float(request.GET.get('timeout', max_age)), max_age)
+        except ValueError:
+            return JsonResponse({"error": "Timeout must be a number of seconds."}, status=status.HTTP_400_BAD_REQUEST)
+        if broker.subscribers >= getattr(settings, 'STREAM_MAX_SUBSCRIBERS', 20000):
+            return JsonResponse({"error": "Too many open streams, retry later."},
+                                status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        user_id = None
+        if username:
+            user_id = await users.objects.filter(username=username).values_list('id', flat=True).afirst()
+            if user_id is None:
+                return JsonResponse({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        # Subscribe before reading the snapshot, so a price saved in between is sent, if twice, rather than missed.
+        subscriber = broker.subscribe(asyncio.get_running_loop(), tickers, all_tickers, user_id,
+                                      getattr(settings, 'STREAM_QUEUE_SIZE', 256))
+        try:
+            stocks = Stock.objects.order_by('id').values_list('ticker', 'price')
+            if tickers and not all_tickers:
+                stocks = stocks.filter(ticker__in=tickers)
+            snapshot = [sse('price', {'ticker': ticker, 'price': from_micros(price)})
+                        async for ticker, price in stocks] if tickers else []
+        except BaseException:
+            broker.unsubscribe(subscriber)
+            raise
+        if not isinstance(request, ASGIRequest):
+            lifetime = 0
+
+        heartbeat = getattr(settings, 'STREAM_HEARTBEAT', 15.0)
+        response = StreamingHttpResponse(events(subscriber, snapshot, heartbeat, lifetime),
+                                         content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stops nginx from buffering the stream.
+        response['X-Accel-Buffering'] = 'no'
+        return response
@@ -1,11 +1,20 @@
+import copy
+import hashlib
+import threading
+import time
 import jwt
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from django.conf import settings
 from django.contrib.auth import authenticate
 from django.http import JsonResponse
 from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from functools import wraps
 
+from .metrics import add_phase
+
 SECRET_KEY = settings.SECRET_KEY
 ALGORITHM = 'HS256'
 
@@ -38,6 +47,94 @@ def decode_jwt(token):
         return None
 
 
+class TokenCache:
+    """
+    A bounded LRU cache of verified tokens, keyed by the SHA-256 digest of the
+    token. Each entry keeps the decoded payload and the loaded `User`, so a
+    repeated token skips both the signature check and the user query, and every
+    hit gets its own copy of the user with all its fields.
+
+    The cache lives in one process. Saving or deleting a user drops its tokens
+    in the process that made the change only, so entries also expire
+    `JWT_CACHE_TTL` seconds after they were stored, or with the token's own
+    `exp` claim if that comes first. That bounds how long another worker keeps
+    accepting the token of a deactivated or deleted user.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(token):
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token):
+        key = self.key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return entry[1], copy.copy(entry[2])
+
+    def set(self, token, payload, user):
+        expires_at = payload.get('exp')
+        if expires_at is None:
+            return
+        expires_at = min(expires_at, time.time() + getattr(settings, 'JWT_CACHE_TTL', 60))
+        key = self.key(token)
+        with self._lock:
+            self._entries[key] = (expires_at, payload, copy.copy(user))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_token(self, token):
+        with self._lock:
+            self._entries.pop(self.key(token), None)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry[2].id == user_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+token_cache = TokenCache(getattr(settings, 'JWT_CACHE_MAX_ENTRIES', 10000))
+
+
+""" Drops a token from the verification cache, e.g. on logout."""
+
+
+def revoke_token(token):
+    token_cache.invalidate_token(token)
+
+
+""" Drops every cached token of a user whenever the user is saved or deleted, in this process only."""
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_tokens(sender, instance, **kwargs):
+    token_cache.invalidate_user(instance.id)
+
+
 """ Authenticates the user and returns a JWT token if successful."""
 
 
@@ -49,30 +146,93 @@ def user_authentication(username, password):
     return None
 
 
+""" Reads the bearer token from the `Authorization` header or the `token` query param."""
+
+
+def get_request_token(request):
+    auth_header = request.headers.get('Authorization')
+
+    if auth_header and auth_header.startswith('Bearer '):
+        return auth_header.split(' ')[1]
+    return request.GET.get('token')
+
+
+""" Checks the request's token against the cache, then its signature."""
+
+
+def read_token(request):
+    """
+    Shared by `jwt_required` and `async_jwt_required`, which only differ in
+    how the user is loaded.
+
+    @:return : tuple of (token, payload, the cached `User` or None when it must be loaded),
+               or the `JsonResponse` to answer with
+    """
+    token = get_request_token(request)
+    if not token:
+        return JsonResponse({'error': 'Token missing'}, status=401)
+
+    if getattr(settings, 'JWT_CACHE_ENABLED', True):
+        cached = token_cache.get(token)
+        if cached is not None:
+            return token, cached[0], cached[1]
+
+    payload = decode_jwt(token)
+    if not payload:
+        return JsonResponse({'error': 'Invalid or expired token'}, status=401)
+    return token, payload, None
+
+
+def remember_token(token, payload, user):
+    if getattr(settings, 'JWT_CACHE_ENABLED', True) and user.is_active:
+        token_cache.set(token, payload, user)
+
+
 """ Creating a JWT decorator which will add on func to restrict the func for only authenticated users"""
 
 
 def jwt_required(view_func):
     @wraps(view_func)
     def wrapper(request, *args, **kwargs):
-        auth_header = request.headers.get('Authorization')
-
-        if auth_header and auth_header.startswith('Bearer '):
-            token = auth_header.split(' ')[1]
-        else:
-            token = request.GET.get('token')
-        if not token:
-            return JsonResponse({'error': 'Token missing'}, status=401)
-
-        payload = decode_jwt(token)
-        if not payload:
-            return JsonResponse({'error': 'Invalid or expired token'}, status=401)
-
-        try:
-            user = User.objects.get(id=payload['user_id'])
-            request.user = user
-        except User.DoesNotExist:
-            return JsonResponse({'error': 'User not found'}, status=404)
+        started = time.perf_counter()
+        checked = read_token(request)
+        if isinstance(checked, JsonResponse):
+            return checked
+
+        token, payload, user = checked
+        if user is None:
+            try:
+                user = User.objects.get(id=payload['user_id'])
+            except User.DoesNotExist:
+                return JsonResponse({'error': 'User not found'}, status=404)
+            remember_token(token, payload, user)
+        request.user = user
+        add_phase('auth', started)
         return view_func(request, *args, **kwargs)
 
     return wrapper
+
+
+""" The same JWT check as `jwt_required`, for async views. The user lookup uses the async ORM."""
+
+
+def async_jwt_required(view_func):
+    @wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        started = time.perf_counter()
+        checked = read_token(request)
+        if isinstance(checked, JsonResponse):
+            return checked
+
+        token, payload, user = checked
+        if user is None:
+            try:
+                user = await User.objects.aget(id=payload['user_id'])
+            except User.DoesNotExist:
+                return JsonResponse({'error': 'User not found'}, status=404)
+            remember_token(token, payload, user)
+        request.user = user
+        add_phase('auth', started)
+        return await view_func(request, *args, **kwargs)
+
+    return wrapper
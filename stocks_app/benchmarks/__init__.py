@@ -0,0 +1,11 @@
+"""
+End-to-end benchmarks of the stocks API.
+
+`seed` fills the database with synthetic users, stocks and transactions,
+`scenarios` describes one request to every endpoint of `stocks_app/urls.py`,
+`runner` drives them in process through the Django test client and `load`
+over HTTP from several processes, and `report` summarizes the timings and
+compares them with a stored JSON baseline. The `seed_benchmark` and
+`benchmark` management commands put them together; with `DB_SQLITE_PATH`
+set everything runs against a local SQLite file.
+"""
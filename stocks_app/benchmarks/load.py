@@ -0,0 +1,151 @@
+import asyncio
+import multiprocessing
+import re
+import time
+from urllib.parse import urlsplit
+from urllib.request import Request, urlopen
+
+from . import scenarios as scenario_module
+from .report import summarize
+
+# One series of the query histogram served at metrics/, e.g. `..._sum{route="stocks/",method="GET"} 12.0`.
+QUERY_SERIES = re.compile(r'^http_request_db_queries_(sum|count)\{route="([^"]*)",method="([^"]*)"\} (\S+)$')
+
+
+class Connection:
+    """ One keep-alive HTTP/1.1 connection that sends a request and reads the whole response, chunked or not."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, raw):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(raw)
+        await self.writer.drain()
+        head = (await self.reader.readuntil(b'\r\n\r\n')).decode('latin-1').lower()
+        status_code = int(head.split(' ', 2)[1])
+        length, chunked = 0, False
+        for line in head.split('\r\n'):
+            if line.startswith('content-length:'):
+                length = int(line.split(':', 1)[1])
+            elif line.startswith('transfer-encoding:') and 'chunked' in line:
+                chunked = True
+        if chunked:
+            while True:
+                size = int((await self.reader.readuntil(b'\r\n')).split(b';')[0], 16)
+                await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        else:
+            await self.reader.readexactly(length)
+        if 'connection: close' in head:
+            self.close()
+        return status_code
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+def raw_request(scenario, n, netloc, token):
+    path, body = scenario.request(n)
+    head = (f'{scenario.method} {path} HTTP/1.1\r\nHost: {netloc}\r\n'
+            f'Authorization: Bearer {token}\r\nConnection: keep-alive\r\n')
+    if body is not None:
+        head += f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n'
+    return (head + '\r\n').encode() + (body or b'')
+
+
+async def drive(scenario, url, token, connections, duration, offset):
+    """ Keeps `connections` connections busy with the scenario for `duration` seconds."""
+    parts = urlsplit(url)
+    latencies, errors = [], 0
+    counter = iter(range(offset, offset + 10 ** 9))
+    deadline = time.perf_counter() + duration
+
+    async def loop():
+        nonlocal errors
+        connection = Connection(parts.hostname, parts.port or 80)
+        while time.perf_counter() < deadline:
+            raw = raw_request(scenario, next(counter), parts.netloc, token)
+            started = time.perf_counter()
+            try:
+                status_code = await connection.request(raw)
+            except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                errors += 1
+                connection.close()
+                await asyncio.sleep(0.01)
+                continue
+            latencies.append(time.perf_counter() - started)
+            errors += status_code >= 400
+        connection.close()
+
+    await asyncio.gather(*[loop() for _ in range(connections)])
+    return latencies, errors
+
+
+""" The body of one load generator process; module level so it can be started with spawn."""
+
+
+def worker(arguments):
+    context, salt, name, url, token, connections, duration, offset = arguments
+    [scenario] = scenario_module.select(scenario_module.build(context, salt), [name])
+    return asyncio.run(drive(scenario, url, token, connections, duration, offset))
+
+
+""" Reads the per-route query totals from the server's metrics/ endpoint; empty if it cannot be read."""
+
+
+def scrape_queries(url):
+    try:
+        with urlopen(Request(url.rstrip('/') + '/metrics/'), timeout=10) as response:
+            text = response.read().decode()
+    except OSError:
+        return {}
+    totals = {}
+    for line in text.splitlines():
+        match = QUERY_SERIES.match(line)
+        if match:
+            kind, route, method, value = match.groups()
+            totals.setdefault((route, method), {})[kind] = float(value)
+    return totals
+
+
+def run_http(scenarios, context, url, token, processes=4, connections=8, duration=10.0, salt=''):
+    """
+    Loads a running server with every scenario in turn, from `processes`
+    processes holding `connections` keep-alive connections each, so the
+    client is not the bottleneck on a multi-core machine. Queries per request
+    come from the difference of the server's `metrics/` histograms before
+    and after each scenario; they are exact only when one server process
+    answers, since every process keeps its own histograms.
+
+    @:param url : base URL of the server, e.g. http://127.0.0.1:8000
+    @:return : dict of scenario name to `report.summarize` output
+    """
+    summaries = {}
+    spawn = multiprocessing.get_context('spawn')
+    with spawn.Pool(processes) as pool:
+        for scenario in scenarios:
+            before = scrape_queries(url)
+            parts = pool.map(worker, [
+                (context, f'{salt}p{index}', scenario.name, url, token, connections, duration, index * 10 ** 9)
+                for index in range(processes)
+            ])
+            after = scrape_queries(url)
+            latencies = [latency for part, _ in parts for latency in part]
+            errors = sum(part_errors for _, part_errors in parts)
+
+            queries = None
+            key = (scenario.route, scenario.method)
+            if key in after:
+                old = before.get(key, {})
+                counted = after[key].get('count', 0) - old.get('count', 0)
+                if counted:
+                    queries = (after[key].get('sum', 0) - old.get('sum', 0)) * len(latencies) / counted
+            summaries[scenario.name] = summarize(latencies, duration, queries, errors)
+    return summaries
@@ -0,0 +1,108 @@
+import json
+import platform
+import time
+
+# Keys of a scenario summary compared with the baseline, and whether a higher value is better.
+COMPARED = {
+    'throughput': True,
+    'p50_ms': False,
+    'p95_ms': False,
+    'p99_ms': False,
+    'queries_per_request': False,
+}
+
+
+""" The p-quantile of already sorted latencies, in milliseconds, the same way `loadtest` reports it."""
+
+
+def percentile(latencies, p):
+    if not latencies:
+        return None
+    return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 3)
+
+
+def summarize(latencies, elapsed, queries=None, errors=0):
+    """
+    Reduces the raw timings of one scenario to the numbers that are stored
+    and compared.
+
+    @:param latencies : seconds per completed request
+    @:param elapsed : wall time of the whole run, in seconds
+    @:param queries : total queries run by the requests, or None when unknown
+    @:param errors : requests that failed or answered with a 4xx or 5xx status
+    """
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        'requests': count,
+        'errors': errors,
+        'throughput': round(count / elapsed, 2) if elapsed else None,
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'queries_per_request': round(queries / count, 2) if queries is not None and count else None,
+    }
+
+
+""" Wraps the summaries of a run with what is needed to judge whether two runs are comparable."""
+
+
+def results(mode, summaries, **details):
+    return {
+        'mode': mode,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        **details,
+        'scenarios': summaries,
+    }
+
+
+def compare(current, baseline, tolerance=0.2):
+    """
+    Lists the numbers of `current` that are worse than `baseline` by more
+    than `tolerance` (0.2 is 20%). Queries per request are compared exactly,
+    since they do not depend on the machine. Scenarios missing from either
+    run are skipped.
+
+    @:return : list of (scenario, key, baseline value, current value)
+    """
+    regressions = []
+    for name, summary in current['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if before is None:
+            continue
+        for key, higher_is_better in COMPARED.items():
+            old, new = before.get(key), summary.get(key)
+            if old is None or new is None:
+                continue
+            if key == 'queries_per_request':
+                worse = new > old
+            elif higher_is_better:
+                worse = new < old * (1 - tolerance)
+            else:
+                worse = new > old * (1 + tolerance)
+            if worse:
+                regressions.append((name, key, old, new))
+    return regressions
+
+
+def format_table(current):
+    lines = [f'{"scenario":<24} {"req/s":>9} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"queries":>7} {"errors":>6}']
+    for name, summary in current['scenarios'].items():
+        cells = [summary.get(key) for key in ('throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request')]
+        cells = ['-' if cell is None else f'{cell:,.1f}' for cell in cells]
+        lines.append(f'{name:<24} {cells[0]:>9} {cells[1]:>8} {cells[2]:>8} {cells[3]:>8} {cells[4]:>7} '
+                     f'{summary["errors"]:>6}')
+    return '\n'.join(lines)
+
+
+def save(current, path):
+    with open(path, 'w') as output:
+        json.dump(current, output, indent=2, sort_keys=True)
+        output.write('\n')
+
+
+def load(path):
+    with open(path) as source:
+        return json.load(source)
@@ -0,0 +1,61 @@
+import math
+import time
+
+from asgiref.sync import async_to_sync
+from django.test import Client, override_settings
+
+from stocks_app.authentication import generate_jwt
+from stocks_app.querybudget import query_budget
+
+from .report import summarize
+
+
+def run_client(scenarios, auth_user, requests=50, warmup=1):
+    """
+    Sends `requests` requests of every scenario through the Django test
+    client, one at a time, after `warmup` untimed ones. This measures the
+    whole Django stack and the database without a server or network, and
+    counts the queries of every request.
+
+    @:return : dict of scenario name to `report.summarize` output
+    """
+    client = Client(HTTP_AUTHORIZATION=f'Bearer {generate_jwt(auth_user)}')
+    summaries = {}
+    # No N+1 call-site capture: it walks the stack on every query and would dominate the timings.
+    with override_settings(ALLOWED_HOSTS=['*'], QUERY_N_PLUS_ONE_THRESHOLD=None):
+        for scenario in scenarios:
+            for n in range(warmup):
+                send(client, scenario, -1 - n)
+            latencies, queries, errors = [], 0, 0
+            started = time.perf_counter()
+            for n in range(requests):
+                with query_budget(math.inf) as budget:
+                    begun = time.perf_counter()
+                    status_code = send(client, scenario, n)
+                    latencies.append(time.perf_counter() - begun)
+                queries += budget.count
+                errors += status_code >= 400
+            summaries[scenario.name] = summarize(latencies, time.perf_counter() - started, queries, errors)
+    return summaries
+
+
+""" Sends the n-th request of a scenario and reads the whole body, streamed or not; returns the status code."""
+
+
+def send(client, scenario, n):
+    path, body = scenario.request(n)
+    if scenario.method == 'GET':
+        response = client.get(path)
+    else:
+        response = client.generic(scenario.method, path, body, content_type='application/json')
+    if response.streaming and response.is_async:
+        async_to_sync(drain)(response.streaming_content)
+    elif response.streaming:
+        for _ in response.streaming_content:
+            pass
+    return response.status_code
+
+
+async def drain(chunks):
+    async for _ in chunks:
+        pass
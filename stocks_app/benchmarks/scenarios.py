@@ -0,0 +1,105 @@
+import json
+from datetime import date, timedelta
+
+# Orders sent in one request by the bulk order scenario.
+BULK_ORDERS = 10
+
+
+class Scenario:
+    """
+    One kind of request to one route of `stocks_app/urls.py`. The n-th
+    request of a scenario is built by `request(n)`, so every request can
+    carry a different user, stock or a fresh username while the whole run
+    stays reproducible. Scenarios are plain data built from a context dict,
+    so load generator processes rebuild them without Django.
+    """
+
+    def __init__(self, name, route, method='GET', path=None, body=None):
+        self.name = name
+        self.route = route
+        self.method = method
+        self._path = path or (lambda n: '/' + route)
+        self._body = body
+
+    def request(self, n):
+        """ Returns the path, with any query string, and the JSON body or None for the n-th request."""
+        body = self._body(n) if self._body is not None else None
+        return self._path(n), (json.dumps(body).encode() if body is not None else None)
+
+
+def build(context, salt=''):
+    """
+    Returns one scenario per endpoint, plus an export of the history, for the
+    data described by `context` (see `seed.benchmark_context`). `salt` keeps
+    the users and stocks created by parallel runs from colliding.
+    """
+    usernames, user_ids, tickers, stock_ids = (
+        context['usernames'], context['user_ids'], context['tickers'], context['stock_ids']
+    )
+    prefix, ticker_prefix = context['user_prefix'], context['ticker_prefix']
+    today = date.fromisoformat(context['today'])
+    month = f'start={today - timedelta(days=30)}&end={today}'
+    week = f'start={today - timedelta(days=7)}&end={today}'
+
+    def user(n):
+        return usernames[n % len(usernames)]
+
+    def order(n):
+        return {'user': user_ids[n % len(user_ids)], 'ticker': stock_ids[n % len(stock_ids)],
+                'transaction_type': 'buy', 'transaction_volume': 1}
+
+    return [
+        Scenario('register', 'register/', 'POST',
+                 body=lambda n: {'username': f'{context["auth_username"]}-{salt}-{n}',
+                                 'password': context['password']}),
+        Scenario('login', 'login/', 'POST',
+                 body=lambda n: {'username': context['auth_username'], 'password': context['password']}),
+        Scenario('add user', 'add-user/', 'POST',
+                 body=lambda n: {'username': f'{prefix}new-{salt}-{n}', 'balance': '100.00'}),
+        Scenario('user', 'user/<str:username>/', path=lambda n: f'/user/{user(n)}/'),
+        Scenario('add stock', 'add-stock/', 'POST',
+                 body=lambda n: {'ticker': f'{ticker_prefix}-{salt}-{n}', 'price': '10.00'}),
+        Scenario('stock', 'stock/<str:ticker>/', path=lambda n: f'/stock/{tickers[n % len(tickers)]}/'),
+        Scenario('stocks', 'stocks/'),
+        Scenario('add transaction', 'add-transaction/', 'POST', body=order),
+        Scenario('add transactions bulk', 'add-transactions/bulk/', 'POST',
+                 body=lambda n: [order(n * BULK_ORDERS + i) for i in range(BULK_ORDERS)]),
+        Scenario('transactions by date', 'transactions/<str:username>/<str:start_time>/<str:end_time>/',
+                 path=lambda n: f'/transactions/{user(n)}/{today - timedelta(days=30)}/{today}/'),
+        Scenario('transactions', 'transactions/<str:username>/', path=lambda n: f'/transactions/{user(n)}/'),
+        Scenario('transactions export', 'transactions/<str:username>/',
+                 path=lambda n: f'/transactions/{user(n)}/?export=ndjson'),
+        Scenario('positions', 'positions/<str:username>/', path=lambda n: f'/positions/{user(n)}/'),
+        Scenario('analytics', 'analytics/<str:username>/', path=lambda n: f'/analytics/{user(n)}/'),
+        Scenario('ticker summary', 'summary/tickers/', path=lambda n: f'/summary/tickers/?{week}'),
+        Scenario('user cash flow', 'summary/users/', path=lambda n: f'/summary/users/?{month}'),
+        # Limit buys far below the market, so they rest and can be cancelled by id.
+        Scenario('place order', 'orders/', 'POST', body=lambda n: {**order(n), 'price': '0.01'}),
+        Scenario('cancel order', 'orders/<int:order_id>/cancel/', 'POST', path=lambda n: f'/orders/{n + 1}/cancel/'),
+        Scenario('sequencer', 'sequencer/'),
+        Scenario('db connections', 'db-connections/'),
+        Scenario('metrics', 'metrics/'),
+        Scenario('async user', 'async/user/<str:username>/', path=lambda n: f'/async/user/{user(n)}/'),
+        Scenario('async stock', 'async/stock/<str:ticker>/',
+                 path=lambda n: f'/async/stock/{tickers[n % len(tickers)]}/'),
+        Scenario('async stocks', 'async/stocks/'),
+        Scenario('async add transaction', 'async/add-transaction/', 'POST', body=order),
+        Scenario('async transactions', 'async/transactions/<str:username>/',
+                 path=lambda n: f'/async/transactions/{user(n)}/'),
+        # Connect, read the current prices and disconnect, the cost of a reconnecting client.
+        Scenario('stream', 'async/stream/',
+                 path=lambda n: f'/async/stream/?tickers={",".join(tickers[:10])}&username={user(n)}&timeout=0'),
+    ]
+
+
+""" The scenarios of `build` named in `names`, or all of them when `names` is empty."""
+
+
+def select(scenarios, names=None):
+    if not names:
+        return scenarios
+    known = {scenario.name for scenario in scenarios}
+    unknown = set(names) - known
+    if unknown:
+        raise ValueError(f'Unknown scenarios: {", ".join(sorted(unknown))}. Known: {", ".join(sorted(known))}.')
+    return [scenario for scenario in scenarios if scenario.name in names]
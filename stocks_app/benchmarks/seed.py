@@ -0,0 +1,139 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from stocks_app.imports import insert_transactions
+from stocks_app.models import users, Stock, Transaction, Position
+from stocks_app.money import to_micros
+from stocks_app.prices import price_cache, stocks_version
+
+USER_PREFIX = 'bench-user-'
+TICKER_PREFIX = 'BENCH'
+AUTH_USERNAME = 'bench'
+AUTH_PASSWORD = 'bench-password'
+STARTING_BALANCE = to_micros(10000)
+
+
+""" The username of the n-th synthetic user."""
+
+
+def username(n):
+    return f'{USER_PREFIX}{n}'
+
+
+""" The ticker of the n-th synthetic stock."""
+
+
+def ticker(n):
+    return f'{TICKER_PREFIX}{n:05d}'
+
+
+""" Deletes every synthetic row, and the auth users made by the seed and by the register scenario."""
+
+
+def clear():
+    Transaction.objects.filter(user__username__startswith=USER_PREFIX).delete()
+    Position.objects.filter(user__username__startswith=USER_PREFIX).delete()
+    users.objects.filter(username__startswith=USER_PREFIX).delete()
+    Stock.objects.filter(ticker__startswith=TICKER_PREFIX).delete()
+    User.objects.filter(username=AUTH_USERNAME).delete()
+    User.objects.filter(username__startswith=f'{AUTH_USERNAME}-').delete()
+
+
+def seed(user_count=1000, stock_count=100, transaction_count=100000, days=365, batch_size=10000,
+         random_seed=0, progress=None):
+    """
+    Creates `user_count` users, `stock_count` stocks and `transaction_count`
+    trades spread evenly over the last `days` days, in time order so ids and
+    timestamps agree like they do for real orders. Trades are generated and
+    inserted one batch at a time with `insert_transactions`, so 10^7 rows
+    need no more memory than one batch plus one position per (user, stock)
+    pair. Sells never exceed the shares held, and balances and positions are
+    written to match the ledger, so the order endpoints can trade on the
+    seeded accounts. The same `random_seed` always produces the same data.
+
+    @:param progress : optional callable, called with the number of trades inserted so far
+    @:return : the benchmark auth `User`, able to log in with `AUTH_PASSWORD`
+    """
+    rng = random.Random(random_seed)
+    auth_user = User.objects.create(username=AUTH_USERNAME, password=make_password(AUTH_PASSWORD))
+    user_ids = [user.id for user in users.objects.bulk_create(
+        [users(username=username(n), balance=0) for n in range(user_count)], batch_size=batch_size
+    )]
+    stocks = Stock.objects.bulk_create(
+        [Stock(ticker=ticker(n), price=to_micros(rng.randint(1, 500))) for n in range(stock_count)],
+        batch_size=batch_size,
+    )
+    prices = {stock.id: stock.price for stock in stocks}
+    stock_ids = list(prices)
+
+    positions = {}
+    cash = dict.fromkeys(user_ids, 0)
+    lowest = dict.fromkeys(user_ids, 0)
+    end = timezone.now()
+    step = timedelta(days=days) / max(transaction_count, 1)
+    created_at = end - timedelta(days=days)
+
+    inserted = 0
+    while inserted < transaction_count:
+        batch = []
+        for _ in range(min(batch_size, transaction_count - inserted)):
+            user_id, stock_id = rng.choice(user_ids), rng.choice(stock_ids)
+            position = positions.get((user_id, stock_id))
+            if position is None:
+                position = positions[(user_id, stock_id)] = Position(user_id=user_id, stock_id=stock_id)
+            volume = rng.randint(1, 100)
+            side = Transaction.SELL if position.quantity >= volume and rng.random() < 0.4 else Transaction.BUY
+            price = prices[stock_id] * volume
+            position.apply(side, volume, price)
+            cash[user_id] += price if side == Transaction.SELL else -price
+            lowest[user_id] = min(lowest[user_id], cash[user_id])
+            created_at += step
+            batch.append((user_id, stock_id, side, volume, price, created_at))
+        with transaction.atomic():
+            insert_transactions(batch)
+        inserted += len(batch)
+        if progress is not None:
+            progress(inserted)
+
+    with transaction.atomic():
+        Position.objects.bulk_create([p for p in positions.values() if p.quantity], batch_size=batch_size)
+        # Every account starts with just enough to never go below zero, plus STARTING_BALANCE to trade with.
+        accounts = [users(id=user_id, balance=STARTING_BALANCE - lowest[user_id] + cash[user_id])
+                    for user_id in user_ids]
+        users.objects.bulk_update(accounts, ['balance'], batch_size=batch_size)
+
+    # bulk_create sends no signals, so drop what the price cache may hold.
+    price_cache.clear()
+    stocks_version.bump()
+    return auth_user
+
+
+def benchmark_context(sample=100):
+    """
+    Describes the seeded data for `scenarios.build`: the first `sample`
+    users and stocks to spread requests over, and the auth credentials.
+
+    @:return : a dict of plain values, so it can be sent to load generator processes
+    """
+    sampled_users = list(users.objects.filter(username__startswith=USER_PREFIX)
+                         .order_by('id').values_list('id', 'username')[:sample])
+    sampled_stocks = list(Stock.objects.filter(ticker__startswith=TICKER_PREFIX)
+                          .order_by('id').values_list('id', 'ticker')[:sample])
+    if not sampled_users or not sampled_stocks or not User.objects.filter(username=AUTH_USERNAME).exists():
+        raise LookupError('No benchmark data; run the seed_benchmark command first.')
+    return {
+        'user_ids': [pk for pk, _ in sampled_users],
+        'usernames': [name for _, name in sampled_users],
+        'stock_ids': [pk for pk, _ in sampled_stocks],
+        'tickers': [name for _, name in sampled_stocks],
+        'auth_username': AUTH_USERNAME,
+        'password': AUTH_PASSWORD,
+        'user_prefix': USER_PREFIX,
+        'ticker_prefix': TICKER_PREFIX,
+        'today': timezone.localdate().isoformat(),
+    }
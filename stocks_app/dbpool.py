@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import deque
+from functools import wraps
+
+from django.db import connections
+from django.db.backends.base.base import BaseDatabaseWrapper
+
+
+class ConnectionStats:
+    """
+    Times every database connection the app opens, per alias. Without a pool
+    this is the full connect cost (TCP, TLS, authentication); with the psycopg
+    pool it is the time spent waiting for a free pooled connection. The last
+    `samples` timings of each alias are kept for percentiles.
+    """
+
+    def __init__(self, samples=1024):
+        self.samples = samples
+        self._waits = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, alias, seconds):
+        with self._lock:
+            waits = self._waits.get(alias)
+            if waits is None:
+                waits = self._waits[alias] = deque(maxlen=self.samples)
+            waits.append(seconds)
+            self._counts[alias] = self._counts.get(alias, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._waits.clear()
+            self._counts.clear()
+
+    def percentile(self, waits, p):
+        return waits[min(len(waits) - 1, int(len(waits) * p))] * 1000 if waits else None
+
+    def stats(self):
+        """
+        @:return : dict of alias to its connection settings, the number of
+                   connections opened, p50/p99/max wait in ms over the recent
+                   samples and, when the alias is pooled, psycopg's own pool counters
+        """
+        with self._lock:
+            recorded = {alias: (self._counts[alias], sorted(waits)) for alias, waits in self._waits.items()}
+        result = {}
+        for alias in connections:
+            settings_dict = connections.settings[alias]
+            opened, waits = recorded.get(alias, (0, []))
+            entry = {
+                'conn_max_age': settings_dict.get('CONN_MAX_AGE'),
+                'conn_health_checks': settings_dict.get('CONN_HEALTH_CHECKS'),
+                'pool': settings_dict.get('OPTIONS', {}).get('pool') or None,
+                'connections_opened': opened,
+                'wait_ms_p50': self.percentile(waits, 0.5),
+                'wait_ms_p99': self.percentile(waits, 0.99),
+                'wait_ms_max': waits[-1] * 1000 if waits else None,
+            }
+            pool = getattr(connections[alias], 'pool', None) if entry['pool'] else None
+            if pool is not None:
+                entry['pool_stats'] = pool.get_stats()
+            result[alias] = entry
+        return result
+
+
+connection_stats = ConnectionStats()
+
+
+""" Wraps `BaseDatabaseWrapper.connect` once so every backend reports its connect time."""
+
+
+def install():
+    connect = BaseDatabaseWrapper.connect
+    if getattr(connect, 'timed', False):
+        return
+
+    @wraps(connect)
+    def timed_connect(self):
+        start = time.perf_counter()
+        try:
+            return connect(self)
+        finally:
+            connection_stats.record(self.alias, time.perf_counter() - start)
+
+    timed_connect.timed = True
+    BaseDatabaseWrapper.connect = timed_connect
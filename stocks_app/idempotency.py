@@ -0,0 +1,241 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import JsonResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyError(Exception):
+    """ Raised when a key cannot be used for this request. Carries the HTTP status to answer with."""
+
+    def __init__(self, message, status_code=status.HTTP_409_CONFLICT):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class IdempotencyStore:
+    """
+    Remembers the response to every request sent with an `Idempotency-Key`
+    header so a retry is answered without running the order again.
+
+    Finished responses live in the `IdempotencyKey` table, unique per user and
+    key, with a bounded in-process LRU in front, so a retry of a recent key
+    costs one dict lookup. A new key is claimed by inserting its row before the
+    order runs. A concurrent duplicate in the same process waits on the first
+    request's event; one in another process finds the unfinished row and polls
+    it until the response is stored or `IDEMPOTENCY_WAIT_TIMEOUT` passes.
+
+    Keys expire `IDEMPOTENCY_KEY_TTL` seconds after first use. Responses with a
+    5xx status are not stored, so the client can retry them.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._running = {}
+        self._lock = threading.Lock()
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60)
+
+    def cached(self, ident, request_hash):
+        with self._lock:
+            entry = self._entries.get(ident)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._entries[ident]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(ident)
+            self.hits += 1
+        if entry[1] != request_hash:
+            raise IdempotencyError("This Idempotency-Key was used with a different request.",
+                                   status.HTTP_422_UNPROCESSABLE_ENTITY)
+        return entry[2], entry[3]
+
+    def remember(self, ident, request_hash, status_code, body, created_at):
+        with self._lock:
+            self._entries[ident] = (created_at.timestamp() + self.ttl, request_hash, status_code, body)
+            self._entries.move_to_end(ident)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def begin(self, owner_id, key, request_hash):
+        """
+        Either returns the stored `(status_code, body)` of an earlier request
+        with this key, or claims the key and returns None; the caller must then
+        run the request and pass its response to `finish`.
+        """
+        ident = (owner_id, key)
+        deadline = time.monotonic() + getattr(settings, 'IDEMPOTENCY_WAIT_TIMEOUT', 10.0)
+        while True:
+            stored = self.cached(ident, request_hash)
+            if stored is not None:
+                return stored
+            with self._lock:
+                running = self._running.get(ident)
+                if running is None:
+                    self._running[ident] = threading.Event()
+                    break
+            if not running.wait(deadline - time.monotonic()):
+                raise IdempotencyError("A request with this Idempotency-Key is still being processed.")
+
+        try:
+            stored = self.claim(ident, request_hash, deadline)
+        except BaseException:
+            self.release(ident)
+            raise
+        if stored is not None:
+            self.release(ident)
+        return stored
+
+    def claim(self, ident, request_hash, deadline):
+        owner_id, key = ident
+        while True:
+            try:
+                with transaction.atomic():
+                    IdempotencyKey.objects.create(owner_id=owner_id, key=key, request_hash=request_hash)
+                return None
+            except IntegrityError:
+                pass
+
+            row = IdempotencyKey.objects.filter(owner_id=owner_id, key=key).first()
+            if row is None:
+                continue
+            if row.created_at <= timezone.now() - timedelta(seconds=self.ttl):
+                IdempotencyKey.objects.filter(pk=row.pk, created_at=row.created_at).delete()
+                continue
+            if row.request_hash != request_hash:
+                raise IdempotencyError("This Idempotency-Key was used with a different request.",
+                                       status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if row.status_code is not None:
+                self.remember(ident, request_hash, row.status_code, row.response, row.created_at)
+                return row.status_code, row.response
+            if time.monotonic() >= deadline:
+                raise IdempotencyError("A request with this Idempotency-Key is still being processed.")
+            time.sleep(0.01)
+
+    def finish(self, owner_id, key, request_hash, status_code, body):
+        """ Stores the response of a claimed key, or drops the claim for a 5xx response."""
+        ident = (owner_id, key)
+        try:
+            claimed = IdempotencyKey.objects.filter(owner_id=owner_id, key=key)
+            if status_code >= 500:
+                claimed.delete()
+                return
+            claimed.update(status_code=status_code, response=body)
+            self.remember(ident, request_hash, status_code, body, timezone.now())
+        finally:
+            self.release(ident)
+
+    def release(self, ident):
+        with self._lock:
+            running = self._running.pop(ident, None)
+        if running is not None:
+            running.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries),
+                'running': len(self._running)}
+
+
+idempotency_store = IdempotencyStore(getattr(settings, 'IDEMPOTENCY_CACHE_MAX_ENTRIES', 10000))
+
+
+def read_key(request):
+    """ Returns the `Idempotency-Key` header and the digest of the request body, or raises for a bad key."""
+    key = request.headers.get('Idempotency-Key')
+    if key is None:
+        return None, None
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise IdempotencyError(f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters.",
+                               status.HTTP_400_BAD_REQUEST)
+    return key, hashlib.sha256(request.body).hexdigest()
+
+
+def response_body(response):
+    data = getattr(response, 'data', None)
+    return data if data is not None else json.loads(response.content or b'null')
+
+
+""" Makes a DRF view replay the stored response for a repeated `Idempotency-Key`."""
+
+
+def idempotent(view_func):
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        try:
+            key, request_hash = read_key(request)
+            if key is None:
+                return view_func(request, *args, **kwargs)
+            stored = idempotency_store.begin(request.user.id, key, request_hash)
+        except IdempotencyError as e:
+            return Response({"error": e.message}, status=e.status_code)
+        if stored is not None:
+            return Response(stored[1], status=stored[0], headers={'Idempotent-Replayed': 'true'})
+
+        try:
+            response = view_func(request, *args, **kwargs)
+        except BaseException:
+            idempotency_store.finish(request.user.id, key, request_hash, status.HTTP_500_INTERNAL_SERVER_ERROR, None)
+            raise
+        idempotency_store.finish(request.user.id, key, request_hash, response.status_code, response_body(response))
+        return response
+
+    return wrapper
+
+
+""" The same as `idempotent`, for async views. Waiting on a duplicate happens off the event loop."""
+
+
+def async_idempotent(view_func):
+    begin = sync_to_async(idempotency_store.begin)
+    finish = sync_to_async(idempotency_store.finish)
+
+    @wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            key, request_hash = read_key(request)
+            if key is None:
+                return await view_func(request, *args, **kwargs)
+            stored = await begin(request.user.id, key, request_hash)
+        except IdempotencyError as e:
+            return JsonResponse({"error": e.message}, status=e.status_code)
+        if stored is not None:
+            response = JsonResponse(stored[1], safe=False, status=stored[0])
+            response['Idempotent-Replayed'] = 'true'
+            return response
+
+        try:
+            response = await view_func(request, *args, **kwargs)
+        except BaseException:
+            await finish(request.user.id, key, request_hash, status.HTTP_500_INTERNAL_SERVER_ERROR, None)
+            raise
+        await finish(request.user.id, key, request_hash, response.status_code, response_body(response))
+        return response
+
+    return wrapper
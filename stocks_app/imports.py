@@ -0,0 +1,276 @@
+import csv
+import gzip
+import io
+import json
+import sys
+from collections import defaultdict
+from datetime import datetime
+from itertools import islice
+
+from django.db import connection
+from django.db.models import BigIntegerField, Case, F, Value, When
+from django.utils import timezone
+
+from .models import users, Stock, Transaction
+from .money import MAX_MICROS, to_micros
+from .orders import MAX_ORDER_VOLUME
+from .prices import price_cache, stocks_version
+
+FORMATS = ('csv', 'ndjson')
+
+# Columns written by `insert_transactions`, in order.
+TRANSACTION_COLUMNS = ['user', 'ticker', 'transaction_type', 'transaction_volume', 'transaction_price', 'created_at']
+
+
+""" The format of a source from its name, e.g. `fills.ndjson.gz`, unless one is given."""
+
+
+def source_format(path, explicit=None):
+    if explicit:
+        return explicit
+    name = path[:-3] if path.endswith('.gz') else path
+    for fmt in FORMATS:
+        if name.endswith(f'.{fmt}'):
+            return fmt
+    if name.endswith('.jsonl') or name.endswith('.json'):
+        return 'ndjson'
+    raise ValueError(f'Cannot tell the format of {path!r}; pass --format csv or --format ndjson.')
+
+
+""" Opens a source for reading as text: a file, a gzip file, or stdin for '-'."""
+
+
+def open_source(path):
+    if path == '-':
+        return io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='')
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, encoding='utf-8', newline='')
+
+
+def read_rows(source, fmt):
+    """
+    Yields the records of a CSV file with a header row, or of an NDJSON file,
+    one at a time, as (line number, dict). Blank NDJSON lines are skipped and
+    an unparsable one is yielded with `None` in place of the dict.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(source)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for number, line in enumerate(source, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield number, row if isinstance(row, dict) else None
+
+
+""" Splits an iterable into lists of at most `size` items."""
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+""" Reads an ISO 8601 timestamp; naive ones are taken in the current time zone."""
+
+
+def parse_timestamp(value):
+    moment = datetime.fromisoformat(value)
+    return timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+
+
+def insert_transactions(rows):
+    """
+    Inserts ledger rows given as tuples in `TRANSACTION_COLUMNS` order, with
+    money already in micro-units. On PostgreSQL the rows are sent with one
+    `COPY ... FROM STDIN`; elsewhere with one `executemany`. Both skip the
+    model instances and the per-statement parameter limit of `bulk_create`.
+    No signals are sent and no balances or positions are changed.
+    """
+    if not rows:
+        return
+    fields = [Transaction._meta.get_field(name) for name in TRANSACTION_COLUMNS]
+    table = connection.ops.quote_name(Transaction._meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for row in rows:
+                writer.writerow(row[:5] + (row[5].isoformat(),))
+            sql = f'COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)'
+            raw = cursor.cursor
+            if hasattr(raw, 'copy'):
+                # psycopg 3
+                with raw.copy(sql) as copy:
+                    copy.write(buffer.getvalue())
+            else:
+                buffer.seek(0)
+                raw.copy_expert(sql, buffer)
+            return
+        adapt = connection.ops.adapt_datetimefield_value
+        cursor.executemany(f'INSERT INTO {table} ({columns}) VALUES ({", ".join(["%s"] * len(fields))})',
+                           [row[:5] + (adapt(row[5]),) for row in rows])
+
+
+""" Adds a delta to the balance of every user in `deltas`, with one UPDATE per `batch_size` users."""
+
+
+def apply_balance_deltas(deltas, batch_size=500):
+    pending = [(user_id, delta) for user_id, delta in deltas.items() if delta]
+    for batch in chunked(pending, batch_size):
+        users.objects.filter(pk__in=[user_id for user_id, _ in batch]).update(balance=Case(
+            *[When(pk=user_id, then=F('balance') + Value(delta)) for user_id, delta in batch],
+            default=F('balance'),
+            output_field=BigIntegerField(),
+        ))
+    return len(pending)
+
+
+class StockImporter:
+    """
+    Loads a stock universe from records with `ticker` and `price` (in whole
+    units). A chunk is inserted with one `bulk_create`; tickers that already
+    exist get the new price in the same statement when `update` is set and
+    are left alone otherwise. The price cache is cleared at the end, since
+    bulk writes send no signals.
+    """
+
+    def __init__(self, update=True):
+        self.update = update
+        self.imported = 0
+        self.errors = []
+
+    def clean(self, chunk):
+        stocks = {}
+        for number, row in chunk:
+            if row is None:
+                self.errors.append((number, 'Not a JSON object.'))
+                continue
+            ticker = (row.get('ticker') or '').strip()
+            if not ticker or len(ticker) > Stock._meta.get_field('ticker').max_length:
+                self.errors.append((number, f'Invalid ticker {ticker!r}.'))
+                continue
+            try:
+                price = to_micros(row.get('price'))
+            except ValueError as e:
+                self.errors.append((number, str(e)))
+                continue
+            if not 0 <= price <= MAX_MICROS:
+                self.errors.append((number, 'Price must not be negative or too large.'))
+                continue
+            # The last row of a ticker within a chunk wins, as it would across chunks.
+            stocks[ticker] = Stock(ticker=ticker, price=price)
+        return list(stocks.values())
+
+    def import_chunk(self, chunk):
+        stocks = self.clean(chunk)
+        if self.update:
+            Stock.objects.bulk_create(stocks, update_conflicts=True, unique_fields=['ticker'], update_fields=['price'])
+        else:
+            Stock.objects.bulk_create(stocks, ignore_conflicts=True)
+        self.imported += len(stocks)
+
+    def finish(self):
+        price_cache.clear()
+        stocks_version.bump()
+
+
+class LedgerImporter:
+    """
+    Loads historical fills from records with `user`, `ticker`,
+    `transaction_type`, `transaction_volume`, and optionally
+    `transaction_price` (the total in whole units, the stock's current price
+    times the volume when missing) and `created_at` (ISO 8601, the start of
+    the import when missing). `user` and `ticker` are a username and a ticker
+    symbol, or primary keys with `by_id`, as in the history export.
+
+    Usernames and tickers are resolved with one query per chunk for the ones
+    not seen before and kept in dictionaries, so memory grows with the number
+    of distinct users and stocks, never with the number of rows. The balance
+    change of every user is summed while streaming and written at the end by
+    `finish`.
+    """
+
+    def __init__(self, by_id=False):
+        self.by_id = by_id
+        self.user_ids = {}
+        self.stocks = {}
+        self.deltas = defaultdict(int)
+        self.imported = 0
+        self.errors = []
+        self.now = timezone.now()
+
+    def resolve(self, chunk):
+        wanted_users = {str(row.get('user')) for _, row in chunk if row} - self.user_ids.keys()
+        wanted_stocks = {str(row.get('ticker')) for _, row in chunk if row} - self.stocks.keys()
+        if self.by_id:
+            wanted_users = [key for key in wanted_users if key.isdigit()]
+            wanted_stocks = [key for key in wanted_stocks if key.isdigit()]
+            self.user_ids.update((str(pk), pk) for pk in users.objects.filter(pk__in=wanted_users)
+                                 .values_list('id', flat=True))
+            self.stocks.update((str(pk), (pk, price)) for pk, price in Stock.objects.filter(pk__in=wanted_stocks)
+                               .values_list('id', 'price'))
+        else:
+            self.user_ids.update(users.objects.filter(username__in=wanted_users).values_list('username', 'id'))
+            self.stocks.update((ticker, (pk, price)) for ticker, pk, price in
+                               Stock.objects.filter(ticker__in=wanted_stocks).values_list('ticker', 'id', 'price'))
+
+    def clean(self, chunk):
+        self.resolve(chunk)
+        rows = []
+        for number, row in chunk:
+            if row is None:
+                self.errors.append((number, 'Not a JSON object.'))
+                continue
+            user_id = self.user_ids.get(str(row.get('user')))
+            stock = self.stocks.get(str(row.get('ticker')))
+            transaction_type = row.get('transaction_type')
+            if user_id is None:
+                self.errors.append((number, f'User {row.get("user")!r} not found.'))
+                continue
+            if stock is None:
+                self.errors.append((number, f'Stock {row.get("ticker")!r} not found.'))
+                continue
+            if transaction_type not in (Transaction.BUY, Transaction.SELL):
+                self.errors.append((number, "Transaction type must be 'buy' or 'sell'."))
+                continue
+            try:
+                volume = int(row.get('transaction_volume'))
+                price = row.get('transaction_price')
+                price = stock[1] * volume if price in (None, '') else to_micros(price)
+                created_at = row.get('created_at')
+                created_at = parse_timestamp(created_at) if created_at else self.now
+            except (TypeError, ValueError) as e:
+                self.errors.append((number, str(e)))
+                continue
+            if not 0 < volume <= MAX_ORDER_VOLUME:
+                self.errors.append((number, f'Volume must be between 1 and {MAX_ORDER_VOLUME}.'))
+                continue
+            if not 0 <= price <= MAX_MICROS:
+                self.errors.append((number, 'Price must not be negative or too large.'))
+                continue
+            rows.append((user_id, stock[0], transaction_type, volume, price, created_at))
+        return rows
+
+    def import_chunk(self, chunk):
+        rows = self.clean(chunk)
+        insert_transactions(rows)
+        for user_id, _, transaction_type, _, price, _ in rows:
+            self.deltas[user_id] += price if transaction_type == Transaction.SELL else -price
+        self.imported += len(rows)
+
+    def finish(self):
+        """ Applies the summed balance changes; returns the number of users whose balance changed."""
+        return apply_balance_deltas(self.deltas)
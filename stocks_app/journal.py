@@ -0,0 +1,273 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, connection, transaction
+
+from .models import JournalCheckpoint
+from .orders import fill_orders
+
+logger = logging.getLogger(__name__)
+
+# Database failures worth retrying the same orders for; any other error is in the orders themselves.
+TRANSIENT_ERRORS = (OperationalError, InterfaceError)
+
+
+class OrderJournal:
+    """
+    Write-behind mode for orders. A validated order is appended to a local
+    journal file and acknowledged as soon as the file is fsynced; one
+    background flusher later applies the journaled orders to the ledger.
+
+    The flusher takes every order that arrives within `ORDER_JOURNAL_MAX_DELAY`
+    seconds of the first one, up to `ORDER_JOURNAL_BATCH_SIZE` orders, and
+    pays one fsync and one database commit for the whole batch. The highest
+    applied sequence number is stored in `JournalCheckpoint` in the same
+    commit, so `replay()` re-applies exactly the orders that never reached the
+    database, and does so before the first new order is accepted.
+
+    Balance and holdings are checked when an order is applied, so an
+    acknowledged order can still be rejected; its fill future reports the
+    `OrderError`. A batch that fails for any other reason than a lost
+    database connection is applied again one order at a time, and the orders
+    that still fail are rejected, so one bad order cannot hold back the rest.
+    Each process needs its own `ORDER_JOURNAL_PATH`.
+    """
+
+    def __init__(self, path=None, batch_size=None, max_delay=None):
+        self.path = str(path or getattr(settings, 'ORDER_JOURNAL_PATH', settings.BASE_DIR / 'orders.journal'))
+        self.batch_size = batch_size or getattr(settings, 'ORDER_JOURNAL_BATCH_SIZE', 500)
+        self.max_delay = getattr(settings, 'ORDER_JOURNAL_MAX_DELAY', 0.005) if max_delay is None else max_delay
+        self.max_bytes = getattr(settings, 'ORDER_JOURNAL_MAX_BYTES', 64 * 1024 * 1024)
+        self.queue = queue.Queue()
+        self.pending = []
+        self.sequence = 0
+        self.file = None
+        self.thread = None
+        self.journaled = 0
+        self.applied = 0
+        self.rejected = 0
+        self.commits = 0
+        self.fsyncs = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        """ Replays what the last run left unapplied, then starts the flusher."""
+        with self._lock:
+            if self.thread is None:
+                self.replay()
+                self.file = open(self.path, 'ab')
+                self.thread = threading.Thread(target=self.run, name='order-journal', daemon=True)
+                self.thread.start()
+
+    def submit(self, order):
+        """
+        Queues a cleaned order for the journal.
+
+        @:param order : tuple returned by `clean_order`
+        @:return : tuple of (future of the journal sequence number, set once the
+                   order is on disk, future of the `Transaction` or `OrderError`)
+        """
+        if self.thread is None:
+            self.start()
+        acknowledged, filled = Future(), Future()
+        self.queue.put((order, acknowledged, filled))
+        return acknowledged, filled
+
+    def read(self, after=0):
+        """
+        Returns the journaled `(sequence, order)` entries above `after` and the
+        last sequence in the file. A torn last line left by a crash is cut off.
+        """
+        entries, last, valid_bytes = [], 0, 0
+        try:
+            with open(self.path, 'rb') as journal:
+                for line in journal:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    if not line.endswith(b'\n'):
+                        break
+                    valid_bytes += len(line)
+                    last = record['seq']
+                    if last > after:
+                        entries.append((last, tuple(record['order'])))
+                torn = journal.seek(0, os.SEEK_END) != valid_bytes
+        except FileNotFoundError:
+            return entries, last
+        if torn:
+            with open(self.path, 'r+b') as journal:
+                journal.truncate(valid_bytes)
+        return entries, last
+
+    def replay(self):
+        """ Applies the journaled orders the database has not seen yet. Returns how many were applied."""
+        checkpoint, _ = JournalCheckpoint.objects.get_or_create(name=self.path)
+        entries, last = self.read(after=checkpoint.last_sequence)
+        self.sequence = max(last, checkpoint.last_sequence)
+        for start in range(0, len(entries), self.batch_size):
+            self.apply(entries[start:start + self.batch_size])
+        return len(entries)
+
+    def commit(self, entries):
+        """ Fills journaled orders and moves the checkpoint in one database commit."""
+        with transaction.atomic():
+            results = fill_orders([order for _, order in entries])
+            JournalCheckpoint.objects.filter(name=self.path).update(last_sequence=entries[-1][0])
+        self.commits += 1
+        return results
+
+    def apply(self, entries, outcomes=None):
+        """
+        Fills journaled orders with one commit, or one per order when the batch
+        fails with an error that is not transient. An order that fails on its
+        own is rejected with that error and the checkpoint moves past it.
+        Transient errors are raised for the caller to retry; the orders
+        committed before one are already recorded in `outcomes`.
+
+        @:param entries : list of (sequence, order)
+        @:param outcomes : dict of sequence to `Transaction` or exception, filled in as orders commit
+        @:return : list with one `Transaction` or exception per entry
+        """
+        outcomes = {} if outcomes is None else outcomes
+        try:
+            self.record(outcomes, zip([sequence for sequence, _ in entries], self.commit(entries)))
+        except TRANSIENT_ERRORS:
+            raise
+        except Exception:
+            logger.exception('Journal batch %d-%d failed, applying its orders one at a time',
+                             entries[0][0], entries[-1][0])
+            for sequence, order in entries:
+                try:
+                    [result] = self.commit([(sequence, order)])
+                except TRANSIENT_ERRORS:
+                    raise
+                except Exception as e:
+                    logger.error('Rejected journaled order %d %r: %r', sequence, order, e)
+                    JournalCheckpoint.objects.filter(name=self.path).update(last_sequence=sequence)
+                    result = e
+                self.record(outcomes, [(sequence, result)])
+        return [outcomes[sequence] for sequence, _ in entries]
+
+    def record(self, outcomes, results):
+        for sequence, result in results:
+            outcomes[sequence] = result
+            if isinstance(result, Exception):
+                self.rejected += 1
+            else:
+                self.applied += 1
+
+    def take_batch(self):
+        """
+        Waits for the first order, then for more until the batch is full or
+        `max_delay` has passed. Orders that hit a transient database error
+        are retried even when nothing new arrives.
+        """
+        try:
+            batch = [self.queue.get(timeout=0.1 if self.pending else None)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.batch_size and batch[-1] is not None:
+            timeout = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.take_batch()
+            stop = batch and batch[-1] is None
+            batch = [item for item in batch if item is not None]
+            if batch:
+                self.write(batch)
+            if self.pending:
+                self.flush()
+            if stop:
+                self.file.close()
+                connection.close()
+                return
+
+    def write(self, batch):
+        entries = []
+        for order, acknowledged, filled in batch:
+            self.sequence += 1
+            entries.append((self.sequence, order, acknowledged, filled))
+        size = os.fstat(self.file.fileno()).st_size
+        try:
+            self.file.write(b''.join(
+                json.dumps({'seq': sequence, 'order': order}, separators=(',', ':')).encode() + b'\n'
+                for sequence, order, _, _ in entries
+            ))
+            self.file.flush()
+            if getattr(settings, 'ORDER_JOURNAL_FSYNC', True):
+                os.fsync(self.file.fileno())
+                self.fsyncs += 1
+        except OSError as e:
+            # Drop a partly written batch so later appends do not follow a torn line.
+            try:
+                self.file.truncate(size)
+            except OSError:
+                pass
+            for _, _, acknowledged, filled in entries:
+                acknowledged.set_exception(e)
+                filled.set_exception(e)
+            return
+        self.journaled += len(entries)
+        for sequence, _, acknowledged, _ in entries:
+            acknowledged.set_result(sequence)
+        self.pending.extend((sequence, order, filled) for sequence, order, _, filled in entries)
+
+    def flush(self):
+        """ Applies the pending journaled orders, keeping the ones a transient database error left for a retry."""
+        outcomes = {}
+        try:
+            self.apply([(sequence, order) for sequence, order, _ in self.pending], outcomes)
+        except TRANSIENT_ERRORS:
+            connection.close_if_unusable_or_obsolete()
+        for sequence, _, filled in self.pending:
+            if sequence in outcomes:
+                result = outcomes[sequence]
+                if isinstance(result, Exception):
+                    filled.set_exception(result)
+                else:
+                    filled.set_result(result)
+        self.pending = [entry for entry in self.pending if entry[0] not in outcomes]
+        if self.pending:
+            return
+        if os.fstat(self.file.fileno()).st_size >= self.max_bytes:
+            # Everything written so far is applied, so the journal can start over.
+            self.file.truncate(0)
+            os.fsync(self.file.fileno())
+
+    def stop(self):
+        """ Journals and applies whatever is queued, then stops the flusher."""
+        with self._lock:
+            thread, self.thread = self.thread, None
+            if thread is not None:
+                self.queue.put(None)
+                thread.join()
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'sequence': self.sequence,
+            'queue_depth': self.queue.qsize(),
+            'pending': len(self.pending),
+            'journaled': self.journaled,
+            'applied': self.applied,
+            'rejected': self.rejected,
+            'commits': self.commits,
+            'fsyncs': self.fsyncs,
+        }
+
+
+journal = OrderJournal()
@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from stocks_app.archive import archive_month, create_partitions, month_start
+from stocks_app.models import Transaction
+from stocks_app.summaries import refresh_daily_rollup
+
+
+class Command(BaseCommand):
+    """
+    Moves every whole month of transactions before the cutoff into compressed
+    files, oldest first. The daily rollup is refreshed beforehand so the
+    ticker summaries keep the totals of the archived months. By default the
+    last `TRANSACTIONS_HOT_MONTHS` months stay in the table. On Postgres the
+    archived months' partitions are dropped, and the partitions of the coming
+    months are created, so run it at least monthly.
+    """
+    help = 'Archive old months of transactions to compressed files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', help='First month to keep in the table, as YYYY-MM.')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if options['before']:
+            try:
+                cutoff = month_start(datetime.strptime(options['before'], '%Y-%m'))
+            except ValueError:
+                raise CommandError('--before must be YYYY-MM.')
+        else:
+            cutoff = month_start(timezone.now())
+            for _ in range(getattr(settings, 'TRANSACTIONS_HOT_MONTHS', 12)):
+                cutoff = month_start(cutoff - timedelta(days=1))
+
+        refresh_daily_rollup()
+        archived = 0
+        while True:
+            oldest = Transaction.objects.order_by('created_at').values_list('created_at', flat=True).first()
+            if oldest is None or month_start(oldest) >= cutoff:
+                break
+            try:
+                archive = archive_month(oldest, chunk_size=options['chunk_size'])
+            except ValueError as e:
+                raise CommandError(str(e))
+            archived += archive.row_count
+            self.stdout.write(f'{archive.month:%Y-%m}: {archive.row_count} transactions -> {archive.path}')
+        for name in create_partitions(cutoff):
+            self.stdout.write(f'Created partition {name}')
+        self.stdout.write(self.style.SUCCESS(f'Archived {archived} transactions before {cutoff:%Y-%m}.'))
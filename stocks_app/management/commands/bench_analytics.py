@@ -0,0 +1,71 @@
+import time
+from collections import deque
+
+from django.core.management.base import BaseCommand, CommandError
+
+from stocks_app import analytics
+
+
+class Command(BaseCommand):
+    """
+    Times `analytics.compute_metrics` on synthetic ledgers of growing size and
+    checks the vectorized FIFO result against a plain Python lot queue on a
+    ledger small enough for the loop to finish quickly.
+    """
+    help = 'Benchmark the vectorized portfolio analytics on synthetic ledgers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7])
+        parser.add_argument('--tickers', type=int, default=50)
+        parser.add_argument('--check-size', type=int, default=10 ** 4)
+
+    def synthetic_ledger(self, rows, tickers, seed=0):
+        np = analytics.np
+        rng = np.random.default_rng(seed)
+        ticker_id = np.sort(rng.integers(1, tickers + 1, rows), kind='stable')
+        is_buy = rng.random(rows) < 0.6
+        volume = rng.integers(1, 100, rows).astype(np.float64)
+        notional = volume * rng.uniform(10, 500, rows)
+        in_window = rng.random(rows) < 0.5
+        prices = {tid: float(rng.uniform(10, 500)) for tid in range(1, tickers + 1)}
+        return ticker_id, is_buy, in_window, volume, notional, prices
+
+    def reference_realized(self, ticker_id, is_buy, in_window, volume, notional):
+        realized = {}
+        lots = {}
+        for tid, buy, window, vol, total in zip(ticker_id.tolist(), is_buy.tolist(), in_window.tolist(),
+                                                volume.tolist(), notional.tolist()):
+            queue = lots.setdefault(tid, deque())
+            if buy:
+                queue.append([vol, total / vol])
+                continue
+            remaining, cost = vol, 0.0
+            while remaining and queue:
+                take = min(remaining, queue[0][0])
+                cost += take * queue[0][1]
+                queue[0][0] -= take
+                remaining -= take
+                if not queue[0][0]:
+                    queue.popleft()
+            if window:
+                realized[tid] = realized.get(tid, 0.0) + total * (vol - remaining) / vol - cost
+        return realized
+
+    def handle(self, *args, **options):
+        if analytics.np is None:
+            raise CommandError('NumPy is required for the analytics benchmark.')
+
+        ledger = self.synthetic_ledger(options['check_size'], options['tickers'])
+        metrics = analytics.compute_metrics(*ledger)
+        expected = self.reference_realized(*ledger[:5])
+        for tid, value in expected.items():
+            if abs(metrics[tid]['realized_gain'] - value) > 1e-6 * max(1.0, abs(value)):
+                raise CommandError(f'ticker {tid}: vectorized {metrics[tid]["realized_gain"]}, reference {value}')
+        self.stdout.write(self.style.SUCCESS(f'FIFO check passed on {options["check_size"]} rows'))
+
+        for rows in options['sizes']:
+            ledger = self.synthetic_ledger(rows, options['tickers'])
+            start = time.perf_counter()
+            analytics.compute_metrics(*ledger)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f'{rows:>10} rows: {elapsed * 1000:9.1f}ms  {rows / elapsed:,.0f} rows/sec')
@@ -0,0 +1,46 @@
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+
+from stocks_app.authentication import generate_jwt, token_cache
+
+
+class Command(BaseCommand):
+    """
+    Calls `stocks/` repeatedly with the same token, once with the JWT
+    verification cache disabled and once enabled, and reports the p50/p99
+    latency of both runs.
+    """
+    help = 'Benchmark jwt_required latency with the token cache on and off.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+
+    def measure(self, client, headers, count):
+        timings = []
+        for _ in range(count):
+            start = time.perf_counter()
+            client.get('/stocks/', **headers)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        return statistics.median(timings), timings[int(len(timings) * 0.99) - 1]
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        user = User.objects.create(username='bench-auth-user')
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {generate_jwt(user)}'}
+        client = Client(HTTP_HOST='localhost')
+
+        try:
+            for enabled in (False, True):
+                token_cache.clear()
+                with override_settings(JWT_CACHE_ENABLED=enabled):
+                    p50, p99 = self.measure(client, headers, count)
+                label = 'on ' if enabled else 'off'
+                self.stdout.write(f'cache {label}: p50 {p50:.3f}ms  p99 {p99:.3f}ms')
+            self.stdout.write(f'cache stats: {token_cache.stats()}')
+        finally:
+            user.delete()
@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from stocks_app.models import users, Stock, Transaction, Position
+from stocks_app.money import to_micros
+from stocks_app.orders import place_order, place_orders
+
+
+class Command(BaseCommand):
+    """
+    Compares filling N orders one at a time through `place_order`, which is
+    what looping `add-transaction/` costs, against one `place_orders` batch.
+    """
+    help = 'Benchmark bulk order submission against looping single orders.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=2000)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--stocks', type=int, default=20)
+
+    def handle(self, *args, **options):
+        count = options['orders']
+        bench_users = users.objects.bulk_create([
+            users(username=f'bench-bulk-{i}', balance=to_micros(10 ** 9)) for i in range(options['users'])
+        ])
+        bench_stocks = Stock.objects.bulk_create([
+            Stock(ticker=f'BULK{i}', price=to_micros(1 + i)) for i in range(options['stocks'])
+        ])
+        Position.objects.bulk_create([
+            Position(user=user, stock=stock, quantity=count, cost_basis=count * stock.price)
+            for user in bench_users for stock in bench_stocks
+        ])
+        orders = [{
+            'user': bench_users[i % len(bench_users)].id,
+            'ticker': bench_stocks[i % len(bench_stocks)].id,
+            'transaction_type': Transaction.BUY if i % 3 else Transaction.SELL,
+            'transaction_volume': 1 + i % 10,
+        } for i in range(count)]
+
+        try:
+            start = time.perf_counter()
+            for order in orders:
+                place_order(order['user'], order['ticker'], order['transaction_type'],
+                            order['transaction_volume'])
+            single = time.perf_counter() - start
+
+            start = time.perf_counter()
+            place_orders(orders)
+            bulk = time.perf_counter() - start
+
+            self.stdout.write(f'single: {count / single:.1f} orders/sec ({single:.3f}s)')
+            self.stdout.write(f'bulk:   {count / bulk:.1f} orders/sec ({bulk:.3f}s)')
+            self.stdout.write(f'speedup: {single / bulk:.1f}x')
+        finally:
+            users.objects.filter(pk__in=[user.pk for user in bench_users]).delete()
+            Stock.objects.filter(pk__in=[stock.pk for stock in bench_stocks]).delete()
@@ -0,0 +1,92 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+from django.test import Client, override_settings
+
+from stocks_app.authentication import generate_jwt, token_cache
+from stocks_app.dbpool import connection_stats
+from stocks_app.models import Stock
+from stocks_app.money import to_micros
+
+
+class Command(BaseCommand):
+    """
+    Requests `stock/<ticker>/` through the test client with a new connection
+    per request, with persistent connections and, when the default database
+    is configured with `DB_POOL=1`, through the psycopg pool. The price and
+    token caches are off so every request runs a query. Reports per-request
+    p50/p99 latency and the p50/p99 time spent opening or waiting for a
+    connection.
+    """
+    help = 'Benchmark per-request latency with and without connection reuse.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--clients', type=int, default=8)
+
+    def percentile(self, latencies, p):
+        latencies = sorted(latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    def run(self, requests, clients, token):
+        def client(index):
+            latencies = []
+            browser = Client(HTTP_AUTHORIZATION=f'Bearer {token}')
+            try:
+                for _ in range(index, requests, clients):
+                    # The test client disconnects close_old_connections from the
+                    # request signals, so run it the way the real handler does.
+                    start = time.perf_counter()
+                    close_old_connections()
+                    browser.get('/stock/BENCH-CONN/')
+                    close_old_connections()
+                    latencies.append(time.perf_counter() - start)
+            finally:
+                connections.close_all()
+            return latencies
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            results = list(pool.map(client, range(clients)))
+        return time.perf_counter() - start, [latency for latencies in results for latency in latencies]
+
+    def handle(self, *args, **options):
+        settings_dict = connections['default'].settings_dict
+        saved = settings_dict['CONN_MAX_AGE'], settings_dict['OPTIONS'].get('pool')
+        modes = [('per-request', 0, None), ('persistent', None, None)]
+        if saved[1]:
+            modes.append(('pool', 0, saved[1]))
+
+        auth_user = User.objects.create(username='bench-connections')
+        stock = Stock.objects.create(ticker='BENCH-CONN', price=to_micros(1))
+        token = generate_jwt(auth_user)
+        try:
+            with override_settings(PRICE_CACHE_ENABLED=False, JWT_CACHE_ENABLED=False, ALLOWED_HOSTS=['*']):
+                for name, max_age, pool in modes:
+                    settings_dict['CONN_MAX_AGE'] = max_age
+                    settings_dict['OPTIONS'].pop('pool', None)
+                    if pool:
+                        settings_dict['OPTIONS']['pool'] = pool
+                    connections.close_all()
+                    connection_stats.clear()
+
+                    elapsed, latencies = self.run(options['requests'], options['clients'], token)
+                    waits = connection_stats.stats()['default']
+                    self.stdout.write(
+                        f'{name:<12} {len(latencies) / elapsed:8.0f} req/s  '
+                        f'p50 {self.percentile(latencies, 0.5):6.2f}ms  p99 {self.percentile(latencies, 0.99):6.2f}ms  '
+                        f'{waits["connections_opened"]:6} connects  '
+                        f'wait p50 {waits["wait_ms_p50"] or 0:6.2f}ms  p99 {waits["wait_ms_p99"] or 0:6.2f}ms'
+                    )
+        finally:
+            settings_dict['CONN_MAX_AGE'] = saved[0]
+            settings_dict['OPTIONS'].pop('pool', None)
+            if saved[1]:
+                settings_dict['OPTIONS']['pool'] = saved[1]
+            connections.close_all()
+            token_cache.clear()
+            stock.delete()
+            auth_user.delete()
@@ -0,0 +1,107 @@
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from stocks_app.journal import OrderJournal
+from stocks_app.models import users, Stock, Transaction, JournalCheckpoint
+from stocks_app.money import to_micros
+from stocks_app.orders import place_order, OrderError
+
+
+class Command(BaseCommand):
+    """
+    Compares filling orders inline, one commit each, with the write-behind
+    journal at several batch sizes. Every client places its orders one after
+    the other and waits for the acknowledgement, so the number of clients
+    bounds how full a batch can get. Reports orders/sec, database commits/sec
+    and the p50/p99 latency until the order is acknowledged and until it is
+    in the ledger.
+    """
+    help = 'Benchmark the write-behind order journal against inline fills.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=5000)
+        parser.add_argument('--clients', type=int, default=64)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 10, 50, 100, 500])
+        parser.add_argument('--max-delay', type=float, default=0.005)
+
+    def percentile(self, latencies, p):
+        latencies = sorted(latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    def run_clients(self, place, orders, clients, user_ids, stock_id):
+        def client(index):
+            latencies = []
+            try:
+                for i in range(index, orders, clients):
+                    start = time.perf_counter()
+                    latencies.append(place((user_ids[i % len(user_ids)], stock_id, Transaction.BUY, 1), start))
+            finally:
+                connection.close()
+            return latencies
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            results = list(pool.map(client, range(clients)))
+        return time.perf_counter() - start, [latency for latencies in results for latency in latencies]
+
+    def handle(self, *args, **options):
+        orders, clients = options['orders'], options['clients']
+        stock = Stock.objects.create(ticker='BENCH-JOURNAL', price=to_micros(1))
+        bench_users = users.objects.bulk_create([
+            users(username=f'bench-journal-{i}', balance=to_micros(orders * 10)) for i in range(options['users'])
+        ])
+        user_ids = [user.id for user in bench_users]
+        directory = tempfile.mkdtemp()
+
+        def inline(order, start):
+            try:
+                place_order(*order)
+            except OrderError:
+                pass
+            return time.perf_counter() - start
+
+        try:
+            elapsed, latencies = self.run_clients(inline, orders, clients, user_ids, stock.id)
+            self.stdout.write(
+                f'inline        {orders / elapsed:8.0f} orders/s  {orders / elapsed:8.0f} commits/s  '
+                f'fill p50 {self.percentile(latencies, 0.5):6.1f}ms  p99 {self.percentile(latencies, 0.99):6.1f}ms'
+            )
+
+            for batch_size in options['batch_sizes']:
+                journal = OrderJournal(path=os.path.join(directory, f'batch-{batch_size}.journal'),
+                                       batch_size=batch_size, max_delay=options['max_delay'])
+                journal.start()
+                fill_latencies = []
+
+                def journaled(order, start):
+                    acknowledged, filled = journal.submit(order)
+                    acknowledged.result()
+                    acked = time.perf_counter() - start
+                    filled.add_done_callback(lambda _: fill_latencies.append(time.perf_counter() - start))
+                    return acked
+
+                start = time.perf_counter()
+                _, latencies = self.run_clients(journaled, orders, clients, user_ids, stock.id)
+                journal.stop()
+                elapsed_applied = time.perf_counter() - start
+                self.stdout.write(
+                    f'batch {batch_size:<7} {orders / elapsed_applied:8.0f} orders/s  '
+                    f'{journal.commits / elapsed_applied:8.0f} commits/s  '
+                    f'ack p50 {self.percentile(latencies, 0.5):6.1f}ms  p99 {self.percentile(latencies, 0.99):6.1f}ms  '
+                    f'fill p50 {self.percentile(fill_latencies, 0.5):6.1f}ms  '
+                    f'p99 {self.percentile(fill_latencies, 0.99):6.1f}ms  '
+                    f'{journal.journaled / max(journal.fsyncs, 1):.1f} orders/fsync'
+                )
+                JournalCheckpoint.objects.filter(name=journal.path).delete()
+        finally:
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+            os.rmdir(directory)
+            users.objects.filter(pk__in=user_ids).delete()
+            stock.delete()
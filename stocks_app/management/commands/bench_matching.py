@@ -0,0 +1,74 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from stocks_app.matching import MatchingEngine
+from stocks_app.models import Transaction
+from stocks_app.money import to_micros
+
+
+class Command(BaseCommand):
+    """
+    Micro-benchmarks of the in-memory matching engine with persistence and
+    pre-trade checks turned off: resting inserts, cancels, matches against a full book, and a mixed
+    random order flow. Reports throughput and per-operation latency.
+    """
+    help = 'Benchmark insert, cancel and match latency of the matching engine.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=200000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def report(self, name, timings):
+        timings.sort()
+        total = sum(timings)
+        self.stdout.write(
+            f'{name:>7}: {len(timings) / total * 1e9:,.0f} ops/sec  '
+            f'p50 {statistics.median(timings) / 1000:.2f}us  '
+            f'p99 {timings[int(len(timings) * 0.99) - 1] / 1000:.2f}us'
+        )
+
+    def handle(self, *args, **options):
+        count = options['orders']
+        rng = random.Random(options['seed'])
+        clock = time.perf_counter_ns
+        engine = MatchingEngine(check_funds=False)
+
+        prices = [to_micros(round(rng.uniform(50, 99), 2)) for _ in range(count)]
+        timings, ids = [], []
+        for price in prices:
+            start = clock()
+            order, _ = engine.submit(1, 1, Transaction.BUY, 10, price)
+            timings.append(clock() - start)
+            ids.append(order.id)
+        self.report('insert', timings)
+
+        timings = []
+        for order_id in ids:
+            start = clock()
+            engine.cancel(order_id)
+            timings.append(clock() - start)
+        self.report('cancel', timings)
+
+        engine = MatchingEngine(check_funds=False)
+        for price in prices:
+            engine.submit(1, 1, Transaction.SELL, 10, price)
+        timings = []
+        for _ in range(count):
+            start = clock()
+            engine.submit(2, 1, Transaction.BUY, 10, to_micros(100))
+            timings.append(clock() - start)
+        self.report('match', timings)
+
+        engine = MatchingEngine(check_funds=False)
+        flow = [(rng.randint(1, 100), rng.randint(1, 10), rng.choice((Transaction.BUY, Transaction.SELL)),
+                 rng.randint(1, 20), None if rng.random() < 0.05 else to_micros(round(rng.gauss(100, 2), 2)))
+                for _ in range(count)]
+        fills = 0
+        start = time.perf_counter()
+        for user_id, stock_id, side, quantity, price in flow:
+            fills += len(engine.submit(user_id, stock_id, side, quantity, price)[1])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f'  mixed: {count / elapsed:,.0f} orders/sec, {fills} fills')
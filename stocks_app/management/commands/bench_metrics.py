@@ -0,0 +1,88 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, override_settings
+from django.urls import resolve
+
+from stocks_app.authentication import generate_jwt
+from stocks_app.metrics import add_phase, phase, record_query, registry
+from stocks_app.middleware import MetricsMiddleware
+from stocks_app.models import Stock
+from stocks_app.money import to_micros
+
+
+class Command(BaseCommand):
+    """
+    Measures the cost of `MetricsMiddleware` with profile sampling off. The
+    middleware is first timed in isolation, around a stub view that records
+    the same phases and one query as a real request, over many calls. That
+    cost is then compared with the fastest full request to `stock/<ticker>/`
+    without the middleware. This is the cheapest endpoint, so it is the
+    worst case for relative overhead. Timing two full request loops against
+    each other is dominated by scheduler noise at this scale.
+    """
+    help = 'Benchmark the request overhead of the metrics middleware.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=50000)
+        parser.add_argument('--requests', type=int, default=300)
+        parser.add_argument('--rounds', type=int, default=21)
+
+    def middleware_cost(self, calls):
+        response = HttpResponse(b'{}')
+
+        def execute(sql, params, many, context):
+            return None
+
+        def view(request):
+            add_phase('auth', time.perf_counter())
+            record_query(execute, 'SELECT 1', (), False, {})
+            with phase('serialize'):
+                pass
+            with phase('render'):
+                pass
+            return response
+
+        request = RequestFactory().get('/stock/BENCH-METRICS/')
+        request.resolver_match = resolve('/stock/BENCH-METRICS/')
+        middleware = MetricsMiddleware(view)
+        with override_settings(PROFILE_SAMPLE_RATE=0, METRICS_ENABLED=True):
+            timings = []
+            for wrapped in (view, middleware, view, middleware):
+                start = time.perf_counter()
+                for _ in range(calls):
+                    wrapped(request)
+                timings.append((time.perf_counter() - start) / calls)
+        return min(timings[1], timings[3]) - min(timings[0], timings[2])
+
+    def request_time(self, token, requests, rounds):
+        middleware = [name for name in settings.MIDDLEWARE if name != 'stocks_app.middleware.MetricsMiddleware']
+        fastest = None
+        with override_settings(MIDDLEWARE=middleware, ALLOWED_HOSTS=['*']):
+            client = Client(HTTP_AUTHORIZATION=f'Bearer {token}')
+            client.get('/stock/BENCH-METRICS/')
+            for _ in range(rounds):
+                start = time.perf_counter()
+                for _ in range(requests):
+                    client.get('/stock/BENCH-METRICS/')
+                elapsed = (time.perf_counter() - start) / requests
+                fastest = elapsed if fastest is None else min(fastest, elapsed)
+        return fastest
+
+    def handle(self, *args, **options):
+        auth_user = User.objects.create(username='bench-metrics')
+        stock = Stock.objects.create(ticker='BENCH-METRICS', price=to_micros(1))
+        token = generate_jwt(auth_user)
+        try:
+            cost = self.middleware_cost(options['calls'])
+            request = self.request_time(token, options['requests'], options['rounds'])
+            self.stdout.write(f'middleware         {cost * 1e6:8.1f}us/request')
+            self.stdout.write(f'stock/<ticker>/    {request * 1e6:8.1f}us/request without it')
+            self.stdout.write(f'overhead           {cost / request:+.2%}')
+        finally:
+            registry.reset()
+            stock.delete()
+            auth_user.delete()
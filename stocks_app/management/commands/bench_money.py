@@ -0,0 +1,87 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from stocks_app import analytics
+from stocks_app.money import SCALE, to_micros
+
+
+class Command(BaseCommand):
+    """
+    Compares integer micro-units with `Decimal` and float for the two money
+    workloads of the app: filling orders (price times volume, a balance check
+    and a debit or credit per order) and aggregating notionals. Aggregation is
+    timed in plain Python and, when NumPy is installed, as int64 and float64
+    array sums (`Decimal` has no native array type). The drift column is how
+    far each result is from the exact total.
+    """
+    help = 'Benchmark int micro-units against Decimal and float money arithmetic.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=10 ** 6)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def fill(self, prices, volumes, sides, balance):
+        start = time.perf_counter()
+        for price, volume, buy in zip(prices, volumes, sides):
+            total = price * volume
+            if buy:
+                if balance >= total:
+                    balance -= total
+            else:
+                balance += total
+        return time.perf_counter() - start, balance
+
+    def handle(self, *args, **options):
+        count = options['orders']
+        rng = random.Random(options['seed'])
+        cents = [rng.randint(100, 50000) for _ in range(count)]
+        volumes = [rng.randint(1, 100) for _ in range(count)]
+        sides = [rng.random() < 0.5 for _ in range(count)]
+
+        representations = {
+            'int micro': ([c * (SCALE // 100) for c in cents], to_micros(10 ** 9)),
+            'Decimal': ([Decimal(c).scaleb(-2) for c in cents], Decimal(10 ** 9)),
+            'float': ([c / 100 for c in cents], float(10 ** 9)),
+        }
+        exact_notional = sum(c * v for c, v in zip(cents, volumes))
+
+        self.stdout.write(f'{count:,} orders')
+        results = {}
+        for name, (prices, balance) in representations.items():
+            elapsed, final = self.fill(prices, volumes, sides, balance)
+            results[name] = final
+            self.stdout.write(f'fill       {name:<10} {count / elapsed:12,.0f} orders/sec')
+
+        exact_balance = results['int micro']
+        for name, final in results.items():
+            as_units = Decimal(final) / SCALE if name == 'int micro' else Decimal(final)
+            drift = as_units - Decimal(exact_balance) / SCALE
+            self.stdout.write(f'balance    {name:<10} drift {drift:.10f}')
+
+        for name, (prices, _) in representations.items():
+            notionals = [price * volume for price, volume in zip(prices, volumes)]
+            start = time.perf_counter()
+            total = sum(notionals)
+            elapsed = time.perf_counter() - start
+            as_units = Decimal(total) / SCALE if name == 'int micro' else Decimal(total)
+            drift = as_units - Decimal(exact_notional).scaleb(-2)
+            self.stdout.write(f'sum        {name:<10} {count / elapsed:12,.0f} rows/sec  drift {drift:.10f}')
+
+        np = analytics.np
+        if np is None:
+            self.stdout.write('NumPy not installed, skipping array sums.')
+            return
+        arrays = {
+            'int64 micro': np.array(cents, dtype=np.int64) * (SCALE // 100) * np.array(volumes, dtype=np.int64),
+            'float64': np.array(cents, dtype=np.float64) / 100 * np.array(volumes, dtype=np.float64),
+        }
+        for name, notionals in arrays.items():
+            start = time.perf_counter()
+            total = notionals.sum()
+            elapsed = time.perf_counter() - start
+            as_units = Decimal(int(total)) / SCALE if notionals.dtype == np.int64 else Decimal(float(total))
+            drift = as_units - Decimal(exact_notional).scaleb(-2)
+            self.stdout.write(f'array sum  {name:<10} {count / elapsed:12,.0f} rows/sec  drift {drift:.10f}')
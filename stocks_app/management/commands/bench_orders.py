@@ -0,0 +1,92 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection, DatabaseError
+
+from stocks_app.models import users, Stock, Transaction, Position
+from stocks_app.money import to_micros
+from stocks_app.orders import place_order, OrderError
+from stocks_app.sequencer import sequencer
+
+
+class Command(BaseCommand):
+    """
+    Fires N parallel buy/sell orders against a single hot user and reports the
+    throughput. Afterwards it checks that the final balance matches the sum of
+    the filled orders, so any lost update shows up as a mismatch. On SQLite use
+    the IMMEDIATE transaction mode, otherwise concurrent writers fail with
+    "database is locked" instead of queueing on the lock.
+
+    With `--sequencer` the same clients queue their orders on the order
+    sequencer and wait for the fills instead of taking the row lock themselves.
+    """
+    help = 'Benchmark concurrent orders against a single hot user.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--price', type=float, default=10.0)
+        parser.add_argument('--sequencer', action='store_true',
+                            help='Route orders through the order sequencer shards.')
+
+    def handle(self, *args, **options):
+        orders = options['orders']
+        price = to_micros(options['price'])
+        initial_balance = orders * price * 10
+
+        user = users.objects.create(username='bench-hot-user', balance=initial_balance)
+        stock = Stock.objects.create(ticker='BENCH', price=price)
+        Position.objects.create(user=user, stock=stock, quantity=orders, cost_basis=orders * price)
+
+        workers = options['workers']
+
+        def submit(worker):
+            filled = 0
+            try:
+                for i in range(worker, orders, workers):
+                    transaction_type = Transaction.BUY if i % 2 else Transaction.SELL
+                    try:
+                        if options['sequencer']:
+                            sequencer.submit((user.id, stock.id, transaction_type, 1))[1].result()
+                        else:
+                            place_order(user.id, stock.id, transaction_type, 1)
+                        filled += 1
+                    except (OrderError, DatabaseError):
+                        pass
+            finally:
+                connection.close()
+            return filled
+
+        try:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                filled = sum(pool.map(submit, range(workers)))
+            elapsed = time.perf_counter() - start
+
+            user.refresh_from_db()
+            trades = Transaction.objects.filter(user=user)
+            expected = initial_balance
+            for trade in trades:
+                if trade.transaction_type == Transaction.BUY:
+                    expected -= trade.transaction_price
+                else:
+                    expected += trade.transaction_price
+
+            self.stdout.write(f'orders: {orders}  filled: {filled}  workers: {workers}')
+            if options['sequencer']:
+                for shard in sequencer.stats()['shards']:
+                    self.stdout.write(f"shard {shard['shard']}: {shard['filled']} filled in {shard['batches']} "
+                                      f"batches, max queue depth {shard['max_queue_depth']}")
+            self.stdout.write(f'elapsed: {elapsed:.3f}s  orders/sec: {orders / elapsed:.1f}')
+            if trades.count() != filled or user.balance != int(expected):
+                self.stderr.write(self.style.ERROR(
+                    f'lost updates: balance {user.balance}, expected {int(expected)}, '
+                    f'{trades.count()} ledger rows for {filled} fills'
+                ))
+            else:
+                self.stdout.write(self.style.SUCCESS('no lost updates'))
+        finally:
+            sequencer.stop()
+            user.delete()
+            stock.delete()
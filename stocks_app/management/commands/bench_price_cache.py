@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from stocks_app.models import users, Stock, Transaction
+from stocks_app.money import to_micros
+from stocks_app.orders import place_order
+from stocks_app.prices import price_cache
+
+
+class Command(BaseCommand):
+    """
+    Measures order throughput with the price cache disabled and with a warm
+    cache, using the configured PRICE_CACHE_BACKEND for the shared tier.
+    """
+    help = 'Benchmark order throughput with a warm price cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=2000)
+        parser.add_argument('--stocks', type=int, default=20)
+
+    def handle(self, *args, **options):
+        count = options['orders']
+        user = users.objects.create(username='bench-price-user', balance=to_micros(10 ** 9))
+        bench_stocks = Stock.objects.bulk_create([
+            Stock(ticker=f'PRICE{i}', price=to_micros(1 + i)) for i in range(options['stocks'])
+        ])
+
+        try:
+            for enabled in (False, True):
+                price_cache.clear()
+                with override_settings(PRICE_CACHE_ENABLED=enabled):
+                    for stock in bench_stocks:
+                        price_cache.get(pk=stock.pk)
+                    start = time.perf_counter()
+                    for i in range(count):
+                        place_order(user.pk, bench_stocks[i % len(bench_stocks)].pk, Transaction.BUY, 1)
+                    elapsed = time.perf_counter() - start
+                label = 'warm' if enabled else 'off '
+                self.stdout.write(f'cache {label}: {count / elapsed:.1f} orders/sec ({elapsed:.3f}s)')
+            self.stdout.write(f'cache stats: {price_cache.stats()}')
+        finally:
+            user.delete()
+            Stock.objects.filter(pk__in=[stock.pk for stock in bench_stocks]).delete()
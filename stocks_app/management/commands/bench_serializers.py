@@ -0,0 +1,73 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework import serializers
+
+from stocks_app.models import users, Stock, Transaction
+from stocks_app.money import to_micros
+from stocks_app.serializers import TransactionSerializer
+
+
+class FieldByFieldSerializer(TransactionSerializer):
+    """ `TransactionSerializer` with DRF's stock list serializer, as the baseline."""
+
+    class Meta(TransactionSerializer.Meta):
+        list_serializer_class = serializers.ListSerializer
+
+
+class Command(BaseCommand):
+    """
+    Serializes the same transactions with DRF's field by field list
+    serializer and with `ValuesListSerializer`, from already loaded instances
+    and from the queryset including the fetch, plus a `?fields=` projection
+    pushed down to `values_list`. The outputs are checked to be identical.
+    """
+    help = 'Benchmark the values_list fast path of the list serializers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000)
+
+    def timed(self, label, func, rows, baseline=None):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        speedup = f'{baseline / elapsed:6.1f}x' if baseline else ''
+        self.stdout.write(f'{label:<32} {rows / elapsed:12,.0f} rows/s  {elapsed:7.3f}s  {speedup}')
+        return elapsed, result
+
+    def handle(self, *args, **options):
+        count = options['rows']
+        user = users.objects.create(username='bench-serializers', balance=0)
+        stock = Stock.objects.create(ticker='BENCH-SER', price=to_micros(1))
+        now = timezone.now()
+        Transaction.objects.bulk_create([
+            Transaction(user=user, ticker=stock, transaction_type=Transaction.BUY if i % 2 else Transaction.SELL,
+                        transaction_volume=i % 100 + 1, transaction_price=to_micros(i % 100 + 1), created_at=now)
+            for i in range(count)
+        ], batch_size=5000)
+        transactions = Transaction.objects.filter(user=user).order_by('id')
+
+        try:
+            instances = list(transactions)
+            slow, expected = self.timed('field by field, instances',
+                                        lambda: FieldByFieldSerializer(instances, many=True).data, count)
+            _, fast = self.timed('values list, instances',
+                                 lambda: TransactionSerializer(instances, many=True).data, count, slow)
+            if fast != expected:
+                raise CommandError('The fast path output differs from DRF.')
+
+            slow, _ = self.timed('field by field, queryset + fetch',
+                                 lambda: FieldByFieldSerializer(transactions.all(), many=True).data, count)
+            _, fast = self.timed('values list, queryset + fetch',
+                                 lambda: TransactionSerializer(transactions.all(), many=True).data, count, slow)
+            if fast != expected:
+                raise CommandError('The fast path output differs from DRF.')
+
+            fields = ['id', 'transaction_price', 'transaction_volume']
+            self.timed(f'values list, fields={",".join(fields)}',
+                       lambda: TransactionSerializer(transactions.all(), many=True, fields=fields).data, count, slow)
+        finally:
+            Transaction.objects.filter(user=user).delete()
+            user.delete()
+            stock.delete()
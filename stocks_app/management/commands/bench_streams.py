@@ -0,0 +1,84 @@
+import asyncio
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from stocks_app.money import to_micros
+from stocks_app import streams
+from stocks_app.streams import Broker, events
+
+
+class Command(BaseCommand):
+    """
+    Measures the streaming broker without a server: the memory held by each
+    idle stream, the body generator of the endpoint waiting on its event
+    included, and the time for a burst of price ticks published from another
+    thread, as the sync views do, to reach every stream. Each stream watches
+    one of `--tickers` stocks, so every tick fans out to many of them and
+    repeated ticks show how much coalescing saves.
+    """
+    help = 'Benchmark idle stream memory and price fan-out of the streaming broker.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscribers', type=int, default=10000)
+        parser.add_argument('--tickers', type=int, default=50)
+        parser.add_argument('--ticks', type=int, default=20, help='Ticks published per stock in the burst.')
+
+    async def run(self, subscribers, tickers, ticks):
+        loop = asyncio.get_running_loop()
+        names = [f'BENCH-STREAM-{n}' for n in range(tickers)]
+        last = f'"price": {float(ticks)}'.encode()
+        delivered, current, done = 0, 0, asyncio.Event()
+
+        async def consume(subscriber):
+            nonlocal delivered, current
+            async for chunk in events(subscriber, heartbeat=3600, lifetime=3600):
+                delivered += chunk.count(b'event: price')
+                if last in chunk:
+                    current += 1
+                    if current == subscribers:
+                        done.set()
+
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        tasks = [loop.create_task(consume(streams.broker.subscribe(loop, [names[n % tickers]])))
+                 for n in range(subscribers)]
+        for _ in range(3):
+            await asyncio.sleep(0)
+        idle = (tracemalloc.get_traced_memory()[0] - before) / subscribers
+        tracemalloc.stop()
+
+        def burst():
+            for price in range(1, ticks + 1):
+                for name in names:
+                    streams.broker.publish_price(name, to_micros(price))
+
+        started = time.perf_counter()
+        await loop.run_in_executor(None, burst)
+        published = time.perf_counter() - started
+        await asyncio.wait_for(done.wait(), 60)
+        fan_out = time.perf_counter() - started
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return idle, published, fan_out, delivered
+
+    def handle(self, *args, **options):
+        subscribers, tickers, ticks = options['subscribers'], options['tickers'], options['ticks']
+        # A private broker, so the benchmark never touches streams of a running server.
+        shared, streams.broker = streams.broker, Broker()
+        try:
+            idle, published, fan_out, delivered = asyncio.run(self.run(subscribers, tickers, ticks))
+            stats = streams.broker.stats()
+        finally:
+            streams.broker = shared
+        fanned = ticks * subscribers
+        self.stdout.write(f'idle streams       {subscribers:8d}')
+        self.stdout.write(f'memory per stream  {idle / 1024:8.2f}KiB ({idle * subscribers / 2 ** 20:.1f}MiB total)')
+        self.stdout.write(f'ticks published    {ticks * tickers:8d} in {published * 1e3:.1f}ms')
+        self.stdout.write(f'streams current    {fan_out * 1e3:8.1f}ms after the first tick')
+        self.stdout.write(f'events delivered   {delivered:8d} of {fanned} fanned out, '
+                          f'{1 - delivered / fanned:.1%} coalesced away')
+        self.stdout.write(f'remaining streams  {stats["subscribers"]:8d}')
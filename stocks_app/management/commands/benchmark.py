@@ -0,0 +1,80 @@
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from stocks_app.authentication import generate_jwt
+from stocks_app.benchmarks import report, scenarios, seed
+from stocks_app.benchmarks.load import run_http
+from stocks_app.benchmarks.runner import run_client
+
+
+class Command(BaseCommand):
+    """
+    Runs every endpoint of `stocks_app/urls.py` against the data made by
+    `seed_benchmark` and reports throughput, p50/p95/p99 latency and queries
+    per request. In `client` mode requests go through the Django test client
+    in this process; in `http` mode a running server at `--url` is loaded
+    from several processes, e.g.
+
+        python manage.py benchmark --output baseline.json
+        python manage.py benchmark --baseline baseline.json --tolerance 0.2
+        python manage.py benchmark --mode http --url http://127.0.0.1:8000 --processes 4
+
+    With `--baseline` the run is compared with a stored result and the
+    command fails when a number is worse by more than the tolerance, or a
+    scenario runs more queries than before. The order scenarios change the
+    seeded balances and positions, so reseed before comparing long runs.
+    Orders filled by the sequencer's worker threads are not included in the
+    query counts.
+    """
+    help = 'Benchmark every endpoint and compare with a stored baseline.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=['client', 'http'], default='client')
+        parser.add_argument('--scenario', action='append', dest='scenarios',
+                            help='Only run this scenario; may be given several times.')
+        parser.add_argument('--requests', type=int, default=50, help='Requests per scenario in client mode.')
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Server to load in http mode.')
+        parser.add_argument('--processes', type=int, default=4)
+        parser.add_argument('--connections', type=int, default=8, help='Connections per process in http mode.')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds per scenario in http mode.')
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+        parser.add_argument('--baseline', help='Compare with the results in this JSON file.')
+        parser.add_argument('--tolerance', type=float, default=0.2)
+
+    def handle(self, *args, **options):
+        try:
+            context = seed.benchmark_context()
+        except LookupError as e:
+            raise CommandError(str(e))
+        salt = uuid.uuid4().hex[:8]
+        try:
+            selected = scenarios.select(scenarios.build(context, salt), options['scenarios'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        auth_user = User.objects.get(username=seed.AUTH_USERNAME)
+
+        if options['mode'] == 'client':
+            summaries = run_client(selected, auth_user, options['requests'])
+            current = report.results('client', summaries, requests=options['requests'])
+        else:
+            summaries = run_http(selected, context, options['url'], generate_jwt(auth_user), options['processes'],
+                                 options['connections'], options['duration'], salt)
+            current = report.results('http', summaries, url=options['url'], processes=options['processes'],
+                                     connections=options['connections'], duration=options['duration'])
+
+        self.stdout.write(report.format_table(current))
+        if options['output']:
+            report.save(current, options['output'])
+
+        if options['baseline']:
+            baseline = report.load(options['baseline'])
+            if baseline.get('mode') != current['mode']:
+                raise CommandError(f'The baseline was run in {baseline.get("mode")} mode, not {current["mode"]}.')
+            regressions = report.compare(current, baseline, options['tolerance'])
+            for name, key, old, new in regressions:
+                self.stderr.write(f'{name}: {key} {old} -> {new}')
+            if regressions:
+                raise CommandError(f'{len(regressions)} numbers regressed beyond the baseline.')
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
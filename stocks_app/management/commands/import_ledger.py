@@ -0,0 +1,68 @@
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from stocks_app.imports import FORMATS, LedgerImporter, chunked, open_source, read_rows, source_format
+
+
+class Command(BaseCommand):
+    """
+    Loads historical fills from a CSV or NDJSON file, read as a stream so
+    the file can be of any size and memory stays flat. Each record has
+    `user`, `ticker`, `transaction_type`, `transaction_volume` and optionally
+    `transaction_price` and `created_at`, see `LedgerImporter`; with `--ids`
+    a history export can be loaded back as is.
+
+    Rows are checked and inserted one chunk at a time, with `COPY` on
+    PostgreSQL. At the end the balance of every user is changed by the net
+    cash flow of their imported fills in one pass, and the `Position` table
+    is rebuilt from the ledger unless `--skip-positions` is given. The import
+    is one transaction: if more rows are rejected than `--max-errors`,
+    nothing is kept.
+
+        python manage.py import_ledger fills.csv.gz
+        python manage.py import_ledger export.ndjson --ids --no-balances
+    """
+    help = 'Import historical transactions from a CSV or NDJSON file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to read, optionally gzipped, or '-' for stdin.")
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to the file extension.')
+        parser.add_argument('--chunk-size', type=int, default=10000)
+        parser.add_argument('--ids', action='store_true',
+                            help='Read `user` and `ticker` as primary keys instead of username and ticker.')
+        parser.add_argument('--no-balances', action='store_true',
+                            help='Leave balances alone, e.g. when they already include these fills.')
+        parser.add_argument('--skip-positions', action='store_true',
+                            help='Do not rebuild the Position table; run rebuild_positions later.')
+        parser.add_argument('--max-errors', type=int, default=0, help='Rejected rows to tolerate before aborting.')
+
+    def handle(self, *args, **options):
+        try:
+            fmt = source_format(options['path'], options['format'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        importer = LedgerImporter(by_id=options['ids'])
+        started = time.perf_counter()
+
+        with open_source(options['path']) as source, transaction.atomic():
+            for chunk in chunked(read_rows(source, fmt), options['chunk_size']):
+                importer.import_chunk(chunk)
+                if len(importer.errors) > options['max_errors']:
+                    break
+            for number, message in importer.errors[:20]:
+                self.stderr.write(f'line {number}: {message}')
+            if len(importer.errors) > options['max_errors']:
+                raise CommandError(f'More than {options["max_errors"]} rows rejected; nothing was imported.')
+            inserted = time.perf_counter() - started
+            changed = 0 if options['no_balances'] else importer.finish()
+            if not options['skip_positions']:
+                call_command('rebuild_positions', stdout=self.stdout)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {importer.imported:,} transactions in {inserted:.1f}s '
+            f'({importer.imported / max(inserted, 1e-9) * 60:,.0f} rows/min), {len(importer.errors)} rows rejected, '
+            f'{changed} balances updated.'
+        ))
@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from stocks_app.imports import FORMATS, StockImporter, chunked, open_source, read_rows, source_format
+
+
+class Command(BaseCommand):
+    """
+    Loads a stock universe from a CSV file with a `ticker,price` header or an
+    NDJSON file of `{"ticker": ..., "price": ...}` objects, read as a stream
+    so the file can be of any size. Prices are in whole units. Existing
+    tickers get the new price unless `--no-update` is given. The import is
+    one transaction: if more rows are rejected than `--max-errors`, nothing
+    is kept.
+
+        python manage.py import_stocks universe.csv
+        zcat universe.ndjson.gz | python manage.py import_stocks - --format ndjson
+    """
+    help = 'Import stocks from a CSV or NDJSON file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to read, optionally gzipped, or '-' for stdin.")
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to the file extension.')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--no-update', action='store_true', help='Leave the price of existing tickers alone.')
+        parser.add_argument('--max-errors', type=int, default=0, help='Rejected rows to tolerate before aborting.')
+
+    def handle(self, *args, **options):
+        try:
+            fmt = source_format(options['path'], options['format'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        importer = StockImporter(update=not options['no_update'])
+        started = time.perf_counter()
+
+        with open_source(options['path']) as source, transaction.atomic():
+            for chunk in chunked(read_rows(source, fmt), options['chunk_size']):
+                importer.import_chunk(chunk)
+                if len(importer.errors) > options['max_errors']:
+                    break
+            for number, message in importer.errors[:20]:
+                self.stderr.write(f'line {number}: {message}')
+            if len(importer.errors) > options['max_errors']:
+                raise CommandError(f'More than {options["max_errors"]} rows rejected; nothing was imported.')
+        importer.finish()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {importer.imported:,} stocks in {time.perf_counter() - started:.1f}s, '
+            f'{len(importer.errors)} rows rejected.'
+        ))
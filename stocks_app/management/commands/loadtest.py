@@ -0,0 +1,106 @@
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from stocks_app.authentication import generate_jwt
+
+
+class Command(BaseCommand):
+    """
+    Drives one or more running servers with many concurrent keep-alive
+    connections and reports requests/sec and tail latency for each. Start the
+    same project under both servers and point a target at each, e.g.
+
+        gunicorn -w 4 --threads 8 -b :8000 stocks_transactions_handler.wsgi
+        uvicorn --workers 4 --port 8001 stocks_transactions_handler.asgi:application
+        python manage.py loadtest --username alice --connections 500 \\
+            --target wsgi=http://127.0.0.1:8000/stocks/ \\
+            --target asgi=http://127.0.0.1:8001/async/stocks/
+
+    The client is plain asyncio, so 500+ connections cost one process.
+    """
+    help = 'Compare requests/sec and tail latency of running WSGI and ASGI servers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', action='append', required=True,
+                            help='name=url of an endpoint to load; may be given several times.')
+        parser.add_argument('--connections', type=int, default=500)
+        parser.add_argument('--duration', type=float, default=20.0)
+        parser.add_argument('--username', help='Auth user to issue a JWT for.')
+        parser.add_argument('--token', help='JWT to send instead of issuing one.')
+
+    async def connection(self, host, port, request, deadline, latencies, errors):
+        reader = writer = None
+        while time.perf_counter() < deadline:
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(host, port)
+                start = time.perf_counter()
+                writer.write(request)
+                await writer.drain()
+                head = await reader.readuntil(b'\r\n\r\n')
+                headers = head.decode('latin-1').lower()
+                length = 0
+                for line in headers.split('\r\n'):
+                    if line.startswith('content-length:'):
+                        length = int(line.split(':', 1)[1])
+                await reader.readexactly(length)
+                latencies.append(time.perf_counter() - start)
+                if not headers.startswith('http/1.1 2') and not headers.startswith('http/1.1 304'):
+                    errors[0] += 1
+                if 'connection: close' in headers:
+                    writer.close()
+                    writer = None
+            except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                errors[0] += 1
+                if writer is not None:
+                    writer.close()
+                writer = None
+                await asyncio.sleep(0.01)
+        if writer is not None:
+            writer.close()
+
+    async def run_target(self, url, token, connections, duration):
+        parts = urlsplit(url)
+        path = parts.path + (f'?{parts.query}' if parts.query else '')
+        request = (f'GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\n'
+                   f'Authorization: Bearer {token}\r\nConnection: keep-alive\r\n\r\n').encode()
+        latencies, errors = [], [0]
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*[
+            self.connection(parts.hostname, parts.port or 80, request, deadline, latencies, errors)
+            for _ in range(connections)
+        ])
+        return latencies, errors[0]
+
+    def handle(self, *args, **options):
+        token = options['token']
+        if token is None:
+            if not options['username']:
+                raise CommandError('Pass --token or --username.')
+            token = generate_jwt(User.objects.get(username=options['username']))
+
+        for target in options['target']:
+            name, _, url = target.partition('=')
+            if not url:
+                raise CommandError(f'Target must look like name=url, got {target!r}.')
+            latencies, errors = asyncio.run(
+                self.run_target(url, token, options['connections'], options['duration'])
+            )
+            latencies.sort()
+            count = len(latencies)
+            if not count:
+                self.stdout.write(f'{name}: no completed requests, {errors} errors')
+                continue
+
+            def percentile(p):
+                return latencies[min(count - 1, int(count * p))] * 1000
+
+            self.stdout.write(
+                f'{name}: {count / options["duration"]:.1f} req/s  p50 {percentile(0.50):.1f}ms  '
+                f'p95 {percentile(0.95):.1f}ms  p99 {percentile(0.99):.1f}ms  '
+                f'requests {count}  errors {errors}'
+            )
@@ -0,0 +1,21 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from stocks_app.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    """
+    Deletes the stored responses of idempotency keys older than
+    `IDEMPOTENCY_KEY_TTL`. Expired keys are already ignored by the order
+    endpoints; this only keeps the table small. Meant to be run from cron.
+    """
+    help = 'Delete expired idempotency keys.'
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+        deleted, _ = IdempotencyKey.objects.filter(created_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired idempotency keys.'))
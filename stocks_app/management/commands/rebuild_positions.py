@@ -0,0 +1,62 @@
+from itertools import chain
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from stocks_app.archive import archived_transactions
+from stocks_app.models import Transaction, Position
+
+
+class Command(BaseCommand):
+    """
+    Replays the whole ledger, archived months first, in (created_at, id) order to compute
+    every position from scratch. By default the `Position` table is replaced
+    with the result; with `--verify` it is only compared and any drift is
+    reported.
+    """
+    help = 'Rebuild or verify the Position table from the transaction ledger.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help='Compare the stored positions with the ledger without writing.')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def replay(self, chunk_size):
+        positions = {}
+        rows = Transaction.objects.order_by('created_at', 'id').values_list(
+            'user_id', 'ticker_id', 'transaction_type', 'transaction_volume', 'transaction_price'
+        ).iterator(chunk_size=chunk_size)
+        archived = ((row.user_id, row.ticker_id, row.transaction_type, row.transaction_volume, row.transaction_price)
+                    for row in archived_transactions())
+        for user_id, ticker_id, transaction_type, transaction_volume, transaction_price in chain(archived, rows):
+            position = positions.get((user_id, ticker_id))
+            if position is None:
+                position = positions[(user_id, ticker_id)] = Position(user_id=user_id, stock_id=ticker_id)
+            position.apply(transaction_type, transaction_volume, transaction_price)
+        return {key: position for key, position in positions.items() if position.quantity != 0}
+
+    def handle(self, *args, **options):
+        expected = self.replay(options['chunk_size'])
+
+        if options['verify']:
+            stored = {(p.user_id, p.stock_id): p for p in Position.objects.exclude(quantity=0)}
+            mismatches = 0
+            for key in expected.keys() | stored.keys():
+                want, have = expected.get(key), stored.get(key)
+                if (want is None or have is None or want.quantity != have.quantity
+                        or want.cost_basis != have.cost_basis):
+                    mismatches += 1
+                    self.stderr.write(
+                        f'user {key[0]} stock {key[1]}: ledger '
+                        f'{(want.quantity, want.cost_basis) if want else None}, stored '
+                        f'{(have.quantity, have.cost_basis) if have else None}'
+                    )
+            if mismatches:
+                raise CommandError(f'{mismatches} positions differ from the ledger.')
+            self.stdout.write(self.style.SUCCESS(f'{len(expected)} positions match the ledger.'))
+            return
+
+        with transaction.atomic():
+            Position.objects.all().delete()
+            Position.objects.bulk_create(expected.values(), batch_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(expected)} positions.'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from stocks_app.summaries import refresh_daily_rollup
+
+
+class Command(BaseCommand):
+    """
+    Folds the transactions added since the last run into the `DailyRollup`
+    table. Meant to be run periodically, e.g. from cron.
+    """
+    help = 'Incrementally refresh the daily per-ticker rollup table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Rebuild the rollup from the whole ledger instead of the new rows only.')
+
+    def handle(self, *args, **options):
+        rows, groups = refresh_daily_rollup(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(f'Rolled up {rows} transactions into {groups} daily rows.'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from stocks_app.journal import OrderJournal
+
+
+class Command(BaseCommand):
+    """
+    Applies the orders of a write-behind journal that never reached the
+    database, e.g. before starting a server after a crash. The server also
+    does this itself on its first order; the command just makes it explicit.
+    """
+    help = 'Replay unapplied orders from the write-behind order journal.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='Journal file; defaults to ORDER_JOURNAL_PATH.')
+
+    def handle(self, *args, **options):
+        journal = OrderJournal(path=options['path'])
+        replayed = journal.replay()
+        self.stdout.write(self.style.SUCCESS(
+            f'replayed {replayed} orders from {journal.path}: {journal.applied} filled, '
+            f'{journal.rejected} rejected, journal at sequence {journal.sequence}'
+        ))
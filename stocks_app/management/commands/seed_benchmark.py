@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from stocks_app.benchmarks import seed
+
+
+class Command(BaseCommand):
+    """
+    Fills the database with synthetic users, stocks and transactions for the
+    `benchmark` command, e.g. ten million trades on a throwaway SQLite file:
+
+        DB_SQLITE_PATH=/tmp/bench.sqlite3 python manage.py migrate
+        DB_SQLITE_PATH=/tmp/bench.sqlite3 python manage.py seed_benchmark --transactions 10000000
+
+    Earlier benchmark data is deleted first; other rows are left alone.
+    """
+    help = 'Seed synthetic users, stocks and transactions for the benchmarks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--stocks', type=int, default=100)
+        parser.add_argument('--transactions', type=int, default=100000)
+        parser.add_argument('--days', type=int, default=365, help='Spread the trades over this many days.')
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed; the same seed gives the same data.')
+
+    def handle(self, *args, **options):
+        seed.clear()
+        started = time.perf_counter()
+        total = options['transactions']
+
+        def progress(inserted):
+            if inserted % (options['batch_size'] * 10) == 0 or inserted == total:
+                rate = inserted / (time.perf_counter() - started)
+                self.stdout.write(f'{inserted:,}/{total:,} transactions, {rate:,.0f}/s')
+
+        seed.seed(options['users'], options['stocks'], total, options['days'], options['batch_size'],
+                  options['seed'], progress)
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {options["users"]} users, {options["stocks"]} stocks and {total:,} transactions '
+            f'in {time.perf_counter() - started:.1f}s. Log in as {seed.AUTH_USERNAME!r} / {seed.AUTH_PASSWORD!r}.'
+        ))
@@ -0,0 +1,489 @@
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timezone as dt_timezone
+from heapq import heappush, heappop
+
+from django.db import transaction
+from django.db.models import Max
+from rest_framework import status
+
+from .journal import TRANSIENT_ERRORS
+from .models import users, Order, Position, Stock, Transaction
+from .orders import MAX_MICROS, MAX_ORDER_VOLUME, OrderError, order_total, record_trades
+from .prices import price_cache
+
+logger = logging.getLogger(__name__)
+
+# Plain module constants keep model class attribute lookups out of the hot path.
+BUY, SELL = Transaction.BUY, Transaction.SELL
+OPEN, FILLED, CANCELLED = Order.OPEN, Order.FILLED, Order.CANCELLED
+
+
+class FlushError(OrderError):
+    """
+    Raised by `MatchingEngine.flush` when buffered orders could not be written.
+    They were taken back out of the books with their fills; `rejected` holds their ids.
+    """
+
+    def __init__(self, rejected):
+        super().__init__("The order could not be saved.", status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.rejected = rejected
+
+
+class BookOrder:
+    """ The in-memory state of one order while the engine owns it."""
+    __slots__ = ('id', 'user_id', 'stock_id', 'side', 'price', 'quantity', 'remaining', 'status', 'created_at')
+
+    def __init__(self, id, user_id, stock_id, side, price, quantity, remaining=None,
+                 status=OPEN, created_at=None):
+        self.id = id
+        self.user_id = user_id
+        self.stock_id = stock_id
+        self.side = side
+        self.price = price
+        self.quantity = quantity
+        self.remaining = quantity if remaining is None else remaining
+        self.status = status
+        self.created_at = time.time() if created_at is None else created_at
+
+
+class OrderBook:
+    """
+    The bids and asks of one stock. Each side is a dict of price level to a
+    FIFO deque of orders, plus a binary heap of the level prices (negated for
+    bids), so resting an order at an existing level is O(1) and only a new
+    level costs a heap push. Cancelled orders stay in their deque and are
+    skipped when they reach the front.
+    """
+    __slots__ = ('stock_id', 'bid_prices', 'bid_levels', 'ask_prices', 'ask_levels')
+
+    def __init__(self, stock_id):
+        self.stock_id = stock_id
+        self.bid_prices = []
+        self.bid_levels = {}
+        self.ask_prices = []
+        self.ask_levels = {}
+
+    def rest(self, order, front=False):
+        """
+        Queues an order at its price level.
+
+        @:param front : put it ahead of the level, for a filled order whose fill was taken back
+        """
+        if order.side == BUY:
+            prices, levels, key = self.bid_prices, self.bid_levels, -order.price
+        else:
+            prices, levels, key = self.ask_prices, self.ask_levels, order.price
+        level = levels.get(key)
+        if level is None:
+            levels[key] = deque((order,))
+            heappush(prices, key)
+        elif front:
+            level.appendleft(order)
+        else:
+            level.append(order)
+
+    def match(self, order, budget=None):
+        """
+        Matches an incoming order against the opposite side at the resting
+        orders' prices and returns the fills as `(resting order, price, quantity)`.
+
+        @:param budget : most micro-units a market buy may spend, or None for no limit
+        """
+        fills = []
+        if order.side == BUY:
+            prices, levels = self.ask_prices, self.ask_levels
+            limit = order.price
+        else:
+            prices, levels = self.bid_prices, self.bid_levels
+            limit = None if order.price is None else -order.price
+        remaining = order.remaining
+        while remaining and prices:
+            key = prices[0]
+            if limit is not None and key > limit:
+                break
+            level = levels[key]
+            while remaining and level:
+                resting = level[0]
+                if resting.status != OPEN:
+                    level.popleft()
+                    continue
+                quantity = remaining if remaining < resting.remaining else resting.remaining
+                if budget is not None:
+                    if budget < quantity * resting.price:
+                        quantity = budget // resting.price
+                        if not quantity:
+                            break
+                    budget -= quantity * resting.price
+                resting.remaining -= quantity
+                remaining -= quantity
+                fills.append((resting, resting.price, quantity))
+                if not resting.remaining:
+                    resting.status = FILLED
+                    level.popleft()
+            if not level:
+                del levels[key]
+                heappop(prices)
+            elif remaining:
+                # The budget ran out in front of this level.
+                break
+        order.remaining = remaining
+        return fills
+
+    def best(self, prices, levels):
+        while prices:
+            level = levels[prices[0]]
+            while level and level[0].status != OPEN:
+                level.popleft()
+            if level:
+                return level[0].price
+            del levels[prices[0]]
+            heappop(prices)
+        return None
+
+    def best_bid(self):
+        return self.best(self.bid_prices, self.bid_levels)
+
+    def best_ask(self):
+        return self.best(self.ask_prices, self.ask_levels)
+
+
+class MatchingEngine:
+    """
+    An in-process, price-time priority matching engine with one `OrderBook`
+    per stock. Limit orders rest until filled or cancelled; market orders take
+    what liquidity there is and the rest is cancelled.
+
+    Matching never touches the database. Order state changes and fills are
+    buffered and written by `flush()` in one transaction: orders go to the
+    `Order` table, and each fill becomes a buy and a sell `Transaction` with
+    the matching balance and position changes. Every `batch_size` buffered
+    fills trigger a flush on their own. `recover()` rebuilds the books from the
+    open `Order` rows, so the engine must be the only writer of that table.
+
+    An order is checked when it enters the book: a limit buy needs the balance
+    for its whole quantity at its limit price, a market buy spends at most the
+    balance, and a sell needs the shares. What resting orders promise is
+    reserved in memory, and fills not flushed yet are counted, so the stored
+    balance and position never go negative. Those checks read the stored
+    balance or position of the user, the only queries made before a flush, so
+    orders filled elsewhere are seen unless they land between a check and the
+    next flush. `check_funds=False` skips them for benchmarks of the bare books.
+
+    A flush that fails on a lost connection keeps everything buffered for the
+    next one. Any other failure writes the buffer again one incoming order at
+    a time, and the orders that still fail are taken back out of the books,
+    so one order that cannot be written never holds back the fills of others.
+    """
+
+    def __init__(self, batch_size=None, check_funds=True):
+        self.batch_size = batch_size
+        self.check_funds = check_funds
+        self.books = {}
+        self.open_orders = {}
+        self.next_id = 1
+        self.new_orders = {}
+        self.changed_orders = {}
+        self.fills = []
+        # Micro-units and shares promised by resting orders, and the changes of unflushed fills.
+        self.reserved_cash = defaultdict(int)
+        self.reserved_shares = defaultdict(int)
+        self.pending_cash = defaultdict(int)
+        self.pending_shares = defaultdict(int)
+        self.started = False
+        self.lock = threading.RLock()
+
+    @classmethod
+    def recover(cls, batch_size=None):
+        """ Builds an engine whose books hold every open order stored in the database."""
+        return cls(batch_size).start()
+
+    def start(self):
+        """ Loads the open orders and their reservations from the database, once."""
+        with self.lock:
+            if self.started:
+                return self
+            self.next_id = (Order.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+            for row in Order.objects.filter(status=OPEN).order_by('id').iterator():
+                order = BookOrder(row.id, row.user_id, row.stock_id, row.side, row.price, row.quantity,
+                                  row.remaining, row.status, row.created_at.timestamp())
+                self.book(order.stock_id).rest(order)
+                self.open_orders[order.id] = order
+                self.reserve(order, 1)
+            self.started = True
+        return self
+
+    def book(self, stock_id):
+        book = self.books.get(stock_id)
+        if book is None:
+            book = self.books[stock_id] = OrderBook(stock_id)
+        return book
+
+    def submit(self, user_id, stock_id, side, quantity, price=None):
+        """
+        Matches a new order and rests any limit remainder.
+
+        @:param price : limit price per share, or None for a market order
+        @:return : tuple of (the `BookOrder`, list of `(resting order, price, quantity)` fills)
+        """
+        if side not in (BUY, SELL):
+            raise OrderError("Side must be 'buy' or 'sell'.")
+        if not 0 < quantity <= MAX_ORDER_VOLUME:
+            raise OrderError(f"Quantity must be between 1 and {MAX_ORDER_VOLUME}.")
+        if price is not None and not 0 < price <= MAX_MICROS // quantity:
+            raise OrderError("Limit price must be positive and the order value not too large.")
+
+        now = time.time()
+        with self.lock:
+            budget = self.check(user_id, stock_id, side, quantity, price) if self.check_funds else None
+            order = BookOrder(self.next_id, user_id, stock_id, side, price, quantity, created_at=now)
+            self.next_id += 1
+            book = self.books.get(stock_id) or self.book(stock_id)
+            fills = book.match(order, budget)
+
+            if order.remaining and price is not None:
+                book.rest(order)
+                self.open_orders[order.id] = order
+                self.reserve(order, 1)
+            elif order.remaining:
+                order.status = CANCELLED
+            else:
+                order.status = FILLED
+
+            self.new_orders[order.id] = order
+            for resting, fill_price, fill_quantity in fills:
+                if resting.status == FILLED:
+                    del self.open_orders[resting.id]
+                if resting.id not in self.new_orders:
+                    self.changed_orders[resting.id] = resting
+                self.settle(order, resting, fill_price, fill_quantity)
+                self.fills.append((order, resting, fill_price, fill_quantity, now))
+
+            if self.batch_size and len(self.fills) >= self.batch_size:
+                self.flush()
+        return order, fills
+
+    def place(self, user_id, stock_id, side, quantity, price=None):
+        """
+        Submits an order and flushes it with its fills. An order that cannot be
+        written, even for a lost connection, is taken back out of the books, so
+        a caller is never told of fills that were not saved.
+
+        @:return : same as `submit`
+        @:raise FlushError : when the order was taken back
+        """
+        with self.lock:
+            order, fills = self.submit(user_id, stock_id, side, quantity, price)
+            try:
+                self.flush()
+            except FlushError as e:
+                if order.id in e.rejected:
+                    raise
+            except TRANSIENT_ERRORS:
+                logger.exception('Flushing order %d failed, taking it back', order.id)
+                raise FlushError(self.discard({order.id}))
+        return order, fills
+
+    def cancel(self, order_id):
+        """ Cancels a resting order. Returns False if it is not open any more."""
+        with self.lock:
+            order = self.open_orders.pop(order_id, None)
+            if order is None:
+                return False
+            order.status = CANCELLED
+            self.reserve(order, -1)
+            if order.id not in self.new_orders:
+                self.changed_orders[order.id] = order
+            return True
+
+    def check(self, user_id, stock_id, side, quantity, price):
+        """
+        Rejects an order the user cannot pay for or deliver.
+
+        @:return : the budget of a market buy, None otherwise
+        """
+        try:
+            price_cache.get(pk=stock_id)
+        except Stock.DoesNotExist:
+            raise OrderError("Stock not found.", status.HTTP_404_NOT_FOUND)
+        if side == SELL:
+            held = Position.objects.filter(user_id=user_id, stock_id=stock_id).values_list(
+                'quantity', flat=True).first() or 0
+            key = (user_id, stock_id)
+            if held + self.pending_shares[key] - self.reserved_shares[key] < quantity:
+                raise OrderError("You don't own enough shares to perform the transaction.")
+            return None
+
+        balance = users.objects.filter(pk=user_id).values_list('balance', flat=True).first()
+        if balance is None:
+            raise OrderError("User not found.", status.HTTP_404_NOT_FOUND)
+        available = balance + self.pending_cash[user_id] - self.reserved_cash[user_id]
+        if price is None:
+            return max(available, 0)
+        if available < order_total(price, quantity):
+            raise OrderError("You don't have enough balance to perform the transaction.")
+        return None
+
+    def reserve(self, order, sign):
+        """ Reserves (sign 1) or releases (sign -1) what the remainder of a resting order promises."""
+        self.reserve_part(order, sign * order.remaining)
+
+    def settle(self, incoming, resting, price, quantity):
+        """ Counts a fill against both users until it is flushed and frees its part of the resting reservation."""
+        self.count(incoming, resting, price, quantity)
+        self.reserve_part(resting, -quantity)
+
+    def count(self, incoming, resting, price, quantity):
+        buyer, seller = (incoming, resting) if incoming.side == BUY else (resting, incoming)
+        value = price * quantity
+        self.pending_cash[buyer.user_id] -= value
+        self.pending_cash[seller.user_id] += value
+        self.pending_shares[(buyer.user_id, buyer.stock_id)] += quantity
+        self.pending_shares[(seller.user_id, seller.stock_id)] -= quantity
+
+    def reserve_part(self, order, quantity):
+        if order.side == BUY:
+            self.reserved_cash[order.user_id] += order.price * quantity
+        else:
+            self.reserved_shares[(order.user_id, order.stock_id)] += quantity
+
+    def recount(self):
+        """ Rebuilds the pending changes from the fills still buffered."""
+        self.pending_cash.clear()
+        self.pending_shares.clear()
+        for incoming, resting, price, quantity, _ in self.fills:
+            self.count(incoming, resting, price, quantity)
+
+    def flush(self):
+        """
+        Persists buffered orders and fills in one transaction. Returns the number of fills written.
+
+        @:raise FlushError : when orders that could not be written were taken back
+        """
+        with self.lock:
+            fills = self.fills
+            try:
+                self.persist(self.new_orders.values(), self.changed_orders.values(), fills)
+            except TRANSIENT_ERRORS:
+                # Keep everything buffered so the next flush retries it.
+                raise
+            except Exception:
+                logger.exception('Matching batch of %d orders failed, writing them one at a time',
+                                 len(self.new_orders))
+                try:
+                    rejected = self.persist_each()
+                finally:
+                    self.recount()
+                if rejected:
+                    raise FlushError(rejected)
+                return len(fills)
+            self.new_orders, self.changed_orders, self.fills = {}, {}, []
+            # The stored balances and positions include the fills now.
+            self.recount()
+            return len(fills)
+
+    def persist_each(self):
+        """
+        Writes the buffer one incoming order at a time, each with its fills
+        and the resting orders they changed, and discards the orders that fail
+        on their own. A lost connection stops it with the rest still buffered.
+
+        @:return : set of the ids of the discarded orders
+        """
+        fills_by_order = defaultdict(list)
+        for fill in self.fills:
+            fills_by_order[fill[0].id].append(fill)
+        rejected = set()
+        for order_id in sorted(self.new_orders):
+            order = self.new_orders.get(order_id)
+            if order is None:
+                # Discarded with an order it traded with.
+                continue
+            fills = fills_by_order[order_id]
+            try:
+                self.persist([order], [resting for _, resting, *_ in fills], fills)
+            except TRANSIENT_ERRORS:
+                raise
+            except Exception as e:
+                logger.error('Rejected order %d: %r', order_id, e)
+                rejected |= self.discard({order_id})
+                continue
+            del self.new_orders[order_id]
+            self.fills = [fill for fill in self.fills if fill[0] is not order]
+            for _, resting, *_ in fills:
+                self.changed_orders.pop(resting.id, None)
+        # Cancellations, and resting orders whose fills were taken back.
+        self.persist([], self.changed_orders.values(), [])
+        self.changed_orders = {}
+        return rejected
+
+    def discard(self, order_ids):
+        """
+        Takes buffered orders back out of the books with their fills, along
+        with every later buffered order that traded with one of them. The
+        resting orders they filled get those shares back, at the front of
+        their price level.
+
+        @:return : set of the ids of the discarded orders
+        """
+        with self.lock:
+            fills_by_order = defaultdict(list)
+            for fill in self.fills:
+                fills_by_order[fill[0].id].append(fill)
+            discarded = set()
+            for order_id in sorted(self.new_orders):
+                traded = any(resting.id in discarded for _, resting, *_ in fills_by_order[order_id])
+                if order_id in order_ids or traded:
+                    discarded.add(order_id)
+
+            # Newest first, so every fill is undone before the order it filled.
+            for order_id in sorted(discarded, reverse=True):
+                order = self.new_orders.pop(order_id)
+                for _, resting, _, quantity, _ in reversed(fills_by_order[order_id]):
+                    resting.remaining += quantity
+                    if resting.status == FILLED:
+                        resting.status = OPEN
+                        self.open_orders[resting.id] = resting
+                        self.book(resting.stock_id).rest(resting, front=True)
+                    if resting.status == OPEN:
+                        self.reserve_part(resting, quantity)
+                    if resting.id not in self.new_orders:
+                        self.changed_orders[resting.id] = resting
+                if self.open_orders.pop(order_id, None) is not None:
+                    self.reserve(order, -1)
+                order.status = CANCELLED
+            self.fills = [fill for fill in self.fills if fill[0].id not in discarded]
+            self.recount()
+            return discarded
+
+    def persist(self, new_orders, changed_orders, fills):
+        trades = []
+        for incoming, resting, price, quantity, filled_at in fills:
+            created_at = datetime.fromtimestamp(filled_at, dt_timezone.utc)
+            for order in (incoming, resting):
+                trades.append(Transaction(
+                    user_id=order.user_id,
+                    ticker_id=order.stock_id,
+                    transaction_type=order.side,
+                    transaction_volume=quantity,
+                    transaction_price=price * quantity,
+                    created_at=created_at,
+                ))
+
+        with transaction.atomic():
+            Order.objects.bulk_create([
+                Order(id=order.id, user_id=order.user_id, stock_id=order.stock_id, side=order.side,
+                      order_type=Order.MARKET if order.price is None else Order.LIMIT, price=order.price,
+                      quantity=order.quantity, remaining=order.remaining, status=order.status,
+                      created_at=datetime.fromtimestamp(order.created_at, dt_timezone.utc))
+                for order in new_orders
+            ])
+            Order.objects.bulk_update([
+                Order(id=order.id, remaining=order.remaining, status=order.status) for order in changed_orders
+            ], ['remaining', 'status'])
+            record_trades(trades)
+
+
+engine = MatchingEngine()
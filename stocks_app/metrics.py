@@ -0,0 +1,275 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from rest_framework.renderers import JSONRenderer
+
+# Per-request phase totals, set by `MetricsMiddleware` for the duration of a request.
+current_request = ContextVar('current_request', default=None)
+
+
+class Histogram:
+    """
+    A log-linear histogram in the style of HdrHistogram. Every power of two
+    is split into `2 ** precision_bits` equal buckets, so any recorded value
+    is within 1 / 2 ** precision_bits of its bucket bound (12.5% with the
+    default 3 bits) while the whole range up to hours in microseconds fits in
+    a few hundred buckets. Bucket bounds never change, so Prometheus sees the
+    same `le` labels on every scrape.
+
+    Values are recorded as integers of `1 / scale` units, e.g. microseconds
+    for a histogram of seconds with `scale=1_000_000`.
+    """
+
+    def __init__(self, scale=1, precision_bits=3):
+        self.scale = scale
+        self.precision_bits = precision_bits
+        self.sub_buckets = 1 << precision_bits
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self._lock = threading.Lock()
+
+    def index(self, value):
+        if value < self.sub_buckets:
+            return value
+        shift = value.bit_length() - self.precision_bits - 1
+        return ((shift + 1) << self.precision_bits) + (value >> shift) - self.sub_buckets
+
+    def upper_bound(self, index):
+        """ The largest integer value that falls in bucket `index`."""
+        if index < self.sub_buckets:
+            return index
+        shift = (index >> self.precision_bits) - 1
+        return ((self.sub_buckets + (index & (self.sub_buckets - 1)) + 1) << shift) - 1
+
+    def record(self, value):
+        with self._lock:
+            self.record_locked(value)
+
+    def record_locked(self, value):
+        """ `record` for a caller that already holds `_lock`, or records from one thread only."""
+        value = int(value * self.scale)
+        if value < 0:
+            value = 0
+        index = value if value < self.sub_buckets else self.index(value)
+        counts = self.counts
+        counts[index] = counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """ Returns the upper bound of the bucket holding the q-quantile, in the recorded unit."""
+        with self._lock:
+            counts, count = sorted(self.counts.items()), self.count
+        if not count:
+            return None
+        rank = max(math.ceil(q * count), 1)
+        seen = 0
+        for index, bucket in counts:
+            seen += bucket
+            if seen >= rank:
+                return min(self.upper_bound(index), self.max) / self.scale
+        return self.max / self.scale
+
+    def snapshot(self):
+        with self._lock:
+            return sorted(self.counts.items()), self.count, self.total
+
+    def reset(self):
+        with self._lock:
+            self.counts.clear()
+            self.count = self.total = self.max = 0
+
+
+class Registry:
+    """
+    The histograms and counters of one process, keyed by metric name and
+    label values, rendered in the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.help = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, labels=(), scale=1_000_000, help_text=''):
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(key, Histogram(scale))
+                self.help.setdefault(name, help_text)
+        return histogram
+
+    def increment(self, name, labels=(), amount=1, help_text=''):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+            self.help.setdefault(name, help_text)
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+        routes.clear()
+
+    def labels(self, labels, extra=()):
+        pairs = [f'{key}="{str(value)}"' for key, value in (*labels, *extra)]
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def render(self):
+        lines = []
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+
+        described = set()
+        for (name, labels), value in counters:
+            if name not in described:
+                described.add(name)
+                lines.append(f'# HELP {name} {self.help.get(name, "")}')
+                lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name}{self.labels(labels)} {value}')
+
+        for (name, labels), histogram in histograms:
+            if name not in described:
+                described.add(name)
+                lines.append(f'# HELP {name} {self.help.get(name, "")}')
+                lines.append(f'# TYPE {name} histogram')
+            counts, count, total = histogram.snapshot()
+            highest = counts[-1][0] if counts else -1
+            recorded = dict(counts)
+            cumulative = 0
+            for index in range(highest + 1):
+                cumulative += recorded.get(index, 0)
+                bound = (histogram.upper_bound(index) + 1) / histogram.scale
+                lines.append(f'{name}_bucket{self.labels(labels, [("le", repr(bound))])} {cumulative}')
+            lines.append(f'{name}_bucket{self.labels(labels, [("le", "+Inf")])} {count}')
+            lines.append(f'{name}_sum{self.labels(labels)} {total / histogram.scale}')
+            lines.append(f'{name}_count{self.labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class RequestTimings:
+    """ What one request spent in each instrumented phase, in seconds, and how many queries it ran."""
+    __slots__ = ('phases', 'queries', 'query_time')
+
+    def __init__(self):
+        self.phases = {}
+        self.queries = 0
+        self.query_time = 0.0
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+
+""" Adds the time since `started` to a phase of the current request, if one is being measured."""
+
+
+def add_phase(phase, started):
+    timings = current_request.get()
+    if timings is not None:
+        timings.add(phase, time.perf_counter() - started)
+
+
+""" Times the block as a phase of the current request."""
+
+
+@contextmanager
+def phase(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_phase(name, started)
+
+
+""" A `connection.execute_wrapper` that counts and times the queries of the current request."""
+
+
+def record_query(execute, sql, params, many, context):
+    timings = current_request.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.queries += 1
+        timings.query_time += time.perf_counter() - started
+
+
+""" Adds `record_query` to a new connection once; connected to `connection_created`."""
+
+
+def install_query_wrapper(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class RouteMetrics:
+    """
+    The histograms of one route and method, looked up once per request and
+    updated under a single lock, which keeps the per-request cost to a few
+    microseconds.
+    """
+
+    def __init__(self, route, method):
+        self.labels = (('route', route), ('method', method))
+        self.lock = threading.Lock()
+        self.duration = registry.histogram('http_request_duration_seconds', self.labels,
+                                           help_text='Time from the middleware to the response, by route.')
+        self.queries = registry.histogram('http_request_db_queries', self.labels, scale=1,
+                                          help_text='Database queries per request, by route.')
+        self.query_time = registry.histogram('http_request_db_seconds', self.labels,
+                                             help_text='Time spent in database queries per request, by route.')
+        self.phases = {}
+
+    def phase(self, name):
+        histogram = self.phases.get(name)
+        if histogram is None:
+            histogram = self.phases[name] = registry.histogram(
+                'http_request_phase_seconds', self.labels + (('phase', name),),
+                help_text='Time spent in auth, serialization and rendering per request.')
+        return histogram
+
+    def observe(self, seconds, timings):
+        with self.lock:
+            self.duration.record_locked(seconds)
+            self.queries.record_locked(timings.queries)
+            self.query_time.record_locked(timings.query_time)
+            for name, spent in timings.phases.items():
+                self.phase(name).record_locked(spent)
+
+
+routes = {}
+
+
+""" Records one finished request into the registry."""
+
+
+def observe(route, method, status_code, seconds, timings):
+    metrics = routes.get((route, method))
+    if metrics is None:
+        metrics = routes.setdefault((route, method), RouteMetrics(route, method))
+    metrics.observe(seconds, timings)
+    registry.increment('http_requests_total', metrics.labels + (('status', status_code),),
+                       help_text='Requests served, by route, method and status.')
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """ DRF's JSON renderer, timed as the render phase of the current request."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with phase('render'):
+            return super().render(data, accepted_media_type, renderer_context)
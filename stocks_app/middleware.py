@@ -0,0 +1,124 @@
+import cProfile
+import itertools
+import os
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .metrics import RequestTimings, current_request, observe
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+
+class RequestProfiler:
+    """
+    Profiles one request in `PROFILE_SAMPLE_RATE` and writes the result to
+    `PROFILE_DIR`, as a `.prof` file for `python -m pstats` or snakeviz, or
+    as an HTML flame view when `PROFILER = 'pyinstrument'` and pyinstrument
+    is installed. A rate of 0 turns sampling off.
+    """
+
+    def __init__(self):
+        self.counter = itertools.count(1)
+
+    def sampled(self):
+        """ Returns the number of this request when it should be profiled, else 0."""
+        rate = getattr(settings, 'PROFILE_SAMPLE_RATE', 0)
+        if rate <= 0:
+            return 0
+        number = next(self.counter)
+        return number if number % rate == 0 else 0
+
+    def start(self):
+        if getattr(settings, 'PROFILER', 'cprofile') == 'pyinstrument' and pyinstrument is not None:
+            profiler = pyinstrument.Profiler()
+            profiler.start()
+            return profiler
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def finish(self, profiler, request, number):
+        directory = str(getattr(settings, 'PROFILE_DIR', settings.BASE_DIR / 'profiles'))
+        os.makedirs(directory, exist_ok=True)
+        name = request.path.strip('/').replace('/', '_') or 'root'
+        path = os.path.join(directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{number}-{name}')
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+            profiler.dump_stats(path + '.prof')
+        else:
+            profiler.stop()
+            with open(path + '.html', 'w') as output:
+                output.write(profiler.output_html())
+
+
+class MetricsMiddleware:
+    """
+    Times every request and records, per URL route, its duration, the number
+    and total time of its database queries, and the time spent in the auth,
+    serialize and render phases into the histograms served at `metrics/`.
+    Queries are counted by the `execute_wrapper` that every connection gets
+    when it opens, and DRF responses are timed by `TimedJSONRenderer`.
+    Phases overlap: the user lookup of the JWT check counts as both auth and
+    database time.
+
+    Works for both sync and async views; only sync requests are sampled by
+    the profiler. Streamed bodies are not included in the duration. With
+    sampling off the cost is two clock reads, a context variable and a few
+    histogram updates per request.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.profiler = RequestProfiler()
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            return self.get_response(request)
+        timings = RequestTimings()
+        token = current_request.set(timings)
+        number = self.profiler.sampled()
+        profiler = self.profiler.start() if number else None
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            if profiler is not None:
+                try:
+                    self.profiler.finish(profiler, request, number)
+                except OSError:
+                    # A profile that cannot be written must not fail the request.
+                    pass
+            current_request.reset(token)
+        self.finish(request, response, started, timings)
+        return response
+
+    async def __acall__(self, request):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            return await self.get_response(request)
+        timings = RequestTimings()
+        token = current_request.set(timings)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request.reset(token)
+        self.finish(request, response, started, timings)
+        return response
+
+    def finish(self, request, response, started, timings):
+        match = request.resolver_match
+        route = match.route if match is not None else 'unmatched'
+        observe(route, request.method, response.status_code, time.perf_counter() - started, timings)
+
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks_app', '0002_rename_user_users'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stock',
+            name='ticker',
+            field=models.CharField(max_length=50, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='users',
+            name='username',
+            field=models.CharField(max_length=50, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user', 'created_at'], name='transaction_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['ticker', 'created_at'], name='transaction_ticker_created_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks_app', '0003_transaction_history_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Position',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField(default=0)),
+                ('cost_basis', models.FloatField(default=0)),
+                ('stock', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='stocks_app.stock')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='stocks_app.users')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'stock'), name='position_user_stock_unique')],
+            },
+        ),
+    ]
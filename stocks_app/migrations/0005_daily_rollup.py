@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks_app', '0004_position'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_transaction_id', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('volume', models.BigIntegerField(default=0)),
+                ('notional', models.FloatField(default=0)),
+                ('buy_count', models.IntegerField(default=0)),
+                ('sell_count', models.IntegerField(default=0)),
+                ('stock', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='stocks_app.stock')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('date', 'stock'), name='daily_rollup_date_stock_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:00
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks_app', '0005_daily_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Order',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('side', models.CharField(choices=[('buy', 'buy'), ('sell', 'sell')], max_length=5)),
+                ('order_type', models.CharField(choices=[('limit', 'limit'), ('market', 'market')], max_length=6)),
+                ('price', models.FloatField(blank=True, null=True)),
+                ('quantity', models.IntegerField()),
+                ('remaining', models.IntegerField()),
+                ('status', models.CharField(choices=[('open', 'open'), ('filled', 'filled'), ('cancelled', 'cancelled')], default='open', max_length=9)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('stock', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='stocks_app.stock')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='stocks_app.users')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['stock', 'status'], name='order_stock_status_idx')],
+            },
+        ),
+    ]
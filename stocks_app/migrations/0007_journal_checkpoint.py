@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks_app', '0006_order'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JournalCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('last_sequence', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:40
+
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Round
+
+# Copied from stocks_app.money so the migration does not change if the module does.
+SCALE = 1_000_000
+
+FLOAT_COLUMNS = [
+    ('Stock', 'price'),
+    ('Transaction', 'transaction_price'),
+    ('Position', 'cost_basis'),
+    ('DailyRollup', 'notional'),
+    ('Order', 'price'),
+]
+
+
+def scale_to_micros(apps, schema_editor):
+    # Float columns are scaled while they are still floats, so the type change
+    # that follows only drops the fraction left by float rounding.
+    for model, field in FLOAT_COLUMNS:
+        apps.get_model('stocks_app', model).objects.update(**{field: Round(F(field) * SCALE)})
+    apps.get_model('stocks_app', 'users').objects.update(balance=F('balance') * SCALE)
+
+
+def scale_from_micros(apps, schema_editor):
+    for model, field in FLOAT_COLUMNS:
+        apps.get_model('stocks_app', model).objects.update(**{field: F(field) / float(SCALE)})
+    apps.get_model('stocks_app', 'users').objects.update(balance=F('balance') / SCALE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks_app', '0008_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='users',
+            name='balance',
+            field=models.BigIntegerField(),
+        ),
+        migrations.RunPython(scale_to_micros, scale_from_micros),
+        migrations.AlterField(
+            model_name='stock',
+            name='price',
+            field=models.BigIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='transaction_price',
+            field=models.BigIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='position',
+            name='cost_basis',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='dailyrollup',
+            name='notional',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='price',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
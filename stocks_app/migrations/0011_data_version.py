@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:35
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def create_stocks_version(apps, schema_editor):
+    apps.get_model('stocks_app', 'DataVersion').objects.get_or_create(name='stocks')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks_app', '0010_transaction_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('version', models.BigIntegerField(default=0)),
+                ('modified_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RunPython(create_stocks_version, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def index_archives(apps, schema_editor):
+    """ Reads the files archived before the index existed; missing files are left unindexed."""
+    import gzip
+    import json
+    import os
+    from datetime import datetime
+
+    TransactionArchiveUser = apps.get_model('stocks_app', 'TransactionArchiveUser')
+    for archive in apps.get_model('stocks_app', 'TransactionArchive').objects.all():
+        if not os.path.exists(archive.path):
+            continue
+        users = {}
+        with gzip.open(archive.path, 'rb') as lines:
+            for line in lines:
+                record = json.loads(line)
+                created_at = datetime.fromisoformat(record['created_at'])
+                entry = users.setdefault(record['user_id'], [0, created_at, created_at])
+                entry[0] += 1
+                entry[2] = created_at
+        TransactionArchiveUser.objects.bulk_create(
+            TransactionArchiveUser(archive=archive, user_id=user_id, row_count=count, first_at=first_at, last_at=last_at)
+            for user_id, (count, first_at, last_at) in users.items()
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks_app', '0011_data_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionArchiveUser',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.BigIntegerField()),
+                ('row_count', models.IntegerField(default=0)),
+                ('first_at', models.DateTimeField()),
+                ('last_at', models.DateTimeField()),
+                ('archive', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='users', to='stocks_app.transactionarchive')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user_id', 'archive'), name='archive_user_unique')],
+            },
+        ),
+        migrations.RunPython(index_archives, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,105 @@
+import re
+from datetime import datetime, timedelta
+
+from django.db import migrations
+from django.utils import timezone
+
+TABLE = 'stocks_app_transaction'
+MONTHS_AHEAD = 3
+
+
+def months(first, last):
+    year, month = first.year, first.month
+    while (year, month) <= (last.year, last.month):
+        start = timezone.make_aware(datetime(year, month, 1))
+        year, month = year + month // 12, month % 12 + 1
+        yield start, timezone.make_aware(datetime(year, month, 1))
+
+
+def replace_table(cursor, partition_by=''):
+    """
+    Renames the table to `<table>_old` and creates an empty copy of its columns
+    under the old name. Returns the index definitions and foreign keys of the
+    old table, to be recreated by `finish_table` once it is dropped and their
+    names are free.
+    """
+    cursor.execute("SELECT indexdef FROM pg_indexes WHERE tablename = %s AND indexname NOT LIKE %s",
+                   [TABLE, '%_pkey'])
+    indexes = [re.sub(r' ON (ONLY )?(\S+\.)?"?\w+"? ', f' ON {TABLE} ', row[0], count=1) for row in cursor.fetchall()]
+    cursor.execute("SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+                   "WHERE conrelid = %s::regclass AND contype = 'f'", [TABLE])
+    foreign_keys = cursor.fetchall()
+
+    cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {TABLE}_old')
+    cursor.execute(f'CREATE TABLE {TABLE} (LIKE {TABLE}_old INCLUDING DEFAULTS INCLUDING CONSTRAINTS) {partition_by}')
+    return indexes, foreign_keys
+
+
+def finish_table(cursor, indexes, foreign_keys):
+    for index in indexes:
+        cursor.execute(index)
+    for name, definition in foreign_keys:
+        cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {name} {definition}')
+
+
+""" Turns `Transaction` into a table range partitioned by month of `created_at`, on PostgreSQL only."""
+
+
+def partition_transactions(apps, schema_editor):
+    """
+    Postgres keeps each month in its own partition, so the history scans only
+    touch the months they ask for and archiving a month drops a partition
+    instead of deleting its rows. The primary key must include the partition
+    key, so it becomes (id, created_at), and the identity column becomes a
+    plain sequence default, since identity on partitioned tables needs
+    Postgres 17. Other databases keep the plain table and `archive_month`
+    deletes the archived rows instead.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        indexes, foreign_keys = replace_table(cursor, 'PARTITION BY RANGE (created_at)')
+        cursor.execute(f'SELECT min(created_at) FROM {TABLE}_old')
+        first = cursor.fetchone()[0] or timezone.now()
+        last = timezone.localtime(timezone.now())
+        for _ in range(MONTHS_AHEAD):
+            last = last.replace(day=28) + timedelta(days=4)
+        for start, end in months(timezone.localtime(first), last):
+            cursor.execute(f"CREATE TABLE {TABLE}_{start:%Y_%m} PARTITION OF {TABLE} "
+                           f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')")
+        cursor.execute(f'CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT')
+
+        cursor.execute(f'INSERT INTO {TABLE} SELECT * FROM {TABLE}_old')
+        cursor.execute(f'DROP TABLE {TABLE}_old')
+        cursor.execute(f'CREATE SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}.id')
+        cursor.execute(f"ALTER TABLE {TABLE} ALTER COLUMN id SET DEFAULT nextval('{TABLE}_id_seq')")
+        cursor.execute(f"SELECT setval('{TABLE}_id_seq', COALESCE((SELECT max(id) FROM {TABLE}), 0) + 1, false)")
+        cursor.execute(f'ALTER TABLE {TABLE} ADD PRIMARY KEY (id, created_at)')
+        finish_table(cursor, indexes, foreign_keys)
+
+
+def unpartition_transactions(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        indexes, foreign_keys = replace_table(cursor)
+        cursor.execute(f'ALTER TABLE {TABLE} ALTER COLUMN id DROP DEFAULT')
+        cursor.execute(f'INSERT INTO {TABLE} SELECT * FROM {TABLE}_old')
+        # Drops the partitions and the sequence with it.
+        cursor.execute(f'DROP TABLE {TABLE}_old CASCADE')
+        cursor.execute(f'ALTER TABLE {TABLE} ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY')
+        cursor.execute(f"SELECT setval(pg_get_serial_sequence('{TABLE}', 'id'), "
+                       f"COALESCE((SELECT max(id) FROM {TABLE}), 0) + 1, false)")
+        cursor.execute(f'ALTER TABLE {TABLE} ADD PRIMARY KEY (id)')
+        finish_table(cursor, indexes, foreign_keys)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stocks_app', '0012_transaction_archive_user'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_transactions, unpartition_transactions),
+    ]
@@ -1,5 +1,7 @@
 from django.utils import timezone
 from django.db import models
+from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
 
 
 class users(models.Model):
@@ -8,11 +10,11 @@ class users(models.Model):
     and balance. Each user can have multiple transactions associated with them.
 
     Fields:
-        - username: A name for the user.
-        - balance: The initial balance of the user.
+        - username: A unique name for the user.
+        - balance: The balance of the user, in micro-units (see `money.SCALE`).
     """
-    username = models.CharField(max_length=50)
-    balance = models.IntegerField()
+    username = models.CharField(max_length=50, unique=True)
+    balance = models.BigIntegerField()
 
     def __str__(self):
         return self.username
@@ -24,11 +26,11 @@ class Stock(models.Model):
     and price.
 
     Fields:
-        - ticker: The stock ticker symbol
-        - price: The current price of the stock.
+        - ticker: The unique stock ticker symbol
+        - price: The current price of the stock, in micro-units.
     """
-    ticker = models.CharField(max_length=50)
-    price = models.FloatField()
+    ticker = models.CharField(max_length=50, unique=True)
+    price = models.BigIntegerField()
 
     def __str__(self):
         return self.ticker
@@ -45,7 +47,7 @@ class Transaction(models.Model):
         - ticker: The stock involved in the transaction (ForeignKey Stock).
         - transaction_type: The type of transaction, 'buy' or 'sell'.
         - transaction_volume: The number of stocks quantity involved in the transaction.
-        - transaction_price: The total price of the transaction.
+        - transaction_price: The total price of the transaction, in micro-units.
         - created_at: The time when the transaction was created.
     """
     BUY = 'buy'
@@ -59,8 +61,262 @@ class Transaction(models.Model):
     ticker = models.ForeignKey(Stock, on_delete=models.CASCADE)
     transaction_type = models.CharField(max_length=5, choices=Transaction_type)
     transaction_volume = models.IntegerField()
-    transaction_price = models.FloatField()
+    transaction_price = models.BigIntegerField()
     created_at = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='transaction_user_created_idx'),
+            models.Index(fields=['ticker', 'created_at'], name='transaction_ticker_created_idx'),
+        ]
+
     def __str__(self):
         return f'{self.transaction_type} - {self.ticker}'
+
+
+class Position(models.Model):
+    """
+    This model stores how many shares of a stock a user currently holds. It is
+    kept in step with the ledger inside the same database transaction as every
+    buy or sell, so holdings can be read without scanning `Transaction`.
+
+    Fields:
+        - user: The user holding the shares (ForeignKey users).
+        - stock: The stock being held (ForeignKey Stock).
+        - quantity: The number of shares held.
+        - cost_basis: The total amount paid for the shares held, at average cost, in micro-units.
+    """
+    user = models.ForeignKey(users, on_delete=models.CASCADE)
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE)
+    quantity = models.IntegerField(default=0)
+    cost_basis = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'stock'], name='position_user_stock_unique'),
+        ]
+
+    def apply(self, transaction_type, transaction_volume, transaction_price):
+        """
+        Applies one fill to the position. A buy adds its full price to the cost
+        basis and a sell removes the average cost of the shares sold.
+        """
+        if transaction_type == Transaction.BUY:
+            self.quantity += transaction_volume
+            self.cost_basis += transaction_price
+        elif self.quantity > 0:
+            sold = min(transaction_volume, self.quantity)
+            self.cost_basis -= self.cost_basis * sold // self.quantity
+            self.quantity -= transaction_volume
+        else:
+            self.quantity -= transaction_volume
+        if self.quantity <= 0:
+            self.cost_basis = 0
+
+    def __str__(self):
+        return f'{self.user} - {self.stock}: {self.quantity}'
+
+
+class DailyRollup(models.Model):
+    """
+    This model stores precomputed daily totals of one stock, so dashboards can
+    read them without aggregating the ledger. It is refreshed incrementally by
+    the `refresh_rollups` management command.
+
+    Fields:
+        - date: The day the totals belong to.
+        - stock: The stock the totals belong to (ForeignKey Stock).
+        - volume: The number of shares traded that day.
+        - notional: The total price of all trades that day, in micro-units.
+        - buy_count: The number of buy transactions that day.
+        - sell_count: The number of sell transactions that day.
+    """
+    date = models.DateField()
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE)
+    volume = models.BigIntegerField(default=0)
+    notional = models.BigIntegerField(default=0)
+    buy_count = models.IntegerField(default=0)
+    sell_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'stock'], name='daily_rollup_date_stock_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.date} - {self.stock}'
+
+
+class RollupState(models.Model):
+    """
+    This model holds the single checkpoint row of the daily rollup.
+
+    Fields:
+        - last_transaction_id: The highest `Transaction` id already folded into `DailyRollup`.
+    """
+    last_transaction_id = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f'rollup up to {self.last_transaction_id}'
+
+
+class Order(models.Model):
+    """
+    This model stores an order handed to the matching engine. Resting limit
+    orders stay `open` until they are filled or cancelled, and the engine
+    rebuilds its order books from the open rows after a restart.
+
+    Fields:
+        - user: The user who placed the order (ForeignKey users).
+        - stock: The stock the order is for (ForeignKey Stock).
+        - side: Either 'buy' or 'sell'.
+        - order_type: Either 'limit' or 'market'.
+        - price: The limit price per share in micro-units, empty for market orders.
+        - quantity: The number of shares ordered.
+        - remaining: The number of shares not yet filled.
+        - status: Either 'open', 'filled' or 'cancelled'.
+        - created_at: The time when the order was accepted.
+    """
+    LIMIT = 'limit'
+    MARKET = 'market'
+    OPEN = 'open'
+    FILLED = 'filled'
+    CANCELLED = 'cancelled'
+
+    Order_type = [
+        (LIMIT, 'limit'),
+        (MARKET, 'market'),
+    ]
+    Order_status = [
+        (OPEN, 'open'),
+        (FILLED, 'filled'),
+        (CANCELLED, 'cancelled'),
+    ]
+    user = models.ForeignKey(users, on_delete=models.CASCADE)
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE)
+    side = models.CharField(max_length=5, choices=Transaction.Transaction_type)
+    order_type = models.CharField(max_length=6, choices=Order_type)
+    price = models.BigIntegerField(null=True, blank=True)
+    quantity = models.IntegerField()
+    remaining = models.IntegerField()
+    status = models.CharField(max_length=9, choices=Order_status, default=OPEN)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['stock', 'status'], name='order_stock_status_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.side} {self.remaining}/{self.quantity} {self.stock} @ {self.price}'
+
+
+class JournalCheckpoint(models.Model):
+    """
+    This model holds how far each write-behind order journal has been applied.
+
+    Fields:
+        - name: The path of the journal file.
+        - last_sequence: The highest journal sequence number already written to the ledger.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    last_sequence = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.name} up to {self.last_sequence}'
+
+
+class IdempotencyKey(models.Model):
+    """
+    This model stores the response to an order request sent with an
+    `Idempotency-Key` header, so a retry gets the same answer instead of a
+    second fill.
+
+    Fields:
+        - owner: The authenticated user who sent the key (ForeignKey User).
+        - key: The client supplied key, unique per owner.
+        - request_hash: The SHA-256 digest of the request body the key was first used with.
+        - status_code: The status of the stored response, empty while the first request is running.
+        - response: The stored response body.
+        - created_at: The time when the key was first seen.
+    """
+    owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'key'], name='idempotency_owner_key_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.owner_id}:{self.key}'
+
+
+class TransactionArchive(models.Model):
+    """
+    This model records one calendar month of `Transaction` rows that was moved
+    out of the table into a compressed file by `archive_transactions`.
+
+    Fields:
+        - month: The first day of the archived month.
+        - path: The gzip compressed NDJSON file holding the month's rows.
+        - row_count: The number of transactions in the file.
+        - archived_at: The time when the month was archived.
+    """
+    month = models.DateField(unique=True)
+    path = models.CharField(max_length=500)
+    row_count = models.IntegerField(default=0)
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f'{self.month:%Y-%m}: {self.row_count} transactions'
+
+
+class DataVersion(models.Model):
+    """
+    This model holds a counter that is bumped whenever a table changes, so
+    caches in every process can tell that what they hold is stale without a
+    shared cache backend.
+
+    Fields:
+        - name: The name of the versioned data, e.g. `stocks`.
+        - version: Incremented on every change.
+        - modified_at: The time of the last change.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    version = models.BigIntegerField(default=0)
+    modified_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f'{self.name} v{self.version}'
+
+
+class TransactionArchiveUser(models.Model):
+    """
+    This model indexes which users have transactions in each archive file,
+    so reading a user's history only opens the files that hold some of it.
+
+    Fields:
+        - archive: The archived month (ForeignKey TransactionArchive).
+        - user_id: The id of a user with transactions in that month.
+        - row_count: The number of that user's transactions in the file.
+        - first_at: The time of the user's first transaction in the file.
+        - last_at: The time of the user's last transaction in the file.
+    """
+    archive = models.ForeignKey(TransactionArchive, on_delete=models.CASCADE, related_name='users')
+    user_id = models.BigIntegerField()
+    row_count = models.IntegerField(default=0)
+    first_at = models.DateTimeField()
+    last_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_id', 'archive'], name='archive_user_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.archive}: user {self.user_id}'
@@ -0,0 +1,76 @@
+from decimal import Decimal, InvalidOperation, ROUND_HALF_EVEN
+
+from rest_framework import serializers
+
+# Prices, balances and totals are stored as integer micro-units: 1.5 is 1_500_000.
+SCALE = 1_000_000
+
+# Largest amount a BigIntegerField money column can hold, in micro-units.
+MAX_MICROS = 2 ** 63 - 1
+
+
+""" Converts an amount in whole units to micro-units."""
+
+
+def to_micros(value):
+    """
+    Accepts an int, float, `Decimal` or numeric string and rounds anything
+    finer than a micro-unit half to even. Floats are read through their
+    shortest repr, so 0.1 becomes exactly 100000.
+
+    @:param value : the amount in whole units
+    @:return : int number of micro-units
+    """
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value * SCALE
+    try:
+        amount = Decimal(value if isinstance(value, (str, Decimal)) else repr(value))
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValueError(f'{value!r} is not a number.')
+    if not amount.is_finite():
+        raise ValueError(f'{value!r} is not a finite number.')
+    return int((amount * SCALE).to_integral_value(ROUND_HALF_EVEN))
+
+
+""" Converts micro-units back to a number in whole units for display."""
+
+
+def from_micros(micros):
+    return None if micros is None else micros / SCALE
+
+
+""" Converts the money columns of `.values()` rows for display, in place."""
+
+
+def rows_from_micros(rows, fields):
+    for row in rows:
+        for field in fields:
+            if field in row:
+                row[field] = from_micros(row[field])
+    return rows
+
+
+class MoneyField(serializers.Field):
+    """
+    A serializer field for integer micro-unit columns. It reads and writes
+    plain numbers in whole units, so the API looks the same as with a float
+    column while the database holds exact integers.
+    """
+    default_error_messages = {
+        'invalid': 'A valid number is required.',
+        'max_value': 'Ensure this value is between -{max_value} and {max_value}.',
+    }
+
+    def to_representation(self, value):
+        return from_micros(value)
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('invalid')
+        try:
+            micros = to_micros(data)
+        except ValueError:
+            self.fail('invalid')
+        if abs(micros) > MAX_MICROS:
+            self.fail('max_value', max_value=Decimal(MAX_MICROS) / SCALE)
+        return micros
@@ -0,0 +1,314 @@
+
+from collections import defaultdict
+from collections.abc import Mapping
+
+from django.db import transaction
+from django.db.models import BigIntegerField, Case, F, When, Value
+from rest_framework import status
+
+from .models import users, Stock, Transaction, Position
+from .money import MAX_MICROS
+from .prices import price_cache
+from .streams import announce_fills
+
+MAX_BULK_ORDERS = 5000
+
+# Largest number of shares in one order; `transaction_volume` is a 32-bit column.
+MAX_ORDER_VOLUME = 10 ** 9
+
+
+class OrderError(Exception):
+    """
+    Raised when an order cannot be filled. Carries the message and the HTTP
+    status code the views should answer with.
+    """
+
+    def __init__(self, message, status_code=status.HTTP_400_BAD_REQUEST):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+""" Validates the raw order fields sent by a client."""
+
+
+def clean_order(data):
+    """
+    Checks that an order carries a user, a ticker, a positive integer volume
+    of at most `MAX_ORDER_VOLUME` and a known transaction type.
+
+    @:param data : mapping with `user`, `ticker`, `transaction_type` and `transaction_volume`
+    @:return : tuple of (user_id, ticker_id, transaction_type, transaction_volume)
+    """
+    if not isinstance(data, Mapping):
+        raise OrderError("Each order must be a JSON object.")
+    user_id = data.get('user')
+    ticker = data.get('ticker')
+    transaction_type = data.get('transaction_type')
+
+    if user_id is None or ticker is None:
+        raise OrderError("User ID and ticker are required.")
+
+    try:
+        user_id = int(user_id)
+        ticker = int(ticker)
+    except (TypeError, ValueError):
+        raise OrderError("User ID and ticker must be integers.")
+
+    try:
+        transaction_volume = int(data.get('transaction_volume'))
+    except (TypeError, ValueError):
+        raise OrderError("Transaction volume must be an integer.")
+    if not 0 < transaction_volume <= MAX_ORDER_VOLUME:
+        raise OrderError(f"Transaction volume must be between 1 and {MAX_ORDER_VOLUME}.")
+
+    if transaction_type not in (Transaction.BUY, Transaction.SELL):
+        raise OrderError("Transaction type must be 'buy' or 'sell'.")
+
+    return user_id, ticker, transaction_type, transaction_volume
+
+
+def order_total(price, transaction_volume, balance=0, transaction_type=Transaction.BUY):
+    """
+    The value of an order in micro-units. Checks the volume again, since the
+    fill functions are also called with tuples that were not built by
+    `clean_order`, and that neither the total nor the balance it is credited
+    to can overflow their columns.
+
+    @:param balance : balance of the user, checked when a sell credits it
+    @:return : int price times volume
+    """
+    if not 0 < transaction_volume <= MAX_ORDER_VOLUME:
+        raise OrderError(f"Transaction volume must be between 1 and {MAX_ORDER_VOLUME}.")
+    total = price * transaction_volume
+    if total > MAX_MICROS or (transaction_type == Transaction.SELL and balance + total > MAX_MICROS):
+        raise OrderError("The order value is too large.")
+    return total
+
+
+""" Fills a single buy or sell order inside one database transaction."""
+
+
+def place_order(user_id, ticker_id, transaction_type, transaction_volume):
+    """
+    Locks the user row with `select_for_update`, applies the balance and
+    position changes and inserts the `Transaction` in the same atomic block, so
+    concurrent orders on the same user can neither lose an update nor leave a
+    debit without its ledger row. A sell is limited to the shares held.
+
+    @:param user_id : primary key of the `users` row placing the order
+    @:param ticker_id : primary key of the `Stock` being traded
+    @:param transaction_type : either `Transaction.BUY` or `Transaction.SELL`
+    @:param transaction_volume : number of shares, already converted to int
+    @:return : the created `Transaction`
+    """
+    with transaction.atomic():
+        try:
+            user = users.objects.select_for_update().get(pk=user_id)
+            stock = price_cache.get(pk=ticker_id)
+        except users.DoesNotExist:
+            raise OrderError("User not found.", status.HTTP_404_NOT_FOUND)
+        except Stock.DoesNotExist:
+            raise OrderError("Stock not found.", status.HTTP_404_NOT_FOUND)
+
+        transaction_price = order_total(stock.price, transaction_volume, user.balance, transaction_type)
+
+        # The user row lock above also serializes every change to this user's positions.
+        position = Position.objects.filter(user=user, stock_id=stock.pk).first()
+
+        if transaction_type == Transaction.BUY and user.balance < transaction_price:
+            raise OrderError("You don't have enough balance to perform the transaction.")
+        if transaction_type == Transaction.SELL and (position is None or position.quantity < transaction_volume):
+            raise OrderError("You don't own enough shares to perform the transaction.")
+
+        if transaction_type == Transaction.BUY:
+            user.balance -= transaction_price
+        else:
+            user.balance += transaction_price
+        user.save(update_fields=['balance'])
+
+        if position is None:
+            position = Position(user=user, stock_id=stock.pk)
+        position.apply(transaction_type, transaction_volume, transaction_price)
+        if position.quantity == 0:
+            position.delete()
+        else:
+            position.save()
+
+        trade = Transaction.objects.create(
+            user=user,
+            ticker=stock,
+            transaction_type=transaction_type,
+            transaction_volume=transaction_volume,
+            transaction_price=transaction_price,
+        )
+        announce_fills([trade])
+        return trade
+
+
+""" Fills a batch of orders with a fixed number of queries."""
+
+
+def place_orders(orders):
+    """
+    Fills a list of orders in one database transaction. All users and stocks
+    are resolved with two `in_bulk` queries, every touched balance is written
+    back with a single `UPDATE ... CASE`, positions are written with one bulk
+    update and one bulk insert, and the ledger rows are inserted with
+    `bulk_create`. Orders are applied in the given order, so a buy can spend
+    the proceeds of an earlier sell in the same batch.
+
+    @:param orders : list of raw order mappings, see `clean_order`
+    @:return : list with one entry per order, either the created `Transaction`
+               or the `OrderError` that rejected it
+    """
+    cleaned = []
+    for data in orders:
+        try:
+            cleaned.append(clean_order(data))
+        except OrderError as e:
+            cleaned.append(e)
+    return fill_orders(cleaned)
+
+
+""" Fills a batch of orders that already went through `clean_order`."""
+
+
+def fill_orders(cleaned):
+    """
+    The body of `place_orders`, for callers that validated their orders earlier.
+    Prices are read through `price_cache`, like `place_order` does.
+
+    @:param cleaned : list of `clean_order` tuples; an `OrderError` in the list is passed through
+    @:return : list with one `Transaction` or `OrderError` per order
+    """
+    valid = [order for order in cleaned if not isinstance(order, OrderError)]
+    user_ids = {order[0] for order in valid}
+    ticker_ids = {order[1] for order in valid}
+
+    with transaction.atomic():
+        users_by_id = users.objects.select_for_update().in_bulk(user_ids)
+        stocks_by_id = price_cache.get_many(ticker_ids)
+        balances = {user_id: user.balance for user_id, user in users_by_id.items()}
+        positions = {
+            (position.user_id, position.stock_id): position
+            for position in Position.objects.filter(user_id__in=user_ids, stock_id__in=ticker_ids)
+        }
+        touched = set()
+
+        results = []
+        for order in cleaned:
+            if isinstance(order, OrderError):
+                results.append(order)
+                continue
+
+            user_id, ticker_id, transaction_type, transaction_volume = order
+            if user_id not in users_by_id:
+                results.append(OrderError("User not found.", status.HTTP_404_NOT_FOUND))
+                continue
+            if ticker_id not in stocks_by_id:
+                results.append(OrderError("Stock not found.", status.HTTP_404_NOT_FOUND))
+                continue
+
+            try:
+                transaction_price = order_total(stocks_by_id[ticker_id].price, transaction_volume,
+                                                balances[user_id], transaction_type)
+            except OrderError as e:
+                results.append(e)
+                continue
+            position = positions.get((user_id, ticker_id))
+            if transaction_type == Transaction.BUY:
+                if balances[user_id] < transaction_price:
+                    results.append(OrderError("You don't have enough balance to perform the transaction."))
+                    continue
+                balances[user_id] -= transaction_price
+            else:
+                if position is None or position.quantity < transaction_volume:
+                    results.append(OrderError("You don't own enough shares to perform the transaction."))
+                    continue
+                balances[user_id] += transaction_price
+
+            if position is None:
+                position = positions[(user_id, ticker_id)] = Position(user_id=user_id, stock_id=ticker_id)
+            position.apply(transaction_type, transaction_volume, transaction_price)
+            touched.add((user_id, ticker_id))
+
+            results.append(Transaction(
+                user=users_by_id[user_id],
+                ticker=stocks_by_id[ticker_id],
+                transaction_type=transaction_type,
+                transaction_volume=transaction_volume,
+                transaction_price=transaction_price,
+            ))
+
+        changed = {user_id: balance for user_id, balance in balances.items()
+                   if balance != users_by_id[user_id].balance}
+        if changed:
+            users.objects.filter(pk__in=changed).update(balance=Case(
+                *[When(pk=user_id, then=Value(balance)) for user_id, balance in changed.items()],
+                output_field=BigIntegerField(),
+            ))
+
+        save_positions([positions[key] for key in touched])
+        trades = Transaction.objects.bulk_create([trade for trade in results if isinstance(trade, Transaction)])
+        announce_fills(trades)
+
+    return results
+
+
+""" Writes back positions that were changed in memory."""
+
+
+def save_positions(positions):
+    """
+    Deletes the positions that dropped to zero and updates or inserts the rest,
+    with one query each.
+    """
+    Position.objects.filter(pk__in=[p.pk for p in positions if p.pk is not None and p.quantity == 0]).delete()
+    Position.objects.bulk_update([p for p in positions if p.pk is not None and p.quantity != 0],
+                                 ['quantity', 'cost_basis'])
+    Position.objects.bulk_create([p for p in positions if p.pk is None and p.quantity != 0])
+
+
+""" Persists trades that were already accepted elsewhere, e.g. by the matching engine."""
+
+
+def record_trades(trades):
+    """
+    Inserts the ledger rows and applies their balance and position changes in
+    bulk. No balance or holdings checks are made here, the caller has already
+    accepted every trade. Balances are changed relative to their stored value,
+    so no row lock is needed. Must run inside `transaction.atomic()`.
+
+    @:param trades : list of unsaved `Transaction` objects with `user_id` and `ticker_id` set
+    """
+    if not trades:
+        return
+
+    user_ids = {trade.user_id for trade in trades}
+    ticker_ids = {trade.ticker_id for trade in trades}
+    positions = {
+        (position.user_id, position.stock_id): position
+        for position in Position.objects.filter(user_id__in=user_ids, stock_id__in=ticker_ids)
+    }
+
+    deltas = defaultdict(int)
+    for trade in trades:
+        key = (trade.user_id, trade.ticker_id)
+        position = positions.get(key)
+        if position is None:
+            position = positions[key] = Position(user_id=trade.user_id, stock_id=trade.ticker_id)
+        position.apply(trade.transaction_type, trade.transaction_volume, trade.transaction_price)
+        if trade.transaction_type == Transaction.BUY:
+            deltas[trade.user_id] -= trade.transaction_price
+        else:
+            deltas[trade.user_id] += trade.transaction_price
+
+    users.objects.filter(pk__in=deltas).update(balance=Case(
+        *[When(pk=user_id, then=F('balance') + Value(delta)) for user_id, delta in deltas.items()],
+        default=F('balance'),
+        output_field=BigIntegerField(),
+    ))
+    save_positions(list(positions.values()))
+    Transaction.objects.bulk_create(trades)
+    announce_fills(trades)
@@ -0,0 +1,171 @@
+import base64
+import csv
+import json
+from datetime import datetime
+from itertools import chain, islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+from .money import from_micros
+
+EXPORT_FIELDS = [
+    'id',
+    'user',
+    'ticker',
+    'transaction_type',
+    'transaction_price',
+    'transaction_volume',
+    'created_at',
+]
+
+
+class TransactionCursorPagination(BasePagination):
+    """
+    Keyset pagination over `(created_at, id)`. The cursor is the position of the
+    last row of the previous page, so every page is one index range scan no
+    matter how deep into the history the client is.
+
+    Query params:
+        - cursor: opaque value taken from `next_cursor` of the previous page.
+        - page_size: rows per page, capped at `TRANSACTIONS_MAX_PAGE_SIZE`.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def get_page_size(self, query_params):
+        page_size = getattr(settings, 'TRANSACTIONS_PAGE_SIZE', 100)
+        max_page_size = getattr(settings, 'TRANSACTIONS_MAX_PAGE_SIZE', 1000)
+        raw = query_params.get(self.page_size_query_param)
+        if raw is not None:
+            try:
+                page_size = int(raw)
+            except ValueError:
+                raise ValidationError({'page_size': 'Must be an integer.'})
+            if page_size < 1:
+                raise ValidationError({'page_size': 'Must be at least 1.'})
+        return min(page_size, max_page_size)
+
+    def decode_cursor(self, raw):
+        try:
+            created_at, pk = base64.urlsafe_b64decode(raw.encode()).decode().split('|')
+            return datetime.fromisoformat(created_at), int(pk)
+        except (ValueError, UnicodeDecodeError):
+            raise ValidationError({'cursor': 'Invalid cursor.'})
+
+    def encode_cursor(self, row):
+        position = f'{row.created_at.isoformat()}|{row.pk}'
+        return base64.urlsafe_b64encode(position.encode()).decode()
+
+    def get_position(self, query_params):
+        raw = query_params.get(self.cursor_query_param)
+        return self.decode_cursor(raw) if raw else None
+
+    def page_queryset(self, queryset, query_params, limit=None):
+        page_size = self.get_page_size(query_params)
+        queryset = queryset.order_by('created_at', 'id')
+
+        position = self.get_position(query_params)
+        if position is not None:
+            created_at, pk = position
+            queryset = queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+
+        # Fetch one extra row to know whether there is a next page.
+        return queryset[:page_size + 1 if limit is None else limit], page_size
+
+    def finish_page(self, page, page_size):
+        self.next_cursor = self.encode_cursor(page[page_size - 1]) if len(page) > page_size else None
+        return page[:page_size]
+
+    def paginate_queryset(self, queryset, request, view=None, archived=None):
+        """
+        @:param archived : optional callable taking the cursor position and returning
+                           an iterator of older rows kept outside the table; they are
+                           served before any row of the queryset
+        """
+        page = []
+        if archived is not None:
+            page_size = self.get_page_size(request.query_params)
+            page = list(islice(archived(self.get_position(request.query_params)), page_size + 1))
+            if len(page) > page_size:
+                return self.finish_page(page, page_size)
+        queryset, page_size = self.page_queryset(queryset, request.query_params,
+                                                 limit=self.get_page_size(request.query_params) + 1 - len(page))
+        return self.finish_page(page + list(queryset), page_size)
+
+    async def apaginate_queryset(self, queryset, query_params, archived=None):
+        page = []
+        if archived is not None:
+            page_size = self.get_page_size(query_params)
+            position = self.get_position(query_params)
+            page = await sync_to_async(lambda: list(islice(archived(position), page_size + 1)))()
+            if len(page) > page_size:
+                return self.finish_page(page, page_size)
+        queryset, page_size = self.page_queryset(queryset, query_params,
+                                                 limit=self.get_page_size(query_params) + 1 - len(page))
+        return self.finish_page(page + [row async for row in queryset], page_size)
+
+    def get_paginated_response(self, data):
+        return Response({'next_cursor': self.next_cursor, 'results': data})
+
+
+class Echo:
+    """ A write-only file-like object that hands back what is written to it."""
+
+    def write(self, value):
+        return value
+
+
+""" Streams a transaction queryset as NDJSON or CSV without materializing it."""
+
+
+def stream_transactions(queryset, export, filename='transactions', archived=None, fields=EXPORT_FIELDS):
+    """
+    Iterates the queryset in chunks with `.values()` so neither model instances
+    nor the full response body are ever held in memory.
+
+    @:param queryset : the `Transaction` queryset to export
+    @:param export : either 'ndjson' or 'csv'
+    @:param filename : base name used for the download
+    @:param archived : optional iterator of older `Transaction` objects streamed first
+    @:param fields : the columns to export, a subset of `EXPORT_FIELDS`
+    """
+    chunk_size = getattr(settings, 'TRANSACTIONS_EXPORT_CHUNK_SIZE', 2000)
+    # Pick the database now, while the view's routing applies; the body is read after it returns.
+    queryset = queryset.using(queryset.db)
+    rows = queryset.order_by('created_at', 'id').values(*fields).iterator(chunk_size=chunk_size)
+    if archived is not None:
+        attnames = [(field, queryset.model._meta.get_field(field).attname) for field in fields]
+        rows = chain(({field: getattr(row, attname) for field, attname in attnames} for row in archived), rows)
+
+    if export == 'csv':
+        writer = csv.writer(Echo())
+
+        def lines():
+            yield writer.writerow(fields)
+            for row in rows:
+                if 'created_at' in row:
+                    row['created_at'] = row['created_at'].isoformat()
+                if 'transaction_price' in row:
+                    row['transaction_price'] = from_micros(row['transaction_price'])
+                yield writer.writerow([row[field] for field in fields])
+
+        content_type = 'text/csv'
+    else:
+        def lines():
+            for row in rows:
+                if 'transaction_price' in row:
+                    row['transaction_price'] = from_micros(row['transaction_price'])
+                yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+        content_type = 'application/x-ndjson'
+
+    response = StreamingHttpResponse(lines(), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{export}"'
+    return response
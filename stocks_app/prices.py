@@ -0,0 +1,254 @@
+import threading
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import DataVersion, Stock
+
+
+class PriceCache:
+    """
+    A read-through cache of `Stock` rows used wherever an order or a lookup
+    needs the current price.
+
+    Two tiers are consulted before the database:
+        - an in-process dict, trusted for at most `PRICE_CACHE_MAX_STALENESS` seconds;
+        - an optional Django cache backend named by `PRICE_CACHE_BACKEND`, shared
+          by every worker and dropped on each `Stock` save or delete.
+
+    Every entry carries the stock's version. Once a local entry is older than
+    the staleness bound its version is checked against the shared tier, so a
+    price changed in another process is never used for longer than the bound.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._by_id = {}
+        self._ids_by_ticker = {}
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        alias = getattr(settings, 'PRICE_CACHE_BACKEND', None)
+        return caches[alias] if alias else None
+
+    @staticmethod
+    def entry_key(pk):
+        return f'stock-price:{pk}'
+
+    @staticmethod
+    def version_key(pk):
+        return f'stock-price-version:{pk}'
+
+    @staticmethod
+    def ticker_key(ticker):
+        return f'stock-id:{ticker}'
+
+    def get(self, pk=None, ticker=None):
+        """
+        Returns a `Stock` for the given primary key or ticker symbol.
+        Raises `Stock.DoesNotExist` like `Stock.objects.get` would.
+        """
+        if not getattr(settings, 'PRICE_CACHE_ENABLED', True):
+            return Stock.objects.get(pk=pk) if pk is not None else Stock.objects.get(ticker=ticker)
+
+        if pk is None:
+            pk = self._ids_by_ticker.get(ticker)
+            if pk is None and self.backend is not None:
+                pk = self.backend.get(self.ticker_key(ticker))
+
+        entry = self._by_id.get(pk) if pk is not None else None
+        if entry is not None and (ticker is None or entry['ticker'] == ticker):
+            max_staleness = getattr(settings, 'PRICE_CACHE_MAX_STALENESS', 1.0)
+            if time.monotonic() - entry['fetched_at'] <= max_staleness or self._revalidate(entry):
+                self.hits += 1
+                return Stock(id=entry['id'], ticker=entry['ticker'], price=entry['price'])
+
+        self.misses += 1
+        entry = self._load(pk, ticker)
+        return Stock(id=entry['id'], ticker=entry['ticker'], price=entry['price'])
+
+    async def aget(self, pk=None, ticker=None):
+        """
+        Async variant of `get`. A fresh in-process entry is returned directly;
+        anything that may touch the database or the shared tier runs in a thread.
+        """
+        if getattr(settings, 'PRICE_CACHE_ENABLED', True):
+            entry = self._by_id.get(pk if pk is not None else self._ids_by_ticker.get(ticker))
+            max_staleness = getattr(settings, 'PRICE_CACHE_MAX_STALENESS', 1.0)
+            if (entry is not None and (ticker is None or entry['ticker'] == ticker)
+                    and time.monotonic() - entry['fetched_at'] <= max_staleness):
+                self.hits += 1
+                return Stock(id=entry['id'], ticker=entry['ticker'], price=entry['price'])
+        return await sync_to_async(self.get)(pk=pk, ticker=ticker)
+
+    def get_many(self, pks):
+        """
+        Returns a dict of primary key to `Stock` for the given keys, like
+        `Stock.objects.in_bulk`. Fresh entries come from the cache and every
+        other stock is read with one query and cached.
+        """
+        if not getattr(settings, 'PRICE_CACHE_ENABLED', True):
+            return Stock.objects.in_bulk(pks)
+
+        max_staleness = getattr(settings, 'PRICE_CACHE_MAX_STALENESS', 1.0)
+        found, missing = {}, []
+        for pk in pks:
+            entry = self._by_id.get(pk)
+            if entry is not None and (time.monotonic() - entry['fetched_at'] <= max_staleness
+                                      or self._revalidate(entry)):
+                self.hits += 1
+                found[pk] = entry
+            else:
+                missing.append(pk)
+
+        if missing:
+            self.misses += len(missing)
+            backend = self.backend
+            # Read the versions before the rows, as `_load` does.
+            versions = backend.get_many([self.version_key(pk) for pk in missing]) if backend is not None else {}
+            for stock in Stock.objects.filter(pk__in=missing):
+                found[stock.pk] = self._store(stock, versions.get(self.version_key(stock.pk), 0))
+        return {pk: Stock(id=entry['id'], ticker=entry['ticker'], price=entry['price'])
+                for pk, entry in found.items()}
+
+    def _revalidate(self, entry):
+        """ Renews a local entry whose version still matches the shared tier."""
+        backend = self.backend
+        if backend is None or backend.get(self.version_key(entry['id']), 0) != entry['version']:
+            return False
+        entry['fetched_at'] = time.monotonic()
+        return True
+
+    def _load(self, pk, ticker):
+        backend = self.backend
+        entry = None
+        if backend is not None and pk is not None:
+            entry = backend.get(self.entry_key(pk))
+            if entry is not None and ticker is not None and entry['ticker'] != ticker:
+                entry = None
+
+        if entry is None:
+            # Read the version before the row, so a concurrent save can only make it look older.
+            version = backend.get(self.version_key(pk), 0) if backend is not None and pk is not None else 0
+            stock = Stock.objects.get(pk=pk) if ticker is None else Stock.objects.get(ticker=ticker)
+            if backend is not None and pk is None:
+                version = backend.get(self.version_key(stock.pk), 0)
+            return self._store(stock, version)
+        return self._remember(entry)
+
+    def _store(self, stock, version):
+        """ Caches a row read from the database in both tiers."""
+        entry = {'id': stock.pk, 'ticker': stock.ticker, 'price': stock.price, 'version': version}
+        backend = self.backend
+        if backend is not None:
+            backend.set_many({
+                self.entry_key(stock.pk): entry,
+                self.ticker_key(stock.ticker): stock.pk,
+            })
+        return self._remember(entry)
+
+    def _remember(self, entry):
+        entry = dict(entry, fetched_at=time.monotonic())
+        with self._lock:
+            self._by_id[entry['id']] = entry
+            self._ids_by_ticker[entry['ticker']] = entry['id']
+        return entry
+
+    def invalidate(self, pk):
+        with self._lock:
+            entry = self._by_id.pop(pk, None)
+            if entry is not None:
+                self._ids_by_ticker.pop(entry['ticker'], None)
+
+        backend = self.backend
+        if backend is not None:
+            backend.delete(self.entry_key(pk))
+            try:
+                backend.incr(self.version_key(pk))
+            except ValueError:
+                backend.set(self.version_key(pk), 1, timeout=None)
+
+    def clear(self):
+        with self._lock:
+            self._by_id.clear()
+            self._ids_by_ticker.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._by_id)}
+
+
+price_cache = PriceCache()
+
+
+class TableVersion:
+    """
+    A token that changes whenever any `Stock` row is saved or deleted, together
+    with the time of that change. It is kept in the `PRICE_CACHE_BACKEND` cache
+    when one is configured, so every worker sees the same version. Without
+    one it lives in a `DataVersion` row, read with one small query, so a
+    change made by any process, a management command included, is seen by
+    every worker at once.
+    """
+
+    def __init__(self, name='stocks'):
+        self.name = name
+        self.key = f'{name}-table-version'
+        self._local = (uuid.uuid4().hex, time.time())
+
+    def get(self):
+        backend = price_cache.backend
+        if backend is None:
+            row = DataVersion.objects.filter(name=self.name).values_list('version', 'modified_at').first()
+            if row is None:
+                row = DataVersion.objects.get_or_create(name=self.name)[0]
+                row = row.version, row.modified_at
+            version, modified_at = row
+            return f'{version}.{int(modified_at.timestamp() * 1_000_000)}', modified_at.timestamp()
+        version = backend.get(self.key)
+        if version is None:
+            version = self._local
+            backend.add(self.key, version, timeout=None)
+            version = backend.get(self.key, version)
+        return version
+
+    def bump(self):
+        self._local = (uuid.uuid4().hex, time.time())
+        backend = price_cache.backend
+        if backend is not None:
+            backend.set(self.key, self._local, timeout=None)
+            return
+        now = timezone.now()
+        if not DataVersion.objects.filter(name=self.name).update(version=F('version') + 1, modified_at=now):
+            _, created = DataVersion.objects.get_or_create(name=self.name, defaults={'version': 1, 'modified_at': now})
+            if not created:
+                DataVersion.objects.filter(name=self.name).update(version=F('version') + 1, modified_at=now)
+
+
+stocks_version = TableVersion()
+
+
+""" Drops a stock from both cache tiers and bumps the table version once a save or delete of it commits."""
+
+
+@receiver(post_save, sender=Stock)
+@receiver(post_delete, sender=Stock)
+def invalidate_stock_price(sender, instance, **kwargs):
+    pk = instance.pk
+
+    def invalidate():
+        price_cache.invalidate(pk)
+        stocks_version.bump()
+
+    transaction.on_commit(invalidate)
@@ -0,0 +1,173 @@
+import logging
+import re
+import traceback
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# The budgets open in the current request or test, innermost last.
+active_budgets = ContextVar('active_budgets', default=())
+
+# Runs of placeholders, as in `IN (%s, %s)` or multi-row `VALUES`, and inlined numbers such as `LIMIT 21`.
+PLACEHOLDER_LIST = re.compile(r'\(%s(?:, %s)*\)(?:, \(%s(?:, %s)*\))*')
+NUMBER = re.compile(r'\b\d+\b')
+
+
+class QueryBudgetExceeded(AssertionError):
+    """ Raised by a budget in 'raise' mode, so it fails a test like a failed assertion."""
+
+
+""" Reduces a SQL statement to its shape, so queries that differ only in their parameters compare equal."""
+
+
+def sql_shape(sql):
+    return NUMBER.sub('N', PLACEHOLDER_LIST.sub('(...)', sql))
+
+
+""" The frames of the stack that belong to this project, outermost first, without the query wrappers."""
+
+
+def call_site():
+    root = str(settings.BASE_DIR)
+    wrappers = (__file__, metrics.__file__)
+    return tuple(
+        f'{frame.filename}:{frame.lineno} in {frame.name}'
+        for frame in traceback.extract_stack()
+        if frame.filename.startswith(root) and frame.filename not in wrappers and 'site-packages' not in frame.filename
+    )
+
+
+class QueryBudget:
+    """
+    Allows at most `max_queries` database queries inside a block, a view or
+    a test. Used as a decorator, sync or async, it checks every call of the
+    view; used as a context manager, it checks the block. Budgets nest, and
+    every open budget counts the queries run inside it, including those of
+    the JWT check when the decorator is applied outside `jwt_required`.
+    Queries run by the order sequencer's worker threads are not counted.
+
+    `QUERY_BUDGET_MODE` decides what happens when a budget is exceeded:
+    'raise' raises `QueryBudgetExceeded` and 'warn' logs a warning. With
+    'off' the view decorators do not count at all, and a `with` block only
+    logs.
+
+    With `QUERY_N_PLUS_ONE_THRESHOLD` set, the budget also records the call
+    site of every query and logs each SQL shape repeated that many times,
+    with the places it was issued from. The stack is walked on every query,
+    so this is meant for development and tests only.
+    """
+
+    def __init__(self, max_queries, name=None):
+        self.max_queries = max_queries
+        self.name = name
+        self.queries = []
+        self._tokens = []
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    def mode(self):
+        return getattr(settings, 'QUERY_BUDGET_MODE', 'off')
+
+    def record(self, sql, site):
+        self.queries.append((sql, site))
+
+    def repeated(self, threshold=None):
+        """ The SQL shapes run at least `threshold` times, with their count and distinct call sites."""
+        if threshold is None:
+            threshold = getattr(settings, 'QUERY_N_PLUS_ONE_THRESHOLD', None)
+        if not threshold:
+            return []
+        shapes = {}
+        for sql, site in self.queries:
+            count, sites = shapes.get(sql_shape(sql), (0, []))
+            if site and site not in sites:
+                sites.append(site)
+            shapes[sql_shape(sql)] = (count + 1, sites)
+        return [(shape, count, sites) for shape, (count, sites) in shapes.items() if count >= threshold]
+
+    def report(self):
+        for shape, count, sites in self.repeated():
+            lines = '\n'.join(f'    {frame}' for site in sites for frame in site[-4:])
+            logger.warning('Possible N+1 in %s: %d queries of shape\n  %s\nissued from\n%s',
+                           self.name or 'block', count, shape, lines)
+
+    def check(self):
+        self.report()
+        if self.count <= self.max_queries:
+            return
+        message = (f'{self.name or "block"} ran {self.count} queries, over its budget of {self.max_queries}:\n' +
+                   '\n'.join(f'  {sql}' for sql, site in self.queries))
+        if self.mode() == 'raise':
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+    def __enter__(self):
+        self.queries = []
+        self._tokens.append(active_budgets.set(active_budgets.get() + (self,)))
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        active_budgets.reset(self._tokens.pop())
+        if exc_type is None:
+            self.check()
+        return False
+
+    def __call__(self, view_func):
+        name = self.name or view_func.__qualname__
+        max_queries = self.max_queries
+
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def async_wrapper(*args, **kwargs):
+                if getattr(settings, 'QUERY_BUDGET_MODE', 'off') == 'off':
+                    return await view_func(*args, **kwargs)
+                with QueryBudget(max_queries, name):
+                    return await view_func(*args, **kwargs)
+
+            async_wrapper.query_budget = max_queries
+            return async_wrapper
+
+        @wraps(view_func)
+        def wrapper(*args, **kwargs):
+            if getattr(settings, 'QUERY_BUDGET_MODE', 'off') == 'off':
+                return view_func(*args, **kwargs)
+            with QueryBudget(max_queries, name):
+                return view_func(*args, **kwargs)
+
+        wrapper.query_budget = max_queries
+        return wrapper
+
+
+""" Allows at most `max_queries` queries per call of the decorated view, or inside the `with` block."""
+
+
+def query_budget(max_queries, name=None):
+    return QueryBudget(max_queries, name)
+
+
+""" A `connection.execute_wrapper` that adds every query to the open budgets."""
+
+
+def record_query(execute, sql, params, many, context):
+    budgets = active_budgets.get()
+    if budgets:
+        site = call_site() if getattr(settings, 'QUERY_N_PLUS_ONE_THRESHOLD', None) else None
+        for budget in budgets:
+            budget.record(sql, site)
+    return execute(sql, params, many, context)
+
+
+""" Adds `record_query` to a new connection once; connected to `connection_created`."""
+
+
+def install_query_wrapper(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
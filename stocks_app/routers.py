@@ -0,0 +1,161 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# True while a view marked with `read_from_replica` is running.
+replica_reads_enabled = ContextVar('replica_reads_enabled', default=False)
+
+
+class ReplicaPins:
+    """
+    Remembers which authenticated users placed an order in the last
+    `REPLICA_PIN_SECONDS`, so their reads stay on the primary until the
+    replicas have caught up with their own writes.
+
+    Pins are kept in process, and also in the Django cache named by
+    `REPLICA_PIN_CACHE_BACKEND` when one is set, so an order sent to one
+    worker pins the reads served by the others.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._until = {}
+        self._lock = threading.Lock()
+
+    @property
+    def seconds(self):
+        return getattr(settings, 'REPLICA_PIN_SECONDS', 5.0)
+
+    def shared(self):
+        alias = getattr(settings, 'REPLICA_PIN_CACHE_BACKEND', None)
+        return caches[alias] if alias else None
+
+    def key(self, user_id):
+        return f'replica-pin:{user_id}'
+
+    def pin(self, user_id):
+        until = time.time() + self.seconds
+        with self._lock:
+            if len(self._until) >= self.max_entries:
+                now = time.time()
+                self._until = {key: value for key, value in self._until.items() if value > now}
+            self._until[user_id] = until
+        shared = self.shared()
+        if shared is not None:
+            shared.set(self.key(user_id), until, timeout=self.seconds)
+
+    def pinned(self, user_id):
+        if user_id is None:
+            return False
+        until = self._until.get(user_id)
+        if until is None:
+            shared = self.shared()
+            until = shared.get(self.key(user_id)) if shared is not None else None
+        return until is not None and until > time.time()
+
+    def clear(self):
+        with self._lock:
+            self._until.clear()
+
+
+pins = ReplicaPins()
+
+
+""" Sends the reads inside the block to a replica, unless the user has just placed an order."""
+
+
+@contextmanager
+def replica_reads(user_id=None):
+    token = replica_reads_enabled.set(not pins.pinned(user_id))
+    try:
+        yield
+    finally:
+        replica_reads_enabled.reset(token)
+
+
+""" Marks a read-only view, sync or async, so its queries are answered by a replica. Applied after `jwt_required`."""
+
+
+def read_from_replica(view_func):
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def async_wrapper(request, *args, **kwargs):
+            with replica_reads(getattr(request.user, 'id', None)):
+                return await view_func(request, *args, **kwargs)
+
+        return async_wrapper
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        with replica_reads(getattr(request.user, 'id', None)):
+            return view_func(request, *args, **kwargs)
+
+    return wrapper
+
+
+""" Marks a view that writes for the requesting user, so their next reads stay on the primary."""
+
+
+def pin_to_primary(view_func):
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def async_wrapper(request, *args, **kwargs):
+            try:
+                return await view_func(request, *args, **kwargs)
+            finally:
+                pins.pin(request.user.id)
+
+        return async_wrapper
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view_func(request, *args, **kwargs)
+        finally:
+            pins.pin(request.user.id)
+
+    return wrapper
+
+
+class ReplicaRouter:
+    """
+    Routes reads made inside `replica_reads` to one of `REPLICA_DATABASES`,
+    chosen at random per query, and everything else to the primary. Writes
+    always go to the primary, and so do reads while the primary is inside a
+    transaction, so a `select_for_update` or a read-then-write never
+    crosses databases. Migrations run on the primary only; the replicas get
+    the schema through replication.
+
+    To try it locally, point `default` and a `replica` alias at two SQLite
+    files, copy the primary file over the replica after migrating, and set
+    `REPLICA_DATABASES = ['replica']`.
+    """
+
+    def replicas(self):
+        return getattr(settings, 'REPLICA_DATABASES', [])
+
+    def db_for_read(self, model, **hints):
+        replicas = self.replicas()
+        if not replicas or not replica_reads_enabled.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, *self.replicas()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in self.replicas()
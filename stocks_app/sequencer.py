@@ -0,0 +1,174 @@
+import queue
+import threading
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import connection
+
+from .orders import OrderError, fill_orders
+
+SHARD_KEYS = ('user', 'ticker')
+
+
+class Shard:
+    """ One queue of pending orders and the single worker thread that drains it."""
+
+    def __init__(self, index, batch_size):
+        self.index = index
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        self.submitted = 0
+        self.filled = 0
+        self.rejected = 0
+        self.failed = 0
+        self.batches = 0
+        self.max_depth = 0
+        self.thread = threading.Thread(target=self.run, name=f'order-shard-{index}', daemon=True)
+        self.thread.start()
+
+    def put(self, order, future):
+        self.queue.put((order, future))
+        self.submitted += 1
+        depth = self.queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def take_batch(self):
+        """ Blocks for one order, then takes whatever else is already queued, up to the batch size."""
+        batch = [self.queue.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.take_batch()
+            stop = any(item is None for item in batch)
+            batch = [item for item in batch if item is not None]
+            if batch:
+                self.fill(batch)
+            if stop:
+                connection.close()
+                return
+
+    def fill(self, batch):
+        # Orders whose caller cancelled the future before it ran are dropped.
+        batch = [(order, future) for order, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        futures = [future for _, future in batch]
+        orders = [order for order, _ in batch]
+        try:
+            results = fill_orders(orders)
+            self.batches += 1
+        except Exception as e:
+            connection.close_if_unusable_or_obsolete()
+            # The whole batch rolled back; fill its orders one at a time so only the failing one fails.
+            results = [self.fill_one(order) for order in orders] if len(orders) > 1 else [e]
+        for result, future in zip(results, futures):
+            if isinstance(result, OrderError):
+                self.rejected += 1
+                future.set_exception(result)
+            elif isinstance(result, Exception):
+                self.failed += 1
+                future.set_exception(result)
+            else:
+                self.filled += 1
+                future.set_result(result)
+
+    def fill_one(self, order):
+        """ Fills one order on its own; returns the `Transaction`, the `OrderError` or the error it raised."""
+        try:
+            [result] = fill_orders([order])
+        except Exception as e:
+            connection.close_if_unusable_or_obsolete()
+            return e
+        self.batches += 1
+        return result
+
+    def stats(self):
+        return {
+            'shard': self.index,
+            'queue_depth': self.queue.qsize(),
+            'max_queue_depth': self.max_depth,
+            'submitted': self.submitted,
+            'filled': self.filled,
+            'rejected': self.rejected,
+            'failed': self.failed,
+            'batches': self.batches,
+        }
+
+
+class OrderSequencer:
+    """
+    Routes every order to one of `ORDER_SEQUENCER_SHARDS` queues by user (or by
+    ticker, see `ORDER_SEQUENCER_SHARD_KEY`). Each queue has exactly one worker
+    thread, so orders of the same shard are filled one batch at a time, in
+    arrival order, and never wait on each other's row locks. A worker fills
+    everything that queued up while it was busy, up to
+    `ORDER_SEQUENCER_BATCH_SIZE` orders, with one `fill_orders` call. If that
+    call raises, the batch is filled again one order at a time, so an order
+    that breaks it only fails its own request.
+
+    Sharding by user keeps every balance change of a user on one worker. When
+    sharding by ticker, orders of one user can still run on two workers at once
+    and the user row lock taken by `fill_orders` keeps them correct.
+
+    Workers start on the first submitted order. Orders still queued when the
+    process exits are lost, callers only get a fill once it is committed.
+    """
+
+    def __init__(self, shards=None, shard_key=None, batch_size=None):
+        self.shard_count = shards or getattr(settings, 'ORDER_SEQUENCER_SHARDS', 4)
+        self.shard_key = shard_key or getattr(settings, 'ORDER_SEQUENCER_SHARD_KEY', 'user')
+        self.batch_size = batch_size or getattr(settings, 'ORDER_SEQUENCER_BATCH_SIZE', 100)
+        if self.shard_key not in SHARD_KEYS:
+            raise ValueError(f"ORDER_SEQUENCER_SHARD_KEY must be one of {', '.join(SHARD_KEYS)}.")
+        self.shards = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.shards is None:
+                self.shards = [Shard(index, self.batch_size) for index in range(self.shard_count)]
+        return self.shards
+
+    def shard_for(self, user_id, ticker_id):
+        key = user_id if self.shard_key == 'user' else ticker_id
+        return key % self.shard_count
+
+    def submit(self, order):
+        """
+        Queues a cleaned order and returns at once.
+
+        @:param order : tuple returned by `clean_order`
+        @:return : tuple of (shard index, `concurrent.futures.Future` resolving to the
+                   `Transaction`, or raising the `OrderError` that rejected the order)
+        """
+        shards = self.shards or self.start()
+        index = self.shard_for(order[0], order[1])
+        future = Future()
+        shards[index].put(order, future)
+        return index, future
+
+    def stop(self):
+        """ Lets every worker finish its queue, then joins them."""
+        with self._lock:
+            shards, self.shards = self.shards, None
+        for shard in shards or ():
+            shard.queue.put(None)
+        for shard in shards or ():
+            shard.thread.join()
+
+    def stats(self):
+        return {
+            'enabled': getattr(settings, 'ORDER_SEQUENCER_ENABLED', True),
+            'shard_key': self.shard_key,
+            'shards': [shard.stats() for shard in self.shards or ()],
+        }
+
+
+sequencer = OrderSequencer()
@@ -1,37 +1,158 @@
+from operator import attrgetter
+
 from rest_framework import serializers
-from .models import users, Stock, Transaction
+from rest_framework.exceptions import ValidationError
+from rest_framework.settings import api_settings
+from .models import users, Stock, Transaction, Position
+from .metrics import phase
+from .money import MoneyField, from_micros
 from django.contrib.auth.models import User
+from django.db.models import Manager, QuerySet
+
+
+""" Formats datetimes exactly like DRF's `DateTimeField` in ISO 8601 mode, without the per-call setup."""
+
+
+def datetime_formatter(field):
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    if output_format is None or output_format.lower() != 'iso-8601':
+        return field.to_representation
+    zone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+
+    def to_representation(value):
+        if zone is not None and value.tzinfo is not None:
+            value = value.astimezone(zone)
+        value = value.isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+    return to_representation
+
+
+class ValuesListSerializer(serializers.ListSerializer):
+    """
+    Serializes many rows without going through a field object per value. A
+    queryset is fetched with `values_list` of just the selected columns; a list
+    of instances is read with one `attrgetter`. Each row then becomes a dict in
+    one pass, and only money and datetime columns are converted. The output is
+    the same as DRF's field by field serialization.
+    """
+
+    @property
+    def data(self):
+        with phase('serialize'):
+            return super().data
+
+    def to_representation(self, data):
+        names, columns, converters = self.child.plan()
+        if isinstance(data, Manager):
+            data = data.all()
+        if isinstance(data, QuerySet):
+            rows = data.values_list(*columns)
+        else:
+            getter = attrgetter(*columns)
+            rows = (getter(row) for row in data) if len(columns) > 1 else ((getter(row),) for row in data)
+
+        positions = [(names.index(name), convert) for name, convert in converters]
+        results = []
+        append = results.append
+        for row in rows:
+            if positions:
+                row = list(row)
+                for index, convert in positions:
+                    value = row[index]
+                    if value is not None:
+                        row[index] = convert(value)
+            append(dict(zip(names, row)))
+        return results
+
+
+class ProjectedModelSerializer(serializers.ModelSerializer):
+    """
+    A model serializer that can emit a subset of its fields, chosen with the
+    `fields` argument or a `?fields=a,b` query param. Subclasses set
+    `list_serializer_class = ValuesListSerializer` in their Meta, so every
+    field must be a plain model column.
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    @property
+    def data(self):
+        with phase('serialize'):
+            return super().data
+
+    @classmethod
+    def requested_fields(cls, query_params):
+        """
+        @:param query_params : the request's query params
+        @:return : the fields named in `?fields=`, in declaration order, or all of them
+        """
+        raw = query_params.get('fields')
+        if not raw:
+            return list(cls.Meta.fields)
+        requested = {name.strip() for name in raw.split(',') if name.strip()}
+        if not requested or not requested <= set(cls.Meta.fields):
+            raise ValidationError({'fields': f"Must be a subset of {','.join(cls.Meta.fields)}."})
+        return [name for name in cls.Meta.fields if name in requested]
+
+    @classmethod
+    def columns(cls, fields):
+        """ Model attribute names of the fields, e.g. `user_id` for `user`, for `.only()` and `values_list`."""
+        return [cls.Meta.model._meta.get_field(name).attname for name in fields]
+
+    def plan(self):
+        names = list(self.fields)
+        converters = []
+        for name, field in self.fields.items():
+            if isinstance(field, MoneyField):
+                converters.append((name, from_micros))
+            elif isinstance(field, serializers.DateTimeField):
+                converters.append((name, datetime_formatter(field)))
+            elif not isinstance(field, (serializers.CharField, serializers.IntegerField,
+                                        serializers.PrimaryKeyRelatedField, serializers.ChoiceField)):
+                converters.append((name, field.to_representation))
+        return names, self.columns(names), converters
 
 
-class usersSerializer(serializers.ModelSerializer):
+class usersSerializer(ProjectedModelSerializer):
     """
     This serializer is for the user's `username` and `balance`
     fields, allowing them to be read and written in API responses and requests.
+    The balance is exchanged in whole units and stored in micro-units.
     """
+    balance = MoneyField()
 
     class Meta:
         model = users
         fields = ['id', 'username', 'balance', ]
+        list_serializer_class = ValuesListSerializer
 
 
-class StockSerializer(serializers.ModelSerializer):
+class StockSerializer(ProjectedModelSerializer):
     """
     This serializer handles the `ticker` and `price` fields of the stock, which can be used
     for creating or retrieving stock data through API requests.
     """
+    price = MoneyField()
 
     class Meta:
         model = Stock
         fields = ['ticker', 'price']
+        list_serializer_class = ValuesListSerializer
 
 
-class TransactionSerializer(serializers.ModelSerializer):
+class TransactionSerializer(ProjectedModelSerializer):
     """
     This serializer includes fields related to a transaction such as the user who
     made the transaction, the stock involved, transaction type, price, volume, and
     creation date.
 
     """
+    transaction_price = MoneyField()
 
     class Meta:
         model = Transaction
@@ -44,6 +165,21 @@ class TransactionSerializer(serializers.ModelSerializer):
             'transaction_volume',
             'created_at',
         ]
+        list_serializer_class = ValuesListSerializer
+
+
+class PositionSerializer(serializers.ModelSerializer):
+    """
+    This serializer shows a single holding of a user: the stock ticker, the
+    number of shares held and their cost basis.
+
+    """
+    ticker = serializers.CharField(source='stock.ticker')
+    cost_basis = MoneyField()
+
+    class Meta:
+        model = Position
+        fields = ['ticker', 'quantity', 'cost_basis']
 
 
 class registerSerializer(serializers.Serializer):
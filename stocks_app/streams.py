@@ -0,0 +1,247 @@
+import asyncio
+import json
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .metrics import registry
+from .models import Stock
+from .money import from_micros
+
+
+""" Encodes one server-sent event."""
+
+
+def sse(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n'.encode()
+
+
+class Subscriber:
+    """
+    One open stream. Price events are kept per ticker, so a burst of ticks
+    on one stock is coalesced into the latest price by the time the stream
+    wakes up. Fills are queued in order, at most `max_fills` of them; a
+    subscriber that falls further behind is dropped by the broker and told
+    to reconnect and reload, rather than silently missing a fill.
+
+    Only the broker's lock guards the fields below, since publishers run on
+    other threads than the event loop that reads them.
+    """
+    __slots__ = ('loop', 'event', 'tickers', 'user_id', 'prices', 'fills', 'max_fills', 'overflowed', 'waking')
+
+    def __init__(self, loop, tickers, user_id, max_fills):
+        self.loop = loop
+        self.event = asyncio.Event()
+        self.tickers = tickers
+        self.user_id = user_id
+        self.prices = {}
+        self.fills = deque()
+        self.max_fills = max_fills
+        self.overflowed = False
+        self.waking = False
+
+
+class Broker:
+    """
+    In-process fan-out of price and fill events to the streams of one
+    worker. Subscribers are indexed by ticker and by user, so a publish only
+    touches the streams that asked for it, and each is woken at most once
+    until it drains, however many events arrive in between.
+
+    Publishing is safe from any thread. Events committed in other server
+    processes are not seen; run the streaming endpoint on one process, or
+    send its clients to a dedicated one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_ticker = {}
+        self._all_tickers = set()
+        self._by_user = {}
+        self.subscribers = 0
+        self.dropped = 0
+        self.prices_published = 0
+        self.fills_published = 0
+
+    def subscribe(self, loop, tickers=(), all_tickers=False, user_id=None, max_fills=256):
+        subscriber = Subscriber(loop, None if all_tickers else frozenset(tickers), user_id, max_fills)
+        with self._lock:
+            if all_tickers:
+                self._all_tickers.add(subscriber)
+            for ticker in subscriber.tickers or ():
+                self._by_ticker.setdefault(ticker, set()).add(subscriber)
+            if user_id is not None:
+                self._by_user.setdefault(user_id, set()).add(subscriber)
+            self.subscribers += 1
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._remove(subscriber)
+
+    def _remove(self, subscriber):
+        removed = subscriber in self._all_tickers
+        self._all_tickers.discard(subscriber)
+        for ticker in subscriber.tickers or ():
+            group = self._by_ticker.get(ticker)
+            if group is not None and subscriber in group:
+                removed = True
+                group.discard(subscriber)
+                if not group:
+                    del self._by_ticker[ticker]
+        group = self._by_user.get(subscriber.user_id)
+        if group is not None and subscriber in group:
+            removed = True
+            group.discard(subscriber)
+            if not group:
+                del self._by_user[subscriber.user_id]
+        if removed:
+            self.subscribers -= 1
+
+    def _wake(self, subscriber, waking):
+        if not subscriber.waking:
+            subscriber.waking = True
+            waking.setdefault(subscriber.loop, []).append(subscriber.event)
+
+    @staticmethod
+    def _set(waking):
+        # One thread-safe call per event loop rather than per stream, each of which writes to the loop's self-pipe.
+        for loop, wakeups in waking.items():
+            try:
+                loop.call_soon_threadsafe(_set_all, wakeups)
+            except RuntimeError:
+                # The loop has closed; its streams are gone and will be removed by their own cleanup.
+                pass
+
+    def wants_price(self, ticker):
+        return bool(self._all_tickers) or ticker in self._by_ticker
+
+    def wants_fills(self):
+        return bool(self._by_user)
+
+    def publish_price(self, ticker, price):
+        """ Sends the latest price of a stock, replacing any not yet sent to a stream."""
+        event = sse('price', {'ticker': ticker, 'price': from_micros(price)})
+        waking = {}
+        with self._lock:
+            self.prices_published += 1
+            for subscriber in (*self._all_tickers, *self._by_ticker.get(ticker, ())):
+                subscriber.prices[ticker] = event
+                self._wake(subscriber, waking)
+        self._set(waking)
+
+    def publish_fills(self, fills):
+        """ Queues committed fills, given as dicts with a `user` id, on the streams of their users."""
+        waking = {}
+        with self._lock:
+            for fill in fills:
+                subscribers = self._by_user.get(fill['user'])
+                if not subscribers:
+                    continue
+                self.fills_published += 1
+                event = sse('fill', fill)
+                for subscriber in list(subscribers):
+                    if len(subscriber.fills) >= subscriber.max_fills:
+                        subscriber.overflowed = True
+                        self.dropped += 1
+                        self._remove(subscriber)
+                        registry.increment('stream_dropped_subscribers_total',
+                                           help_text='Streams closed for falling too far behind on fills.')
+                    else:
+                        subscriber.fills.append(event)
+                    self._wake(subscriber, waking)
+        self._set(waking)
+
+    def drain(self, subscriber):
+        """ Takes what is pending for a stream: fills in order, then the latest price of each ticker."""
+        with self._lock:
+            events = [*subscriber.fills, *subscriber.prices.values()]
+            subscriber.fills.clear()
+            subscriber.prices = {}
+            subscriber.waking = False
+            return events, subscriber.overflowed
+
+    def stats(self):
+        return {
+            'subscribers': self.subscribers,
+            'dropped_slow_subscribers': self.dropped,
+            'prices_published': self.prices_published,
+            'fills_published': self.fills_published,
+        }
+
+
+def _set_all(wakeups):
+    for event in wakeups:
+        event.set()
+
+
+broker = Broker()
+
+
+async def events(subscriber, snapshot=(), heartbeat=15.0, lifetime=3600.0):
+    """
+    The body of one stream: the `snapshot` events first, then whatever is
+    published until `lifetime` seconds have passed, with a comment line
+    every `heartbeat` seconds of silence so proxies keep the connection open
+    and dead clients are noticed. The subscriber is removed however the
+    stream ends, including when the client disconnects.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + lifetime
+    try:
+        yield b'retry: 3000\n\n' + b''.join(snapshot)
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            # A timer on the stream's own event rather than `wait_for`, which costs a task per wait.
+            timer = loop.call_later(min(heartbeat, remaining), subscriber.event.set)
+            try:
+                await subscriber.event.wait()
+            finally:
+                timer.cancel()
+            subscriber.event.clear()
+            pending, overflowed = broker.drain(subscriber)
+            if pending:
+                yield b''.join(pending)
+            elif not overflowed:
+                yield b': keep-alive\n\n'
+            if overflowed:
+                yield sse('overflow', {'error': 'Too far behind; reconnect and reload the history.'})
+                return
+    finally:
+        broker.unsubscribe(subscriber)
+
+
+""" Publishes committed fills to the streams of their users, once the surrounding transaction commits."""
+
+
+def announce_fills(trades):
+    if not trades or not broker.wants_fills() or not getattr(settings, 'STREAMS_ENABLED', True):
+        return
+    fills = [{
+        'id': trade.pk,
+        'user': trade.user_id,
+        'ticker': trade.ticker_id,
+        'transaction_type': trade.transaction_type,
+        'transaction_price': from_micros(trade.transaction_price),
+        'transaction_volume': trade.transaction_volume,
+        'created_at': trade.created_at,
+    } for trade in trades]
+    transaction.on_commit(lambda: broker.publish_fills(fills))
+
+
+""" Publishes a stock's new price to the streams watching it once the save commits."""
+
+
+@receiver(post_save, sender=Stock)
+def announce_price(sender, instance, **kwargs):
+    if not getattr(settings, 'STREAMS_ENABLED', True) or not broker.wants_price(instance.ticker):
+        return
+    ticker, price = instance.ticker, instance.price
+    transaction.on_commit(lambda: broker.publish_price(ticker, price))
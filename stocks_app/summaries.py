@@ -0,0 +1,137 @@
+from django.db import transaction
+from django.db.models import Count, F, Max, Q, Sum
+from django.db.models.functions import TruncDate, TruncHour
+
+from .archive import horizon
+from .models import Transaction, DailyRollup, RollupState
+
+TRUNCATIONS = {
+    'day': TruncDate,
+    'hour': TruncHour,
+}
+
+
+def window(queryset, start=None, end=None, field='created_at'):
+    if start is not None:
+        queryset = queryset.filter(**{f'{field}__gte': start})
+    if end is not None:
+        queryset = queryset.filter(**{f'{field}__lt': end})
+    return queryset
+
+
+""" Per-ticker, per-period totals computed by one grouped SQL query."""
+
+
+def ticker_summary(start=None, end=None, interval='day'):
+    """
+    Groups the ledger by ticker and by day or hour and returns traded volume,
+    notional and the number of buys and sells of each group.
+
+    @:param start : aware datetime, first instant included, or None
+    @:param end : aware datetime, first instant excluded, or None
+    @:param interval : either 'day' or 'hour'
+    """
+    return window(Transaction.objects.all(), start, end).values(
+        period=TRUNCATIONS[interval]('created_at'),
+        symbol=F('ticker__ticker'),
+    ).annotate(
+        volume=Sum('transaction_volume'),
+        notional=Sum('transaction_price'),
+        buy_count=Count('id', filter=Q(transaction_type=Transaction.BUY)),
+        sell_count=Count('id', filter=Q(transaction_type=Transaction.SELL)),
+    ).order_by('period', 'symbol')
+
+
+""" Per-ticker daily totals read from the precomputed rollup table."""
+
+
+def rollup_summary(start=None, end=None):
+    rollups = window(DailyRollup.objects.all(), start and start.date(), end and end.date(), field='date')
+    return rollups.values(
+        'volume', 'notional', 'buy_count', 'sell_count', period=F('date'), symbol=F('stock__ticker'),
+    ).order_by('period', 'symbol')
+
+
+""" Net cash flow of every user, computed by one grouped SQL query."""
+
+
+def user_cash_flow(start=None, end=None, username=None):
+    """
+    Sells count as money in and buys as money out, so a positive `net_cash_flow`
+    means the user took more cash out of the market than they put in.
+    """
+    transactions = window(Transaction.objects.all(), start, end)
+    if username is not None:
+        transactions = transactions.filter(user__username=username)
+    return transactions.values(username=F('user__username')).annotate(
+        bought=Sum('transaction_price', filter=Q(transaction_type=Transaction.BUY), default=0),
+        sold=Sum('transaction_price', filter=Q(transaction_type=Transaction.SELL), default=0),
+        trades=Count('id'),
+    ).annotate(net_cash_flow=F('sold') - F('bought')).order_by('username')
+
+
+""" Folds every transaction added since the last refresh into the daily rollup."""
+
+
+def refresh_daily_rollup(full=False):
+    """
+    Aggregates the transactions with an id above the stored checkpoint in one
+    grouped query and adds the totals onto the matching `DailyRollup` rows.
+
+    Ids are treated as the order in which rows became visible, so a transaction
+    committed after a higher id was already rolled up is missed; run with
+    `full=True` to rebuild the table from the whole ledger. Rollups of archived
+    months are kept as they are, since their transactions are no longer in the table.
+
+    @:return : tuple of (number of transactions folded in, rollup rows written)
+    """
+    with transaction.atomic():
+        state, _ = RollupState.objects.select_for_update().get_or_create(pk=1)
+        if full:
+            rollups = DailyRollup.objects.all()
+            current = horizon()
+            if current is not None:
+                rollups = rollups.filter(date__gte=current.date())
+            rollups.delete()
+            state.last_transaction_id = 0
+
+        pending = Transaction.objects.filter(id__gt=state.last_transaction_id)
+        last_id = pending.aggregate(last_id=Max('id'))['last_id']
+        if last_id is None:
+            return 0, 0
+        pending = pending.filter(id__lte=last_id)
+
+        groups = pending.annotate(date=TruncDate('created_at')).values('date', 'ticker_id').annotate(
+            volume=Sum('transaction_volume'),
+            notional=Sum('transaction_price'),
+            buy_count=Count('id', filter=Q(transaction_type=Transaction.BUY)),
+            sell_count=Count('id', filter=Q(transaction_type=Transaction.SELL)),
+            rows=Count('id'),
+        )
+        groups = {(group['date'], group['ticker_id']): group for group in groups}
+
+        existing = DailyRollup.objects.filter(
+            date__in={date for date, _ in groups}, stock_id__in={stock_id for _, stock_id in groups}
+        )
+        existing = {(rollup.date, rollup.stock_id): rollup for rollup in existing}
+
+        updated, created = [], []
+        for key, group in groups.items():
+            rollup = existing.get(key)
+            if rollup is None:
+                rollup = DailyRollup(date=key[0], stock_id=key[1])
+                created.append(rollup)
+            else:
+                updated.append(rollup)
+            rollup.volume += group['volume']
+            rollup.notional += group['notional']
+            rollup.buy_count += group['buy_count']
+            rollup.sell_count += group['sell_count']
+
+        DailyRollup.objects.bulk_update(updated, ['volume', 'notional', 'buy_count', 'sell_count'])
+        DailyRollup.objects.bulk_create(created)
+
+        state.last_transaction_id = last_id
+        state.save(update_fields=['last_transaction_id'])
+
+    return sum(group['rows'] for group in groups.values()), len(groups)
@@ -1,3 +1,1660 @@
-from django.test import TestCase
+import asyncio
+import base64
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import DataError, OperationalError, connection, connections
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import F, QuerySet
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern
+from django.utils import timezone
+from unittest import mock, skipUnless
+from rest_framework.exceptions import ValidationError
+
+from . import analytics
+from .archive import archive_month, archived_transactions, reaches_archive
+from .authentication import generate_jwt, token_cache
+from .benchmarks import report, scenarios, seed
+from .benchmarks.runner import run_client
+from .dbpool import connection_stats, install
+from .idempotency import IdempotencyError, idempotency_store
+from .journal import OrderJournal
+from .matching import FlushError, MatchingEngine
+from .metrics import Histogram, Registry, RequestTimings, current_request, record_query, registry
+from .models import (users, DailyRollup, DataVersion, IdempotencyKey, JournalCheckpoint, Order, RollupState, Stock,
+                     Transaction, TransactionArchiveUser, Position)
+from .money import MoneyField, from_micros, to_micros
+from .orders import (MAX_MICROS, MAX_ORDER_VOLUME, OrderError, clean_order, fill_orders, place_order, place_orders,
+                     record_trades)
+from .prices import price_cache, stocks_version
+from .querybudget import QueryBudgetExceeded, query_budget
+from .routers import ReplicaRouter, pins, replica_reads
+from .sequencer import OrderSequencer
+from .streams import Broker, broker, events
+from .summaries import refresh_daily_rollup, rollup_summary, ticker_summary, user_cash_flow
+from .serializers import StockSerializer, TransactionSerializer, usersSerializer
+from .views import Get_AllStocksView
+
+
+class HistoryIndexChecks:
+    """
+    Checks with EXPLAIN that the history queries are answered from the
+    composite and unique indexes instead of a full table scan.
+    """
+
+    def setUp(self):
+        self.user = users.objects.create(username='trader', balance=to_micros(1000))
+        self.stock = Stock.objects.create(ticker='AAPL', price=to_micros(10))
+        self.start = timezone.make_aware(datetime(2024, 9, 1))
+        self.end = self.start + timedelta(days=1)
+
+    def test_date_range_uses_user_created_index(self):
+        plan = Transaction.objects.filter(
+            user=self.user, created_at__gte=self.start, created_at__lt=self.end
+        ).explain()
+        self.assertIn('transaction_user_created_idx', plan)
+
+    def test_ticker_history_uses_ticker_created_index(self):
+        plan = Transaction.objects.filter(
+            ticker=self.stock, created_at__gte=self.start, created_at__lt=self.end
+        ).explain()
+        self.assertIn('transaction_ticker_created_idx', plan)
+
+    def test_username_lookup_uses_unique_index(self):
+        plan = users.objects.filter(username='trader').explain()
+        self.assertIn('USING INDEX', plan)
+
+    def test_ticker_lookup_uses_unique_index(self):
+        plan = Stock.objects.filter(ticker='AAPL').explain()
+        self.assertIn('USING INDEX', plan)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite plans, the default test database, see test_settings')
+class TransactionHistoryIndexTests(HistoryIndexChecks, TestCase):
+    """ The checks against SQLite, the database of `test_settings`."""
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Postgres plans are only checked against Postgres')
+class PostgresHistoryIndexTests(HistoryIndexChecks, TestCase):
+    """
+    The same checks against PostgreSQL. Sequential scans are disabled for
+    each test, so the planner still shows which index it can use on tables
+    too small to prefer one.
+    """
+
+    def setUp(self):
+        super().setUp()
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def test_username_lookup_uses_unique_index(self):
+        plan = users.objects.filter(username='trader').explain()
+        self.assertRegex(plan, r'Index (Only )?Scan using \w*username\w*')
+
+    def test_ticker_lookup_uses_unique_index(self):
+        plan = Stock.objects.filter(ticker='AAPL').explain()
+        self.assertRegex(plan, r'Index (Only )?Scan using \w*ticker\w*')
+
+
+@override_settings(REPLICA_DATABASES=['replica'], REPLICA_PIN_SECONDS=60, REPLICA_PIN_CACHE_BACKEND=None)
+class ReplicaRouterTests(SimpleTestCase):
+    """
+    Checks which alias the router picks. Outside a transaction, so the
+    primary is not held by an atomic block.
+    """
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+        pins.clear()
+
+    def tearDown(self):
+        pins.clear()
+
+    def test_reads_stay_on_primary_outside_read_only_views(self):
+        self.assertEqual(self.router.db_for_read(Transaction), 'default')
+
+    def test_read_only_views_read_from_replica(self):
+        with replica_reads(user_id=1):
+            self.assertEqual(self.router.db_for_read(Transaction), 'replica')
+        self.assertEqual(self.router.db_for_read(Transaction), 'default')
+
+    def test_user_reads_own_writes_after_order(self):
+        pins.pin(1)
+        with replica_reads(user_id=1):
+            self.assertEqual(self.router.db_for_read(Transaction), 'default')
+        with replica_reads(user_id=2):
+            self.assertEqual(self.router.db_for_read(Transaction), 'replica')
+
+    def test_writes_and_migrations_stay_on_primary(self):
+        with replica_reads(user_id=1):
+            self.assertEqual(self.router.db_for_write(Transaction), 'default')
+        self.assertTrue(self.router.allow_migrate('default', 'stocks_app'))
+        self.assertFalse(self.router.allow_migrate('replica', 'stocks_app'))
+
+
+@override_settings(REPLICA_DATABASES=['replica'], REPLICA_PIN_SECONDS=60, REPLICA_PIN_CACHE_BACKEND=None,
+                   ORDER_SEQUENCER_ENABLED=False, ORDER_WRITE_BEHIND_ENABLED=False)
+@skipUnless('replica' in settings.DATABASES, 'needs the replica database of the test settings')
+class ReplicaDatabaseTests(TransactionTestCase):
+    """
+    Runs the router against a primary and a replica that are two separate
+    SQLite databases. The test settings only make `replica` a replica inside
+    these tests, so it is migrated like any database, and it holds other rows
+    than the primary, so every answer shows which database served it. Not a
+    `TestCase`: reads inside its transaction would all stay on the primary.
+    """
+    databases = {'default', 'replica'} if 'replica' in settings.DATABASES else {'default'}
+
+    def setUp(self):
+        pins.clear()
+        price_cache.clear()
+        token_cache.clear()
+        idempotency_store.clear()
+        self.addCleanup(pins.clear)
+        for database, quantity in [('default', 3), ('replica', 7)]:
+            user = users.objects.using(database).create(id=1, username='trader', balance=to_micros(100))
+            stock = Stock.objects.using(database).create(id=1, ticker='AAPL', price=to_micros(10))
+            Position.objects.using(database).create(user=user, stock=stock, quantity=quantity,
+                                                    cost_basis=to_micros(10 * quantity))
+        self.addCleanup(lambda: [model.objects.using('replica').all().delete() for model in (Position, Stock, users)])
+        self.first, self.second = [
+            {'HTTP_AUTHORIZATION': f'Bearer {generate_jwt(User.objects.create(username=name))}'}
+            for name in ('first', 'second')
+        ]
+
+    def held(self, headers):
+        [position] = self.client.get('/positions/trader/', **headers).json()
+        return position['quantity']
+
+    def test_read_only_views_read_from_the_replica(self):
+        self.assertEqual(self.held(self.first), 7)
+        # Reads outside a read-only view stay on the primary.
+        self.assertEqual(Position.objects.get().quantity, 3)
+
+    def test_user_who_placed_an_order_reads_the_primary(self):
+        order = {'user': 1, 'ticker': 1, 'transaction_type': 'buy', 'transaction_volume': 1}
+        response = self.client.post('/add-transaction/', order, content_type='application/json', **self.first)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.held(self.first), 4)
+        self.assertEqual(self.held(self.second), 7)
+        pins.clear()
+        self.assertEqual(self.held(self.first), 7)
+
+
+@override_settings(QUERY_BUDGET_MODE='raise', QUERY_N_PLUS_ONE_THRESHOLD=5, ORDER_SEQUENCER_ENABLED=False)
+class QueryBudgetTests(TestCase):
+    """
+    Runs the endpoints against enough rows that a query per row would blow
+    their budgets, with every in-process cache cold.
+    """
+
+    def setUp(self):
+        price_cache.clear()
+        token_cache.clear()
+        idempotency_store.clear()
+        Get_AllStocksView.responses.clear()
+        self.auth_user = User.objects.create(username='auditor', is_staff=True, is_superuser=True)
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {generate_jwt(self.auth_user)}'}
+        self.user = users.objects.create(username='trader', balance=to_micros(100000))
+        self.stocks = [Stock.objects.create(ticker=f'T{i}', price=to_micros(10)) for i in range(10)]
+        now = timezone.now()
+        Transaction.objects.bulk_create([
+            Transaction(user=self.user, ticker=self.stocks[i % 10], transaction_type=Transaction.BUY,
+                        transaction_volume=1, transaction_price=to_micros(10), created_at=now - timedelta(hours=i))
+            for i in range(50)
+        ])
+        Position.objects.bulk_create([
+            Position(user=self.user, stock=stock, quantity=5, cost_basis=to_micros(50)) for stock in self.stocks
+        ])
+
+    def test_every_endpoint_has_a_budget(self):
+        from . import urls
+        for pattern in urls.urlpatterns:
+            self.assertIsInstance(pattern, URLPattern)
+            view_class = pattern.callback.view_class
+            methods = [getattr(view_class, name) for name in view_class.http_method_names
+                       if name != 'options' and hasattr(view_class, name)]
+            self.assertTrue(methods, pattern)
+            for method in methods:
+                self.assertTrue(hasattr(method, 'query_budget'), f'{pattern.pattern} {method.__name__}')
+
+    def test_history_endpoints_stay_within_budget(self):
+        for path in ['/transactions/trader/', '/transactions/trader/?export=ndjson',
+                     f'/transactions/trader/2000-01-01/{timezone.now():%Y-%m-%d}/', '/async/transactions/trader/']:
+            response = self.client.get(path, **self.headers)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            self.assertEqual(response.status_code, 200, path)
+
+    def test_read_endpoints_stay_within_budget(self):
+        for path in ['/user/trader/', '/stock/T1/', '/stocks/', '/positions/trader/', '/summary/tickers/',
+                     '/summary/users/', '/async/user/trader/', '/async/stock/T1/', '/async/stocks/']:
+            self.assertEqual(self.client.get(path, **self.headers).status_code, 200, path)
+
+    def test_bulk_orders_cost_the_same_as_one(self):
+        orders = [{'user': self.user.id, 'ticker': stock.id, 'transaction_type': 'buy', 'transaction_volume': 1}
+                  for stock in self.stocks]
+        with query_budget(14):
+            response = self.client.post('/add-transactions/bulk/', orders, content_type='application/json',
+                                        **self.headers)
+        self.assertEqual(response.json()['filled'], 10)
+
+    def test_admin_change_lists_join_related_rows(self):
+        self.client.force_login(self.auth_user)
+        for model in ['transaction', 'position']:
+            with query_budget(8) as budget:
+                self.assertEqual(self.client.get(f'/admin/stocks_app/{model}/').status_code, 200)
+            self.assertEqual(budget.repeated(), [], model)
+
+    def test_over_budget_raises(self):
+        with self.assertRaises(QueryBudgetExceeded), self.assertLogs('stocks_app.querybudget', level='WARNING'):
+            with query_budget(3):
+                for stock in self.stocks:
+                    Stock.objects.get(pk=stock.pk)
+
+    def test_repeated_query_shapes_are_reported_with_call_site(self):
+        with self.assertLogs('stocks_app.querybudget', level='WARNING') as logs:
+            with query_budget(20) as budget:
+                for transaction in Transaction.objects.all()[:10]:
+                    transaction.ticker.ticker
+        [(shape, count, sites)] = budget.repeated()
+        self.assertEqual(count, 10)
+        self.assertIn('"stocks_app_stock"', shape)
+        self.assertTrue(any('tests.py' in frame for frame in sites[0]))
+        self.assertIn('Possible N+1', logs.output[0])
+
+
+@override_settings(QUERY_BUDGET_MODE='raise', ORDER_SEQUENCER_ENABLED=False,
+                   PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class BenchmarkTests(TestCase):
+    """ Runs the benchmark suite end to end on a small seed."""
+
+    def setUp(self):
+        price_cache.clear()
+        token_cache.clear()
+        idempotency_store.clear()
+        Get_AllStocksView.responses.clear()
+        patcher = mock.patch('stocks_app.views.engine', MatchingEngine())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.auth_user = seed.seed(user_count=5, stock_count=3, transaction_count=300, days=60, batch_size=100)
+
+    def test_seeded_ledger_matches_balances_and_positions(self):
+        self.assertEqual(Transaction.objects.count(), 300)
+        self.assertFalse(users.objects.filter(balance__lt=seed.STARTING_BALANCE).exists())
+        expected = {}
+        for transaction in Transaction.objects.order_by('id'):
+            position = expected.setdefault((transaction.user_id, transaction.ticker_id),
+                                           Position(user_id=transaction.user_id, stock_id=transaction.ticker_id))
+            position.apply(transaction.transaction_type, transaction.transaction_volume,
+                           transaction.transaction_price)
+        stored = {(p.user_id, p.stock_id): (p.quantity, p.cost_basis) for p in Position.objects.all()}
+        self.assertEqual(stored, {key: (p.quantity, p.cost_basis) for key, p in expected.items() if p.quantity})
+
+    def test_every_endpoint_has_a_scenario(self):
+        from . import urls
+        routes = {str(pattern.pattern) for pattern in urls.urlpatterns}
+        self.assertEqual({scenario.route for scenario in scenarios.build(seed.benchmark_context())}, routes)
+
+    def test_client_run_reports_every_scenario(self):
+        selected = scenarios.build(seed.benchmark_context(), 'test')
+        summaries = run_client(selected, self.auth_user, requests=2, warmup=0)
+        self.assertEqual(list(summaries), [scenario.name for scenario in selected])
+        for name, summary in summaries.items():
+            self.assertEqual(summary['requests'], 2, name)
+            self.assertEqual(summary['errors'], 0, name)
+            self.assertIsNotNone(summary['queries_per_request'], name)
+
+    def test_compare_flags_regressions_beyond_tolerance(self):
+        baseline = report.results('client', {'stocks': report.summarize([0.010] * 10, 1.0, queries=10)})
+        slower = report.results('client', {'stocks': report.summarize([0.011] * 9, 1.0, queries=9)})
+        self.assertEqual(report.compare(slower, baseline, tolerance=0.2), [])
+        worse = report.results('client', {'stocks': report.summarize([0.020] * 5, 1.0, queries=10)})
+        self.assertEqual({key for _, key, _, _ in report.compare(worse, baseline, tolerance=0.2)},
+                         {'throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request'})
+
+
+class StreamBrokerTests(SimpleTestCase):
+    """
+    Checks the fan-out of the streaming endpoint on a private broker, driven
+    from an event loop the way the ASGI server drives it.
+    """
+
+    def test_price_ticks_are_coalesced(self):
+        async def scenario():
+            hub = Broker()
+            subscriber = hub.subscribe(asyncio.get_running_loop(), tickers=['AAPL'])
+            for price in (10, 11, 12):
+                hub.publish_price('AAPL', to_micros(price))
+            hub.publish_price('MSFT', to_micros(99))
+            await asyncio.wait_for(subscriber.event.wait(), 1)
+            return hub.drain(subscriber)
+
+        pending, overflowed = asyncio.run(scenario())
+        self.assertEqual(len(pending), 1)
+        self.assertIn(b'"price": 12.0', pending[0])
+        self.assertFalse(overflowed)
+
+    def test_fills_reach_only_their_user(self):
+        async def scenario():
+            hub = Broker()
+            loop = asyncio.get_running_loop()
+            mine, other = hub.subscribe(loop, user_id=1), hub.subscribe(loop, user_id=2)
+            hub.publish_fills([{'id': 1, 'user': 1}, {'id': 2, 'user': 1}])
+            return hub.drain(mine), hub.drain(other)
+
+        (mine, _), (other, _) = asyncio.run(scenario())
+        self.assertEqual([b'"id": 1' in event for event in mine], [True, False])
+        self.assertEqual(other, [])
+
+    def test_slow_subscriber_is_dropped(self):
+        async def scenario():
+            hub = Broker()
+            subscriber = hub.subscribe(asyncio.get_running_loop(), user_id=1, max_fills=2)
+            hub.publish_fills([{'id': n, 'user': 1} for n in range(3)])
+            stream = events(subscriber, heartbeat=1, lifetime=1)
+            chunks = [chunk async for chunk in stream]
+            return hub, chunks
+
+        hub, chunks = asyncio.run(scenario())
+        self.assertEqual(hub.stats()['subscribers'], 0)
+        self.assertEqual(hub.stats()['dropped_slow_subscribers'], 1)
+        self.assertTrue(chunks[-1].startswith(b'event: overflow'))
+
+
+class StreamPublishTests(TestCase):
+    """ Checks that writes reach the shared broker once, and only once, they commit."""
+
+    def test_committed_fill_and_price_are_published(self):
+        user = users.objects.create(username='streamer', balance=to_micros(1000))
+        stock = Stock.objects.create(ticker='STRM', price=to_micros(10))
+        loop = asyncio.new_event_loop()
+        subscriber = broker.subscribe(loop, tickers=['STRM'], user_id=user.pk)
+        try:
+            with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                place_order(user.pk, stock.pk, Transaction.BUY, 2)
+                stock.price = to_micros(11)
+                stock.save()
+            self.assertEqual(broker.drain(subscriber)[0], [])
+            for callback in callbacks:
+                callback()
+            pending, _ = broker.drain(subscriber)
+        finally:
+            broker.unsubscribe(subscriber)
+            loop.close()
+        self.assertEqual([event.split(b'\n', 1)[0] for event in pending], [b'event: fill', b'event: price'])
+
+
+class CursorPaginationTests(TestCase):
+    """ Walks the history endpoints page by page, with several rows sharing one timestamp."""
+
+    def setUp(self):
+        token_cache.clear()
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {generate_jwt(User.objects.create(username="reader"))}'}
+        user = users.objects.create(username='trader', balance=0)
+        stock = Stock.objects.create(ticker='AAPL', price=to_micros(10))
+        start = timezone.now() - timedelta(days=1)
+        self.rows = Transaction.objects.bulk_create([
+            Transaction(user=user, ticker=stock, transaction_type=Transaction.BUY, transaction_volume=1,
+                        transaction_price=to_micros(10), created_at=start + timedelta(minutes=n // 3))
+            for n in range(7)
+        ])
+
+    def get(self, path, cursor=None, **params):
+        if cursor:
+            params['cursor'] = cursor
+        query = '&'.join(f'{name}={value}' for name, value in params.items())
+        return self.client.get(f'{path}?{query}', **self.headers)
+
+    def test_pages_cover_every_row_once_in_keyset_order(self):
+        expected = [row.id for row in sorted(self.rows, key=lambda row: (row.created_at, row.id))]
+        for path in ['/transactions/trader/', '/async/transactions/trader/']:
+            ids, cursor = [], None
+            while True:
+                body = self.get(path, cursor, page_size=3).json()
+                self.assertEqual(set(body), {'next_cursor', 'results'})
+                self.assertLessEqual(len(body['results']), 3)
+                ids += [row['id'] for row in body['results']]
+                cursor = body['next_cursor']
+                if cursor is None:
+                    break
+            self.assertEqual(ids, expected, path)
+
+    def test_next_cursor_is_the_position_of_the_last_row(self):
+        body = self.get('/transactions/trader/', page_size=2).json()
+        created_at, pk = base64.urlsafe_b64decode(body['next_cursor']).decode().split('|')
+        last = Transaction.objects.get(pk=body['results'][-1]['id'])
+        self.assertEqual((datetime.fromisoformat(created_at), int(pk)), (last.created_at, last.pk))
+        self.assertIsNone(self.get('/transactions/trader/', page_size=7).json()['next_cursor'])
+
+    @override_settings(TRANSACTIONS_MAX_PAGE_SIZE=4)
+    def test_page_size_is_validated_and_capped(self):
+        self.assertEqual(len(self.get('/transactions/trader/', page_size=100).json()['results']), 4)
+        for params in [{'page_size': 0}, {'page_size': 'many'}, {'cursor': 'not-a-cursor'}]:
+            for path in ['/transactions/trader/', '/async/transactions/trader/']:
+                self.assertEqual(self.get(path, **params).status_code, 400, (path, params))
+
+
+class PositionTests(TestCase):
+    """ Checks the running position kept per user and stock, its rebuild from the ledger and its endpoint."""
+
+    def setUp(self):
+        token_cache.clear()
+        self.user = users.objects.create(username='trader', balance=0)
+        self.stock = Stock.objects.create(ticker='AAPL', price=to_micros(10))
+        self.other = Stock.objects.create(ticker='MSFT', price=to_micros(20))
+
+    def test_apply_keeps_the_average_cost_of_the_shares_left(self):
+        position = Position(user=self.user, stock=self.stock)
+        position.apply(Transaction.BUY, 3, to_micros(30))
+        position.apply(Transaction.BUY, 1, to_micros(14))
+        self.assertEqual((position.quantity, position.cost_basis), (4, to_micros(44)))
+        position.apply(Transaction.SELL, 1, to_micros(50))
+        self.assertEqual((position.quantity, position.cost_basis), (3, to_micros(33)))
+        position.apply(Transaction.SELL, 3, to_micros(60))
+        self.assertEqual((position.quantity, position.cost_basis), (0, 0))
+
+    def test_rebuild_replaces_drifted_positions_and_verify_reports_them(self):
+        now = timezone.now()
+        Transaction.objects.bulk_create([
+            Transaction(user=self.user, ticker=stock, transaction_type=kind, transaction_volume=volume,
+                        transaction_price=to_micros(price), created_at=now + timedelta(seconds=n))
+            for n, (stock, kind, volume, price) in enumerate([
+                (self.stock, Transaction.BUY, 4, 40), (self.stock, Transaction.SELL, 2, 30),
+                (self.other, Transaction.BUY, 1, 20), (self.other, Transaction.SELL, 1, 25),
+            ])
+        ])
+        Position.objects.create(user=self.user, stock=self.stock, quantity=9, cost_basis=0)
+        Position.objects.create(user=self.user, stock=self.other, quantity=1, cost_basis=to_micros(20))
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_positions', '--verify', stdout=StringIO(), stderr=StringIO())
+        call_command('rebuild_positions', stdout=StringIO())
+        self.assertEqual(list(Position.objects.values_list('stock__ticker', 'quantity', 'cost_basis')),
+                         [('AAPL', 2, to_micros(20))])
+        call_command('rebuild_positions', '--verify', stdout=StringIO())
+
+    def test_positions_endpoint_lists_open_holdings(self):
+        Position.objects.create(user=self.user, stock=self.stock, quantity=2, cost_basis=to_micros(21))
+        Position.objects.create(user=self.user, stock=self.other, quantity=0, cost_basis=0)
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {generate_jwt(User.objects.create(username="reader"))}'}
+        response = self.client.get('/positions/trader/', **headers)
+        self.assertEqual(response.json(), [{'ticker': 'AAPL', 'quantity': 2, 'cost_basis': 21.0}])
+        self.assertEqual(self.client.get('/positions/nobody/', **headers).status_code, 404)
+
+
+class MoneyTests(SimpleTestCase):
+    """ Checks the conversion between whole units and the integer micro-units stored in the money columns."""
+
+    def test_to_micros_rounds_half_to_even(self):
+        cases = [(1, 1_000_000), (0.1, 100_000), ('19.99', 19_990_000), (Decimal('-2.5'), -2_500_000),
+                 ('1.0000005', 1_000_000), ('1.0000015', 1_000_002), ('0.0000004', 0), (1e-7, 0)]
+        for value, micros in cases:
+            self.assertEqual(to_micros(value), micros, value)
+
+    def test_to_micros_rejects_what_is_not_a_finite_number(self):
+        for value in ['ten', None, True, 'NaN', float('inf'), '']:
+            with self.assertRaises(ValueError, msg=value):
+                to_micros(value)
+
+    def test_from_micros_and_the_serializer_field(self):
+        self.assertEqual((from_micros(1_500_000), from_micros(None)), (1.5, None))
+        field = MoneyField()
+        self.assertEqual((field.to_internal_value('0.30'), field.to_representation(300_000)), (300_000, 0.3))
+        for value in [True, 'abc', '1e13', -1e13]:
+            with self.assertRaises(ValidationError, msg=value):
+                field.to_internal_value(value)
+        self.assertEqual(field.to_internal_value('9223372036854.775807'), MAX_MICROS)
+
+
+class MoneyBoundsTests(TestCase):
+    """ Checks that amounts too large for the money columns are answered with 400 instead of overflowing."""
+
+    def setUp(self):
+        token_cache.clear()
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {generate_jwt(User.objects.create(username="reader"))}'}
+
+    def test_oversized_price_and_balance_are_rejected(self):
+        response = self.client.post('/add-stock/', {'ticker': 'HUGE', 'price': 1e13}, content_type='application/json',
+                                    **self.headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('price', response.json())
+        response = self.client.post('/add-user/', {'username': 'rich', 'balance': 1e14},
+                                    content_type='application/json', **self.headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('balance', response.json())
+        self.assertFalse(Stock.objects.exists() or users.objects.exists())
+
+        response = self.client.post('/add-stock/', {'ticker': 'BIG', 'price': 1e12}, content_type='application/json',
+                                    **self.headers)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Stock.objects.get().price, to_micros(10 ** 12))
+
+
+class FixedPointMigrationTests(TransactionTestCase):
+    """ Migrates the float money columns to micro-units and back on a copy of the old schema."""
+    before = [('stocks_app', '0008_idempotency_key')]
+    after = [('stocks_app', '0009_fixed_point_money')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_round_trip(self):
+        apps = self.migrate(self.before)
+        user = apps.get_model('stocks_app', 'users').objects.create(username='trader', balance=250)
+        stock = apps.get_model('stocks_app', 'Stock').objects.create(ticker='AAPL', price=0.1)
+        trade = apps.get_model('stocks_app', 'Transaction').objects.create(
+            user_id=user.pk, ticker_id=stock.pk, transaction_type='buy', transaction_volume=3,
+            transaction_price=0.3)
+
+        apps = self.migrate(self.after)
+        self.assertEqual(apps.get_model('stocks_app', 'users').objects.get(pk=user.pk).balance, 250_000_000)
+        self.assertEqual(apps.get_model('stocks_app', 'Stock').objects.get(pk=stock.pk).price, 100_000)
+        self.assertEqual(apps.get_model('stocks_app', 'Transaction').objects.get(pk=trade.pk).transaction_price,
+                         300_000)
+
+        apps = self.migrate(self.before)
+        self.assertEqual(apps.get_model('stocks_app', 'users').objects.get(pk=user.pk).balance, 250)
+        self.assertAlmostEqual(apps.get_model('stocks_app', 'Stock').objects.get(pk=stock.pk).price, 0.1)
+        self.assertAlmostEqual(
+            apps.get_model('stocks_app', 'Transaction').objects.get(pk=trade.pk).transaction_price, 0.3)
+
+
+class PlaceOrderTests(TestCase):
+    """ Checks that a single order changes the balance, the position and the ledger together or not at all."""
+
+    def setUp(self):
+        price_cache.clear()
+        self.user = users.objects.create(username='trader', balance=to_micros(100))
+        self.stock = Stock.objects.create(ticker='AAPL', price=to_micros(10))
+
+    def state(self):
+        self.user.refresh_from_db()
+        position = Position.objects.filter(user=self.user, stock=self.stock).first()
+        return self.user.balance, position and position.quantity, Transaction.objects.count()
+
+    def test_buy_and_sell_update_balance_position_and_ledger(self):
+        place_order(self.user.pk, self.stock.pk, Transaction.BUY, 4)
+        self.assertEqual(self.state(), (to_micros(60), 4, 1))
+        trade = place_order(self.user.pk, self.stock.pk, Transaction.SELL, 4)
+        self.assertEqual(trade.transaction_price, to_micros(40))
+        self.assertEqual(self.state(), (to_micros(100), None, 2))
+
+    def test_failed_ledger_insert_rolls_back_the_balance_and_position(self):
+        with mock.patch.object(Transaction.objects, 'create', side_effect=OperationalError('gone')):
+            with self.assertRaises(OperationalError):
+                place_order(self.user.pk, self.stock.pk, Transaction.BUY, 4)
+        self.assertEqual(self.state(), (to_micros(100), None, 0))
+
+    def test_rejected_orders_change_nothing(self):
+        for transaction_type, volume in [(Transaction.BUY, 11), (Transaction.SELL, 1)]:
+            with self.assertRaises(OrderError):
+                place_order(self.user.pk, self.stock.pk, transaction_type, volume)
+        with self.assertRaises(OrderError) as raised:
+            place_order(self.user.pk + 1, self.stock.pk, Transaction.BUY, 1)
+        self.assertEqual(raised.exception.status_code, 404)
+        self.assertEqual(self.state(), (to_micros(100), None, 0))
+
+    def test_user_row_is_locked_before_the_balance_is_read(self):
+        locked = []
+        original = QuerySet.select_for_update
+
+        def select_for_update(queryset, *args, **kwargs):
+            locked.append(queryset.model)
+            return original(queryset, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'select_for_update', select_for_update):
+            place_order(self.user.pk, self.stock.pk, Transaction.BUY, 1)
+            place_orders([{'user': self.user.pk, 'ticker': self.stock.pk, 'transaction_type': 'buy',
+                           'transaction_volume': 1}])
+        self.assertEqual(locked, [users, users])
+
+    @override_settings(ORDER_SEQUENCER_ENABLED=False, ORDER_WRITE_BEHIND_ENABLED=False)
+    def test_add_transaction_fills_the_order(self):
+        token_cache.clear()
+        response = self.client.post(
+            '/add-transaction/', {'user': self.user.pk, 'ticker': self.stock.pk, 'transaction_type': 'buy',
+                                  'transaction_volume': 2},
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'Bearer {generate_jwt(User.objects.create(username="client"))}')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['transaction_price'], 20.0)
+        self.assertEqual(self.state(), (to_micros(80), 2, 1))
+
+
+@override_settings(ORDER_SEQUENCER_ENABLED=False)
+class OrderVolumeTests(TestCase):
+    """ Checks that every order path refuses volumes that are not positive or would overflow the money columns."""
+
+    def setUp(self):
+        price_cache.clear()
+        self.user = users.objects.create(username='trader', balance=to_micros(100))
+        self.stock = Stock.objects.create(ticker='AAPL', price=to_micros(10))
+
+    def order(self, volume):
+        return {'user': self.user.pk, 'ticker': self.stock.pk, 'transaction_type': 'buy', 'transaction_volume': volume}
+
+    def assertUntouched(self):
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, to_micros(100))
+        self.assertFalse(Position.objects.exists())
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_clean_order_rejects_non_positive_and_oversized_volumes(self):
+        for volume in (-1000, 0, MAX_ORDER_VOLUME + 1):
+            with self.assertRaises(OrderError, msg=volume):
+                clean_order(self.order(volume))
+        self.assertEqual(clean_order(self.order(MAX_ORDER_VOLUME))[3], MAX_ORDER_VOLUME)
+
+    def test_place_order_rejects_negative_buy(self):
+        with self.assertRaises(OrderError):
+            place_order(self.user.pk, self.stock.pk, Transaction.BUY, -1000)
+        self.assertUntouched()
+
+    def test_bulk_orders_reject_bad_volumes_individually(self):
+        results = place_orders([self.order(-1000), self.order(0), self.order(10 ** 14), self.order(1)])
+        self.assertEqual([type(result) for result in results], [OrderError] * 3 + [Transaction])
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, to_micros(90))
+
+    def test_bulk_endpoint_rejects_elements_that_are_not_objects(self):
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {generate_jwt(User.objects.create(username="reader"))}'}
+        response = self.client.post('/add-transactions/bulk/', [self.order(1), 'junk', [1], None],
+                                    content_type='application/json', **headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['filled'], response.json()['rejected']), (1, 3))
+        self.assertEqual(response.json()['results'][1], {'status': 400, 'error': 'Each order must be a JSON object.'})
+
+    def test_order_value_overflow_is_rejected(self):
+        Stock.objects.filter(pk=self.stock.pk).update(price=2 ** 62)
+        price_cache.clear()
+        with self.assertRaises(OrderError):
+            place_order(self.user.pk, self.stock.pk, Transaction.BUY, 2)
+        self.assertUntouched()
+
+
+class OrderJournalTests(TestCase):
+    """
+    Drives the journal's replay and flush directly on the test thread, so
+    the orders are applied inside the test's transaction.
+    """
+
+    def setUp(self):
+        price_cache.clear()
+        self.user = users.objects.create(username='trader', balance=to_micros(100))
+        self.stock = Stock.objects.create(ticker='AAPL', price=to_micros(10))
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'orders.journal')
+        self.journal = OrderJournal(path=self.path, batch_size=10, max_delay=0)
+
+    def order(self, user=None):
+        return [self.user.pk if user is None else user, self.stock.pk, 'buy', 1]
+
+    def write_lines(self, orders, tail=b''):
+        with open(self.path, 'wb') as journal:
+            for sequence, order in enumerate(orders, start=1):
+                journal.write(json.dumps({'seq': sequence, 'order': order}).encode() + b'\n')
+            journal.write(tail)
+
+    def checkpoint(self):
+        return JournalCheckpoint.objects.get(name=self.path).last_sequence
+
+    def test_replay_applies_only_orders_after_the_checkpoint(self):
+        self.write_lines([self.order()] * 3)
+        JournalCheckpoint.objects.create(name=self.path, last_sequence=1)
+        self.assertEqual(self.journal.replay(), 2)
+        self.assertEqual(Transaction.objects.count(), 2)
+        self.assertEqual(self.checkpoint(), 3)
+        self.assertEqual(self.journal.replay(), 0)
+
+    def test_torn_last_line_is_cut_off(self):
+        self.write_lines([self.order()] * 2)
+        intact = os.path.getsize(self.path)
+        self.write_lines([self.order()] * 2, tail=b'{"seq":3,"order":[1,')
+        entries, last = self.journal.read()
+        self.assertEqual([sequence for sequence, _ in entries], [1, 2])
+        self.assertEqual(last, 2)
+        self.assertEqual(os.path.getsize(self.path), intact)
+
+    def test_failing_order_is_rejected_and_the_checkpoint_moves_past_it(self):
+        self.write_lines([self.order(), self.order('not-a-user-id'), self.order()])
+        with self.assertLogs('stocks_app.journal', level='ERROR'):
+            self.assertEqual(self.journal.replay(), 3)
+        self.assertEqual(Transaction.objects.count(), 2)
+        self.assertEqual(self.checkpoint(), 3)
+        self.assertEqual(self.journal.stats()['rejected'], 1)
+
+    def test_flush_resolves_futures_and_retries_only_transient_errors(self):
+        JournalCheckpoint.objects.create(name=self.path)
+        self.journal.file = open(self.path, 'ab')
+        self.addCleanup(self.journal.file.close)
+        futures = [(Future(), Future()) for _ in range(3)]
+        self.journal.write([(tuple(order), *pair) for order, pair in
+                            zip([self.order(), self.order('not-a-user-id'), self.order()], futures)])
+
+        with mock.patch('stocks_app.journal.fill_orders', side_effect=OperationalError('gone')):
+            self.journal.flush()
+        self.assertEqual(len(self.journal.pending), 3)
+        self.assertFalse(any(filled.done() for _, filled in futures))
+
+        with self.assertLogs('stocks_app.journal', level='ERROR'):
+            self.journal.flush()
+        self.assertEqual(self.journal.pending, [])
+        self.assertIsInstance(futures[0][1].result(), Transaction)
+        self.assertIsInstance(futures[1][1].exception(), ValueError)
+        self.assertIsInstance(futures[2][1].result(), Transaction)
+        self.assertEqual(self.checkpoint(), 3)
+
+
+class OrderSequencerTests(SimpleTestCase):
+    """
+    Checks routing, batching and error reporting of the sequencer with
+    `fill_orders` replaced, so the worker threads never touch the database.
+    """
+
+    def setUp(self):
+        self.batches = []
+        self.release = threading.Event()
+        self.release.set()
+
+        def fill(orders):
+            self.release.wait(5)
+            self.batches.append(list(orders))
+            if any(order[0] == 666 for order in orders):
+                raise ValueError('poison')
+            return [OrderError('Rejected.') if order[3] == 0 else ('filled', order) for order in orders]
+
+        patcher = mock.patch('stocks_app.sequencer.fill_orders', side_effect=fill)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def sequencer(self, **kwargs):
+        sequencer = OrderSequencer(**kwargs)
+        self.addCleanup(sequencer.stop)
+        return sequencer
+
+    def test_orders_are_routed_by_user_or_ticker(self):
+        by_user = OrderSequencer(shards=4, shard_key='user')
+        by_ticker = OrderSequencer(shards=4, shard_key='ticker')
+        self.assertEqual(by_user.shard_for(6, 3), 2)
+        self.assertEqual(by_ticker.shard_for(6, 3), 3)
+        with self.assertRaises(ValueError):
+            OrderSequencer(shard_key='stock')
+
+    def test_orders_queued_behind_a_busy_worker_share_a_batch(self):
+        sequencer = self.sequencer(shards=1, batch_size=10)
+        self.release.clear()
+        futures = [sequencer.submit((1, 1, 'buy', n))[1] for n in range(1, 6)]
+        # The first order is taken on its own while the others queue up behind it.
+        self.release.set()
+        results = [future.result(5) for future in futures]
+        self.assertEqual([order[3] for _, order in results], [1, 2, 3, 4, 5])
+        self.assertLess(len(self.batches), 5)
+
+    def test_errors_reach_only_the_futures_of_their_orders(self):
+        sequencer = self.sequencer(shards=1, batch_size=10)
+        self.release.clear()
+        futures = [sequencer.submit(order)[1] for order in
+                   [(1, 1, 'buy', 1), (1, 1, 'buy', 1), (666, 1, 'buy', 1), (1, 1, 'buy', 0), (1, 1, 'buy', 2)]]
+        self.release.set()
+        self.assertEqual(futures[0].result(5)[0], 'filled')
+        self.assertEqual(futures[1].result(5)[0], 'filled')
+        self.assertIsInstance(futures[2].exception(5), ValueError)
+        self.assertIsInstance(futures[3].exception(5), OrderError)
+        self.assertEqual(futures[4].result(5)[1][3], 2)
+        [shard] = sequencer.stats()['shards']
+        self.assertEqual((shard['filled'], shard['rejected'], shard['failed']), (3, 1, 1))
+
+
+class FillOrdersPriceCacheTests(TestCase):
+    """ Checks that batch fills read prices through the price cache."""
+
+    def test_cached_prices_are_not_read_again(self):
+        price_cache.clear()
+        user = users.objects.create(username='trader', balance=to_micros(100))
+        stock = Stock.objects.create(ticker='AAPL', price=to_micros(10))
+        price_cache.get(pk=stock.pk)
+        with CaptureQueriesContext(connection) as queries:
+            [trade] = fill_orders([(user.pk, stock.pk, Transaction.BUY, 2)])
+        self.assertEqual(trade.transaction_price, to_micros(20))
+        self.assertFalse([query for query in queries if 'FROM "stocks_app_stock"' in query['sql']])
+
+
+@override_settings(PRICE_CACHE_BACKEND=None)
+class StocksETagTests(TestCase):
+    """ Checks that the cached stocks/ body and its ETag follow changes made by any process."""
+
+    def setUp(self):
+        token_cache.clear()
+        Get_AllStocksView.responses.clear()
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {generate_jwt(User.objects.create(username="reader"))}'}
+        self.stock = Stock.objects.create(ticker='AAPL', price=to_micros(10))
+
+    def get(self, **headers):
+        return self.client.get('/stocks/', **self.headers, **headers)
+
+    def test_saving_a_stock_changes_the_etag(self):
+        etag = self.get()['ETag']
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.stock.price = to_micros(11)
+            self.stock.save()
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()[0]['price'], 11.0)
+
+    def test_change_made_by_another_process_is_seen(self):
+        etag = self.get()['ETag']
+        # What a bump in another worker or in `import_stocks` leaves behind.
+        Stock.objects.filter(pk=self.stock.pk).update(price=to_micros(12))
+        DataVersion.objects.filter(name='stocks').update(version=F('version') + 1)
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['price'], 12.0)
+
+
+class ArchiveTests(TestCase):
+    """ Archives whole months to files and reads them back through the index of users per file."""
+
+    def setUp(self):
+        token_cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(TRANSACTIONS_ARCHIVE_DIR=directory.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {generate_jwt(User.objects.create(username="reader"))}'}
+        self.trader = users.objects.create(username='trader', balance=to_micros(100))
+        self.other = users.objects.create(username='other', balance=to_micros(100))
+        self.stock = Stock.objects.create(ticker='AAPL', price=to_micros(10))
+
+    def trade(self, user, created_at, volume=1):
+        return Transaction.objects.create(user=user, ticker=self.stock, transaction_type=Transaction.BUY,
+                                          transaction_volume=volume, transaction_price=to_micros(10) * volume,
+                                          created_at=created_at)
+
+    def at(self, month, day):
+        return timezone.make_aware(datetime(2025, month, day, 12))
+
+    def fields(self, rows):
+        return [(row.id, row.user_id, row.ticker_id, row.transaction_type, row.transaction_volume,
+                 row.transaction_price, row.created_at) for row in rows]
+
+    def test_round_trip_keeps_every_field_and_the_order(self):
+        trades = [self.trade(self.trader, self.at(1, day), volume=day) for day in (20, 5, 5)]
+        self.trade(self.other, self.at(1, 9))
+        archive = archive_month(self.at(1, 1))
+
+        self.assertEqual(archive.row_count, 4)
+        self.assertFalse(Transaction.objects.exists())
+        expected = sorted(self.fields(trades), key=lambda row: (row[-1], row[0]))
+        self.assertEqual(self.fields(archived_transactions(user_id=self.trader.id)), expected)
+        entry = TransactionArchiveUser.objects.get(archive=archive, user_id=self.trader.id)
+        self.assertEqual((entry.row_count, entry.first_at, entry.last_at), (3, self.at(1, 5), self.at(1, 20)))
+
+    def test_files_without_the_user_are_never_opened(self):
+        self.trade(self.trader, self.at(1, 10))
+        self.trade(self.other, self.at(2, 10))
+        archive_month(self.at(1, 1))
+        archive_month(self.at(2, 1))
+        fresh = users.objects.create(username='fresh', balance=0)
+
+        self.assertTrue(reaches_archive(user_id=self.trader.id))
+        self.assertFalse(reaches_archive(user_id=fresh.id))
+        self.assertFalse(reaches_archive(start=self.at(1, 11), user_id=self.trader.id))
+        with mock.patch('stocks_app.archive.gzip.open', wraps=__import__('gzip').open) as opened:
+            self.assertEqual(len(list(archived_transactions(user_id=self.trader.id))), 1)
+            self.assertEqual(list(archived_transactions(user_id=fresh.id)), [])
+        self.assertEqual(opened.call_count, 1)
+        self.assertTrue(opened.call_args[0][0].endswith('transactions-2025-01.ndjson.gz'))
+
+    def test_history_pages_run_from_archived_into_hot_rows(self):
+        archived = [self.trade(self.trader, self.at(1, day)) for day in (3, 4, 5)]
+        archive_month(self.at(1, 1))
+        hot = [self.trade(self.trader, timezone.now() - timedelta(minutes=minutes)) for minutes in (2, 1)]
+
+        ids, cursor, pages = [], None, 0
+        while True:
+            query = '?page_size=2' + (f'&cursor={cursor}' if cursor else '')
+            body = self.client.get(f'/transactions/trader/{query}', **self.headers).json()
+            ids += [row['id'] for row in body['results']]
+            cursor, pages = body['next_cursor'], pages + 1
+            if cursor is None:
+                break
+        self.assertEqual(ids, [row.id for row in archived + hot])
+        self.assertEqual(pages, 3)
+
+        # A cursor past the user's archived rows reads the table alone.
+        cursor = self.client.get('/transactions/trader/?page_size=4', **self.headers).json()['next_cursor']
+        with mock.patch('stocks_app.archive.gzip.open') as opened:
+            body = self.client.get(f'/async/transactions/trader/?cursor={cursor}', **self.headers).json()
+        self.assertEqual([row['id'] for row in body['results']], [hot[1].id])
+        opened.assert_not_called()
+
+
+class MatchingEngineTests(TestCase):
+    """ Matches orders in memory and checks what `flush()` and `recover()` make of them."""
+
+    def setUp(self):
+        price_cache.clear()
+        token_cache.clear()
+        self.buyer = users.objects.create(username='buyer', balance=to_micros(100))
+        self.seller = users.objects.create(username='seller', balance=0)
+        self.stock = Stock.objects.create(ticker='AAPL', price=to_micros(10))
+        Position.objects.create(user=self.seller, stock=self.stock, quantity=10, cost_basis=to_micros(50))
+        self.engine = MatchingEngine()
+
+    def buy(self, quantity, price=None, user=None):
+        return self.engine.submit((user or self.buyer).pk, self.stock.pk, Transaction.BUY, quantity,
+                                  None if price is None else to_micros(price))
+
+    def sell(self, quantity, price=None, user=None):
+        return self.engine.submit((user or self.seller).pk, self.stock.pk, Transaction.SELL, quantity,
+                                  None if price is None else to_micros(price))
+
+    def holding(self, user):
+        return Position.objects.filter(user=user, stock=self.stock).values_list('quantity', flat=True).first() or 0
+
+    def test_limit_buy_fills_best_price_first_at_the_resting_price(self):
+        expensive, _ = self.sell(5, 11)
+        cheap, _ = self.sell(5, 10)
+        order, fills = self.buy(7, 12)
+        self.assertEqual([(resting.id, price, quantity) for resting, price, quantity in fills],
+                         [(cheap.id, to_micros(10), 5), (expensive.id, to_micros(11), 2)])
+        self.assertEqual((order.status, expensive.remaining), (Order.FILLED, 3))
+
+        self.assertEqual(self.engine.flush(), 2)
+        self.buyer.refresh_from_db()
+        self.seller.refresh_from_db()
+        self.assertEqual((self.buyer.balance, self.seller.balance), (to_micros(28), to_micros(72)))
+        self.assertEqual((self.holding(self.buyer), self.holding(self.seller)), (7, 3))
+        self.assertEqual(Transaction.objects.count(), 4)
+        self.assertEqual(Order.objects.get(pk=expensive.id).remaining, 3)
+
+    def test_market_order_takes_what_it_can_afford_and_cancels_the_rest(self):
+        self.sell(4, 20)
+        self.sell(6, 30)
+        order, fills = self.buy(10)
+        self.assertEqual([(price, quantity) for _, price, quantity in fills], [(to_micros(20), 4)])
+        self.assertEqual((order.status, order.remaining), (Order.CANCELLED, 6))
+        self.engine.flush()
+        self.buyer.refresh_from_db()
+        self.assertEqual(self.buyer.balance, to_micros(20))
+        self.assertEqual(Order.objects.get(pk=order.id).order_type, Order.MARKET)
+
+    def test_partial_fill_leaves_the_resting_order_open(self):
+        resting, _ = self.sell(10, 5)
+        self.buy(4, 5)
+        self.engine.flush()
+        self.assertEqual((resting.status, resting.remaining), (Order.OPEN, 6))
+        row = Order.objects.get(pk=resting.id)
+        self.assertEqual((row.status, row.remaining), (Order.OPEN, 6))
+        self.assertEqual(self.holding(self.seller), 6)
+
+    def test_orders_beyond_balance_or_holdings_are_rejected(self):
+        with self.assertRaises(OrderError):
+            self.sell(7, 10, user=self.buyer)
+        with self.assertRaises(OrderError):
+            self.buy(11, 10)
+        self.sell(8, 10)
+        # The shares promised by the resting sell are no longer available.
+        with self.assertRaises(OrderError):
+            self.sell(3, 12)
+        self.buy(8, 10)
+        self.engine.flush()
+        self.assertEqual(Position.objects.filter(quantity__lt=0).count(), 0)
+        self.assertFalse(users.objects.filter(balance__lt=0).exists())
+
+    def test_cancel_releases_the_reservation(self):
+        order, _ = self.buy(10, 10)
+        with self.assertRaises(OrderError):
+            self.buy(1, 1)
+        self.assertTrue(self.engine.cancel(order.id))
+        self.assertFalse(self.engine.cancel(order.id))
+        self.assertEqual(self.buy(1, 1)[0].status, Order.OPEN)
+        self.engine.flush()
+        self.assertEqual(Order.objects.get(pk=order.id).status, Order.CANCELLED)
+
+    def test_failed_flush_keeps_everything_buffered(self):
+        self.sell(5, 10)
+        self.buy(5, 10)
+        with mock.patch('stocks_app.matching.record_trades', side_effect=OperationalError('gone')):
+            with self.assertRaises(OperationalError):
+                self.engine.flush()
+        self.assertFalse(Transaction.objects.exists())
+        # Unflushed fills still count: the buyer has 50 left, not 100.
+        with self.assertRaises(OrderError):
+            self.buy(6, 10)
+        self.assertEqual(self.engine.flush(), 1)
+        self.assertEqual(Transaction.objects.count(), 2)
+
+    def test_limit_prices_beyond_the_money_columns_are_rejected(self):
+        with self.assertRaises(OrderError):
+            self.sell(1, '1e20')
+        with self.assertRaises(OrderError):
+            self.engine.submit(self.seller.pk, self.stock.pk, Transaction.SELL, 2, MAX_MICROS // 2 + 1)
+        self.assertEqual(self.engine.submit(self.seller.pk, self.stock.pk, Transaction.SELL, 2,
+                                            MAX_MICROS // 2)[0].status, Order.OPEN)
+        self.assertEqual(self.engine.flush(), 0)
+
+    def test_order_that_cannot_be_written_is_taken_back(self):
+        other = users.objects.create(username='other', balance=to_micros(100))
+        resting, _ = self.sell(5, 10)
+        self.engine.flush()
+        poison, _ = self.buy(2, 10)
+        self.buy(3, 10, user=other)
+        self.assertEqual(resting.status, Order.FILLED)
+
+        def record(trades):
+            if any(trade.user_id == self.buyer.pk for trade in trades):
+                raise DataError('value out of range')
+            return record_trades(trades)
+
+        with mock.patch('stocks_app.matching.record_trades', side_effect=record):
+            with self.assertRaises(FlushError) as raised, self.assertLogs('stocks_app.matching', level='ERROR'):
+                self.engine.flush()
+        self.assertEqual(raised.exception.rejected, {poison.id})
+        self.assertEqual((resting.status, resting.remaining), (Order.OPEN, 2))
+        self.assertEqual(self.engine.book(self.stock.pk).best_ask(), to_micros(10))
+        row = Order.objects.get(pk=resting.id)
+        self.assertEqual((row.status, row.remaining), (Order.OPEN, 2))
+        self.assertFalse(Order.objects.filter(pk=poison.id).exists())
+        self.assertEqual(self.holding(other), 3)
+
+        # Nothing is left to retry, and the shares taken back can be bought again.
+        self.assertEqual(self.engine.flush(), 0)
+        self.buy(2, 10)
+        self.assertEqual(self.engine.flush(), 1)
+        self.assertEqual(self.holding(self.buyer), 2)
+
+    def test_order_endpoint_takes_back_an_order_it_cannot_save(self):
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {generate_jwt(User.objects.create(username="reader"))}'}
+        self.sell(5, 10)
+        self.engine.flush()
+        body = {'user': self.buyer.pk, 'ticker': self.stock.pk, 'transaction_type': 'buy',
+                'transaction_volume': 5, 'price': '10'}
+        with mock.patch('stocks_app.views.engine', self.engine):
+            with mock.patch.object(self.engine, 'persist', side_effect=OperationalError('gone')), \
+                    self.assertLogs('stocks_app.matching', level='ERROR'):
+                response = self.client.post('/orders/', body, content_type='application/json', **headers)
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(self.engine.book(self.stock.pk).best_ask(), to_micros(10))
+
+            response = self.client.post('/orders/', body, content_type='application/json', **headers)
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(response.json()['status'], Order.FILLED)
+
+            body.update(transaction_type='sell', transaction_volume=1, price='1e20')
+            response = self.client.post('/orders/', body, content_type='application/json', **headers)
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(Transaction.objects.count(), 2)
+
+    def test_recover_rebuilds_books_and_reservations(self):
+        self.sell(10, 10)
+        bid, _ = self.buy(5, 9)
+        self.engine.flush()
+
+        engine = MatchingEngine.recover()
+        self.assertEqual((engine.book(self.stock.pk).best_bid(), engine.book(self.stock.pk).best_ask()),
+                         (to_micros(9), to_micros(10)))
+        self.assertEqual(engine.next_id, bid.id + 1)
+        # The recovered bid still holds 45 of the buyer's 100.
+        with self.assertRaises(OrderError):
+            engine.submit(self.buyer.pk, self.stock.pk, Transaction.BUY, 6, to_micros(10))
+        order, fills = engine.submit(self.buyer.pk, self.stock.pk, Transaction.BUY, 5, to_micros(10))
+        self.assertEqual((order.id, sum(quantity for _, _, quantity in fills)), (bid.id + 1, 5))
+
+    def test_order_endpoints_place_and_cancel(self):
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {generate_jwt(User.objects.create(username="reader"))}'}
+        with mock.patch('stocks_app.views.engine', self.engine):
+            body = {'user': self.buyer.pk, 'ticker': self.stock.pk, 'transaction_type': 'buy',
+                    'transaction_volume': 2, 'price': '9.50'}
+            response = self.client.post('/orders/', body, content_type='application/json', **headers)
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(response.json()['status'], Order.OPEN)
+            order_id = response.json()['id']
+
+            body.update(transaction_type='sell', price='1')
+            response = self.client.post('/orders/', body, content_type='application/json', **headers)
+            self.assertEqual(response.status_code, 400)
+
+            self.assertTrue(self.client.post(f'/orders/{order_id}/cancel/', **headers).json()['cancelled'])
+            self.assertFalse(self.client.post(f'/orders/{order_id}/cancel/', **headers).json()['cancelled'])
+        self.assertEqual(Order.objects.get(pk=order_id).status, Order.CANCELLED)
+
+
+@override_settings(ORDER_SEQUENCER_ENABLED=False, ORDER_WRITE_BEHIND_ENABLED=False)
+class IdempotencyTests(TestCase):
+    """ Sends orders with an `Idempotency-Key` and checks that only the first one is filled."""
+
+    def setUp(self):
+        price_cache.clear()
+        token_cache.clear()
+        idempotency_store.clear()
+        self.auth_user = User.objects.create(username='client')
+        self.user = users.objects.create(username='trader', balance=to_micros(100))
+        self.stock = Stock.objects.create(ticker='AAPL', price=to_micros(10))
+        self.order = {'user': self.user.pk, 'ticker': self.stock.pk, 'transaction_type': 'buy',
+                      'transaction_volume': 1}
+
+    def post(self, order, key='order-1'):
+        return self.client.post('/add-transaction/', order, content_type='application/json',
+                                HTTP_AUTHORIZATION=f'Bearer {generate_jwt(self.auth_user)}',
+                                HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_stored_response(self):
+        first = self.post(self.order)
+        self.assertEqual(first.status_code, 201)
+        for _ in range(2):
+            retry = self.post(self.order)
+            self.assertEqual((retry.status_code, retry.json()), (201, first.json()))
+            self.assertEqual(retry['Idempotent-Replayed'], 'true')
+            # The second retry finds the response in the table, not in the process cache.
+            idempotency_store.clear()
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.assertEqual(self.post(self.order, key='order-2').status_code, 201)
+        self.assertEqual(Transaction.objects.count(), 2)
+
+    def test_key_reused_with_another_body_is_rejected(self):
+        self.post(self.order)
+        response = self.post({**self.order, 'transaction_volume': 2})
+        self.assertEqual(response.status_code, 422)
+        idempotency_store.clear()
+        self.assertEqual(self.post({**self.order, 'transaction_volume': 2}).status_code, 422)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_server_errors_are_not_stored(self):
+        with mock.patch('stocks_app.views.place_order', side_effect=OSError):
+            self.assertEqual(self.post(self.order).status_code, 503)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        retry = self.post(self.order)
+        self.assertEqual(retry.status_code, 201)
+        self.assertFalse(retry.has_header('Idempotent-Replayed'))
+
+    def test_concurrent_duplicate_waits_for_the_first_response(self):
+        self.assertIsNone(idempotency_store.begin(self.auth_user.pk, 'order-1', 'hash'))
+        misses = idempotency_store.misses
+        results = []
+        duplicate = threading.Thread(
+            target=lambda: results.append(idempotency_store.begin(self.auth_user.pk, 'order-1', 'hash')))
+        duplicate.start()
+        deadline = time.monotonic() + 5
+        while idempotency_store.misses == misses and time.monotonic() < deadline:
+            time.sleep(0.001)
+        idempotency_store.finish(self.auth_user.pk, 'order-1', 'hash', 201, {'id': 1})
+        duplicate.join(5)
+        self.assertEqual(results, [(201, {'id': 1})])
+
+    @override_settings(IDEMPOTENCY_WAIT_TIMEOUT=0.05)
+    def test_duplicate_of_an_unfinished_request_elsewhere_times_out(self):
+        # What a request still running in another process leaves behind.
+        IdempotencyKey.objects.create(owner_id=self.auth_user.pk, key='order-1', request_hash='hash')
+        with self.assertRaises(IdempotencyError) as raised:
+            idempotency_store.begin(self.auth_user.pk, 'order-1', 'hash')
+        self.assertEqual(raised.exception.status_code, 409)
+        self.assertEqual(idempotency_store.stats()['running'], 0)
+
+
+class TokenCacheTests(TestCase):
+    """ Checks what `jwt_required` serves from the token cache and when it drops an entry."""
+
+    def setUp(self):
+        token_cache.clear()
+        Get_AllStocksView.responses.clear()
+        self.auth_user = User.objects.create(username='auditor', is_staff=True)
+        self.token = generate_jwt(self.auth_user)
+
+    def request(self, path='/stocks/'):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        return response, [query['sql'] for query in queries if 'auth_user' in query['sql']]
+
+    def test_repeated_token_skips_the_user_query(self):
+        for path in ['/stocks/', '/async/stocks/']:
+            token_cache.clear()
+            self.assertEqual(len(self.request(path)[1]), 1, path)
+            response, user_queries = self.request(path)
+            self.assertEqual((response.status_code, user_queries), (200, []), path)
+            self.assertEqual(token_cache.stats()['hits'], 1, path)
+
+    def test_cache_hit_returns_a_full_copy_of_the_user(self):
+        self.request()
+        _, user = token_cache.get(self.token)
+        self.assertEqual((user.pk, user.username, user.is_staff), (self.auth_user.pk, 'auditor', True))
+        user.is_staff = False
+        self.assertTrue(token_cache.get(self.token)[1].is_staff)
+
+    def test_saving_or_deleting_the_user_drops_its_tokens(self):
+        self.request()
+        self.auth_user.is_active = False
+        self.auth_user.save()
+        self.assertIsNone(token_cache.get(self.token))
+        # Inactive users are checked against the database on every request.
+        self.assertEqual(len(self.request()[1]), 1)
+        self.assertIsNone(token_cache.get(self.token))
+
+        self.auth_user.delete()
+        response, _ = self.request()
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(JWT_CACHE_TTL=30)
+    def test_entries_expire_after_the_ttl(self):
+        self.request()
+        self.assertIsNotNone(token_cache.get(self.token))
+        with mock.patch('stocks_app.authentication.time.time', return_value=time.time() + 31):
+            self.assertIsNone(token_cache.get(self.token))
+
+
+class ImportTests(TestCase):
+    """ Runs `import_stocks` and `import_ledger` on small files, good rows and bad."""
+
+    def setUp(self):
+        price_cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.user = users.objects.create(username='trader', balance=to_micros(1000))
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with (gzip.open(path, 'wt') if name.endswith('.gz') else open(path, 'w')) as source:
+            source.write(text)
+        return path
+
+    def call(self, *args):
+        stdout, stderr = StringIO(), StringIO()
+        call_command(*args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_stocks_are_created_updated_and_the_version_bumped(self):
+        Stock.objects.create(ticker='AAPL', price=to_micros(1))
+        price_cache.get(ticker='AAPL')
+        version = stocks_version.get()
+        self.call('import_stocks', self.write('universe.csv', 'ticker,price\nAAPL,190.5\nMSFT,410\nMSFT,411\n'))
+        self.assertEqual(dict(Stock.objects.values_list('ticker', 'price')),
+                         {'AAPL': to_micros(190.5), 'MSFT': to_micros(411)})
+        self.assertEqual(price_cache.get(ticker='AAPL').price, to_micros(190.5))
+        self.assertNotEqual(stocks_version.get(), version)
+
+        self.call('import_stocks', self.write('again.ndjson', '{"ticker": "AAPL", "price": 1}\n'), '--no-update')
+        self.assertEqual(Stock.objects.get(ticker='AAPL').price, to_micros(190.5))
+
+    def test_bad_stock_rows_are_reported_and_abort_the_import(self):
+        path = self.write('universe.csv', 'ticker,price\nAAPL,10\n,5\nMSFT,-1\nTSLA,abc\nHUGE,1e13\n')
+        with self.assertRaises(CommandError):
+            self.call('import_stocks', path, '--max-errors', '3')
+        self.assertFalse(Stock.objects.exists())
+        _, errors = self.call('import_stocks', path, '--max-errors', '4')
+        self.assertEqual([line.split(':')[0] for line in errors.splitlines()],
+                         ['line 3', 'line 4', 'line 5', 'line 6'])
+        self.assertEqual(list(Stock.objects.values_list('ticker', flat=True)), ['AAPL'])
+
+    def test_ledger_import_moves_balances_and_rebuilds_positions(self):
+        Stock.objects.create(ticker='AAPL', price=to_micros(10))
+        path = self.write('fills.ndjson.gz', '\n'.join(json.dumps(row) for row in [
+            {'user': 'trader', 'ticker': 'AAPL', 'transaction_type': 'buy', 'transaction_volume': 5},
+            {'user': 'trader', 'ticker': 'AAPL', 'transaction_type': 'sell', 'transaction_volume': 2,
+             'transaction_price': '30.5', 'created_at': '2030-01-01T00:00:00+00:00'},
+        ]) + '\n')
+        self.call('import_ledger', path)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, to_micros(1000 - 50 + 30.5))
+        self.assertEqual(list(Transaction.objects.order_by('created_at').values_list('transaction_price', flat=True)),
+                         [to_micros(50), to_micros(30.5)])
+        self.assertEqual(Position.objects.get(user=self.user).quantity, 3)
+
+    def test_bad_ledger_rows_are_reported_and_abort_the_import(self):
+        Stock.objects.create(ticker='AAPL', price=to_micros(10))
+        Stock.objects.create(ticker='BIG', price=MAX_MICROS // 2)
+        path = self.write('fills.csv', 'user,ticker,transaction_type,transaction_volume\n'
+                                       'trader,AAPL,buy,1\nnobody,AAPL,buy,1\ntrader,GOOG,buy,1\n'
+                                       'trader,AAPL,hold,1\ntrader,AAPL,buy,0\ntrader,AAPL,buy,10000000000\n'
+                                       'trader,BIG,buy,3\n')
+        with self.assertRaises(CommandError):
+            self.call('import_ledger', path, '--max-errors', '5')
+        self.assertFalse(Transaction.objects.exists())
+        _, errors = self.call('import_ledger', path, '--max-errors', '6', '--no-balances')
+        self.assertEqual(len(errors.splitlines()), 6)
+        self.assertIn('line 7: Volume must be between 1', errors)
+        self.assertIn('line 8: Price must not be negative or too large.', errors)
+        self.assertIn("User 'nobody' not found.", errors)
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.balance, to_micros(1000))
+
+
+@skipUnless(analytics.np is not None, 'analytics need NumPy')
+class AnalyticsTests(TestCase):
+    """ Checks the FIFO realized and unrealized gains of `compute_metrics` against hand-computed ledgers."""
+
+    def setUp(self):
+        token_cache.clear()
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {generate_jwt(User.objects.create(username="reader"))}'}
+        self.user = users.objects.create(username='trader', balance=0)
+        self.aapl = Stock.objects.create(ticker='AAPL', price=to_micros(20))
+        self.msft = Stock.objects.create(ticker='MSFT', price=to_micros(7))
+
+    def metrics(self, trades, price=20):
+        """ Runs `compute_metrics` on one ticker; `trades` are (side, volume, total) in time order."""
+        np = analytics.np
+        return analytics.compute_metrics(
+            np.ones(len(trades), dtype=np.int64), np.array([side == 'buy' for side, _, _ in trades]),
+            np.ones(len(trades), dtype=bool), np.array([volume for _, volume, _ in trades], dtype=np.float64),
+            np.array([total for _, _, total in trades], dtype=np.float64), {1: price},
+        )[1]
+
+    def trade(self, stock, side, volume, total, day):
+        Transaction.objects.create(user=self.user, ticker=stock, transaction_type=side, transaction_volume=volume,
+                                   transaction_price=to_micros(total),
+                                   created_at=timezone.make_aware(datetime(2024, 1, 1)) + timedelta(days=day))
+
+    def assertMetrics(self, metrics, **expected):
+        for name, value in expected.items():
+            self.assertAlmostEqual(metrics[name], value, msg=name)
+
+    def test_sells_consume_the_oldest_lots_first(self):
+        # 15 sold for 225 cost 10 x 10 + 5 x 12 = 160; 2 sold for 40 cost 2 x 12 = 24.
+        metrics = self.metrics([('buy', 10, 100), ('buy', 10, 120), ('sell', 15, 225), ('sell', 2, 40)])
+        self.assertMetrics(metrics, trades=4, volume_bought=20, volume_sold=17, turnover=485, vwap=485 / 37,
+                           realized_gain=65 + 16, held=3, held_cost=36, unrealized_gain=3 * 20 - 36)
+
+    def test_partial_sell_inside_one_lot(self):
+        metrics = self.metrics([('buy', 10, 100), ('sell', 4, 60)], price=11)
+        self.assertMetrics(metrics, realized_gain=60 - 40, held=6, held_cost=60, unrealized_gain=6 * 11 - 60)
+
+    def test_oversell_only_realizes_the_shares_held(self):
+        # 5 of the 8 sold were held: 96 x 5 / 8 - 50 = 10. The later buy opens a fresh lot.
+        metrics = self.metrics([('buy', 5, 50), ('sell', 8, 96), ('buy', 2, 22)])
+        self.assertMetrics(metrics, volume_sold=8, realized_gain=10, held=2, held_cost=22,
+                           unrealized_gain=2 * 20 - 22)
+
+    def test_tickers_are_matched_separately(self):
+        self.trade(self.aapl, Transaction.BUY, 1, 10, 0)
+        self.trade(self.msft, Transaction.BUY, 2, 10, 1)
+        self.trade(self.aapl, Transaction.BUY, 1, 16, 2)
+        self.trade(self.msft, Transaction.SELL, 1, 8, 3)
+        self.trade(self.aapl, Transaction.SELL, 1, 13, 4)
+
+        report = analytics.portfolio_analytics(self.user)
+        tickers = {values['ticker']: values for values in report['tickers']}
+        self.assertMetrics(tickers['AAPL'], realized_gain=3, held=1, held_cost=16, unrealized_gain=4)
+        self.assertMetrics(tickers['MSFT'], realized_gain=3, held=1, held_cost=5, unrealized_gain=2)
+        self.assertMetrics(report, turnover=57, realized_gain=6, unrealized_gain=6, pnl=12)
+
+    def test_window_limits_the_totals_but_not_the_lots(self):
+        self.trade(self.aapl, Transaction.BUY, 10, 100, 0)
+        self.trade(self.aapl, Transaction.SELL, 5, 60, 31)
+        self.trade(self.aapl, Transaction.SELL, 5, 70, 60)
+
+        response = self.client.get('/analytics/trader/?start=2024-02-01&end=2024-02-28', **self.headers)
+        self.assertEqual(response.status_code, 200)
+        [aapl] = response.json()['tickers']
+        # The January lot prices the February sell; the March sell is after the window.
+        self.assertMetrics(aapl, trades=1, volume_bought=0, volume_sold=5, turnover=60, vwap=12, realized_gain=10,
+                           held=5, held_cost=50, unrealized_gain=50)
+
+        [aapl] = self.client.get('/analytics/trader/', **self.headers).json()['tickers']
+        self.assertMetrics(aapl, trades=3, realized_gain=30, held=0, held_cost=0, unrealized_gain=0)
+        self.assertEqual(self.client.get('/analytics/trader/?start=2024-13-01', **self.headers).status_code, 400)
+        self.assertEqual(self.client.get('/analytics/nobody/', **self.headers).status_code, 404)
+
+
+class MetricsTests(TestCase):
+    """ Checks the error bounds of `Histogram`, the exposition format of `Registry` and the request middleware."""
+
+    def test_every_value_lies_in_its_bucket_within_the_precision(self):
+        histogram = Histogram()
+        large = (2 ** shift + offset for shift in range(11, 40) for offset in (-1, 0, 1, 12345))
+        values = sorted({*range(2000), *large})
+        previous = -1
+        for value in values:
+            index = histogram.index(value)
+            upper = histogram.upper_bound(index)
+            lower = histogram.upper_bound(index - 1) + 1 if index else 0
+            self.assertTrue(lower <= value <= upper, value)
+            self.assertLessEqual(upper - lower + 1, max(lower / histogram.sub_buckets, 1), value)
+            self.assertGreaterEqual(index, previous)
+            previous = index
+
+    def test_quantiles_are_within_one_bucket_of_the_true_value(self):
+        histogram = Histogram(scale=1000)
+        self.assertIsNone(histogram.quantile(0.5))
+        for millis in range(1, 1001):
+            histogram.record(millis / 1000)
+        for q in (0.01, 0.5, 0.9, 0.99):
+            true = q * 1000 / 1000
+            self.assertTrue(true <= histogram.quantile(q) <= true * 1.125, q)
+        self.assertEqual(histogram.quantile(1.0), 1.0)
+
+    def test_render_writes_the_prometheus_text_format(self):
+        metrics = Registry()
+        metrics.increment('requests_total', (('route', 'a/'),), help_text='Requests.')
+        metrics.increment('requests_total', (('route', 'a/'),))
+        histogram = metrics.histogram('queries', (('route', 'a/'),), scale=1, help_text='Queries.')
+        for value in (1, 3, 3):
+            histogram.record(value)
+        self.assertEqual(metrics.render().splitlines(), [
+            '# HELP requests_total Requests.',
+            '# TYPE requests_total counter',
+            'requests_total{route="a/"} 2',
+            '# HELP queries Queries.',
+            '# TYPE queries histogram',
+            'queries_bucket{route="a/",le="1.0"} 0',
+            'queries_bucket{route="a/",le="2.0"} 1',
+            'queries_bucket{route="a/",le="3.0"} 1',
+            'queries_bucket{route="a/",le="4.0"} 3',
+            'queries_bucket{route="a/",le="+Inf"} 3',
+            'queries_sum{route="a/"} 7.0',
+            'queries_count{route="a/"} 3',
+        ])
+
+    def test_middleware_counts_requests_by_route(self):
+        registry.reset()
+        self.addCleanup(registry.reset)
+        token_cache.clear()
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {generate_jwt(User.objects.create(username="reader"))}'}
+        users.objects.create(username='trader', balance=0)
+        for _ in range(2):
+            self.assertEqual(self.client.get('/user/trader/', **headers).status_code, 200)
+        self.client.get('/user/nobody/', **headers)
+
+        text = self.client.get('/metrics/').content.decode()
+        self.assertIn('http_requests_total{route="user/<str:username>/",method="GET",status="200"} 2', text)
+        self.assertIn('http_requests_total{route="user/<str:username>/",method="GET",status="404"} 1', text)
+        self.assertIn('http_request_duration_seconds_count{route="user/<str:username>/",method="GET"} 3', text)
+        # Two queries on the first request; the token check is served from the cache after it.
+        self.assertIn('http_request_db_queries_sum{route="user/<str:username>/",method="GET"} 4.0', text)
+        self.assertIn('http_request_phase_seconds_count{route="user/<str:username>/",method="GET",phase="auth"} 3',
+                      text)
+
+
+class ProjectionTests(TestCase):
+    """ Checks `?fields=` projection and that `ValuesListSerializer` matches DRF's own field by field output."""
+
+    def setUp(self):
+        price_cache.clear()
+        token_cache.clear()
+        Get_AllStocksView.responses.clear()
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {generate_jwt(User.objects.create(username="reader"))}'}
+        self.user = users.objects.create(username='trader', balance=to_micros('1234.567891'))
+        users.objects.create(username='other', balance=-to_micros('0.5'))
+        self.stocks = [Stock.objects.create(ticker='AAPL', price=to_micros('190.25')),
+                       Stock.objects.create(ticker='MSFT', price=to_micros('0.000001'))]
+        Transaction.objects.bulk_create([
+            Transaction(user=self.user, ticker=self.stocks[i % 2],
+                        transaction_type=[Transaction.BUY, Transaction.SELL][i % 2],
+                        transaction_volume=i + 1, transaction_price=to_micros('10.1') * (i + 1),
+                        created_at=timezone.make_aware(datetime(2024, 1, 1, 12, 30, 15, 123456)) + timedelta(hours=i))
+            for i in range(5)
+        ])
+
+    def test_fast_path_matches_drf_serialization(self):
+        for serializer, queryset in [(usersSerializer, users.objects.order_by('id')),
+                                     (StockSerializer, Stock.objects.order_by('id')),
+                                     (TransactionSerializer, Transaction.objects.order_by('id'))]:
+            for fields in [None, serializer.Meta.fields[1:], serializer.Meta.fields[-1:]]:
+                expected = [dict(serializer(row, fields=fields).data) for row in queryset]
+                self.assertEqual(serializer(queryset, many=True, fields=fields).data, expected, (serializer, fields))
+                self.assertEqual(serializer(list(queryset), many=True, fields=fields).data, expected,
+                                 (serializer, fields))
+
+    def test_unknown_fields_are_rejected(self):
+        for path in ['/user/trader/?fields=username,password', '/stocks/?fields=bogus', '/stock/AAPL/?fields=,',
+                     '/transactions/trader/?fields=id,balance']:
+            response = self.client.get(path, **self.headers)
+            self.assertEqual(response.status_code, 400, path)
+            self.assertIn('fields', response.json(), path)
+
+    def assertSelects(self, path, table, fetched, skipped):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, **self.headers)
+        self.assertEqual(response.status_code, 200, path)
+        [sql] = [query['sql'] for query in queries if f'FROM {connection.ops.quote_name(table)}' in query['sql']]
+        select = sql.split(' FROM ')[0]
+        for column in fetched:
+            self.assertIn(connection.ops.quote_name(column), select, path)
+        for column in skipped:
+            self.assertNotIn(connection.ops.quote_name(column), select, path)
+        return response.json()
+
+    def test_only_the_selected_columns_are_read(self):
+        body = self.assertSelects('/user/trader/?fields=balance', users._meta.db_table, ['balance'], ['username'])
+        self.assertEqual(body, {'balance': 1234.567891})
+        body = self.assertSelects('/stocks/?fields=ticker', Stock._meta.db_table, ['ticker'], ['price'])
+        self.assertEqual(body, [{'ticker': 'AAPL'}, {'ticker': 'MSFT'}])
+        body = self.assertSelects('/transactions/trader/?fields=transaction_price', Transaction._meta.db_table,
+                                  ['transaction_price'], ['transaction_volume', 'transaction_type', 'ticker_id'])
+        self.assertEqual([row['transaction_price'] for row in body['results']],
+                         [10.1, 20.2, 30.3, 40.4, 50.5])
+
+
+class SummaryTests(TestCase):
+    """ Checks the grouped ticker and cash flow summaries and that incremental rollups add up to a full rebuild."""
+
+    def setUp(self):
+        self.alice = users.objects.create(username='alice', balance=0)
+        self.bob = users.objects.create(username='bob', balance=0)
+        self.aapl = Stock.objects.create(ticker='AAPL', price=to_micros(10))
+        self.msft = Stock.objects.create(ticker='MSFT', price=to_micros(20))
+        self.trade(self.alice, self.aapl, Transaction.BUY, 2, 20, day=1, hour=9)
+        self.trade(self.bob, self.aapl, Transaction.SELL, 1, 11, day=1, hour=15)
+        self.trade(self.alice, self.msft, Transaction.BUY, 1, 20, day=1, hour=15)
+        self.trade(self.alice, self.aapl, Transaction.SELL, 3, 36, day=2, hour=9)
+
+    def trade(self, user, stock, side, volume, total, day, hour=12):
+        Transaction.objects.create(user=user, ticker=stock, transaction_type=side, transaction_volume=volume,
+                                   transaction_price=to_micros(total),
+                                   created_at=timezone.make_aware(datetime(2024, 1, day, hour)))
+
+    def rollup(self):
+        return list(DailyRollup.objects.order_by('date', 'stock_id').values_list(
+            'date', 'stock_id', 'volume', 'notional', 'buy_count', 'sell_count'))
+
+    def test_ticker_summary_groups_by_ticker_and_period(self):
+        rows = [(row['period'].day, row['symbol'], row['volume'], row['notional'], row['buy_count'], row['sell_count'])
+                for row in ticker_summary()]
+        self.assertEqual(rows, [(1, 'AAPL', 3, to_micros(31), 1, 1), (1, 'MSFT', 1, to_micros(20), 1, 0),
+                                (2, 'AAPL', 3, to_micros(36), 0, 1)])
+        self.assertEqual(len(ticker_summary(interval='hour')), 4)
+        window = ticker_summary(timezone.make_aware(datetime(2024, 1, 2)), timezone.make_aware(datetime(2024, 1, 3)))
+        self.assertEqual([(row['symbol'], row['volume']) for row in window], [('AAPL', 3)])
+
+    def test_user_cash_flow_nets_sells_against_buys(self):
+        rows = [(row['username'], row['bought'], row['sold'], row['trades'], row['net_cash_flow'])
+                for row in user_cash_flow()]
+        self.assertEqual(rows, [('alice', to_micros(40), to_micros(36), 3, to_micros(-4)),
+                                ('bob', 0, to_micros(11), 1, to_micros(11))])
+        day_one = user_cash_flow(end=timezone.make_aware(datetime(2024, 1, 2)), username='alice')
+        self.assertEqual([(row['username'], row['net_cash_flow']) for row in day_one], [('alice', to_micros(-40))])
+
+    def test_incremental_refresh_matches_a_full_rebuild(self):
+        out = StringIO()
+        call_command('refresh_rollups', stdout=out)
+        self.assertIn('Rolled up 4 transactions into 3 daily rows.', out.getvalue())
+        self.assertEqual(refresh_daily_rollup(), (0, 0))
+
+        # New trades land on an existing day and ticker and on a new day.
+        self.trade(self.bob, self.aapl, Transaction.BUY, 5, 50, day=1, hour=18)
+        self.trade(self.bob, self.msft, Transaction.SELL, 1, 21, day=3)
+        self.assertEqual(refresh_daily_rollup(), (2, 2))
+        self.assertEqual(RollupState.objects.get().last_transaction_id, Transaction.objects.latest('id').id)
+        incremental = self.rollup()
+
+        call_command('refresh_rollups', '--full', stdout=StringIO())
+        self.assertEqual(self.rollup(), incremental)
+        self.assertEqual(incremental[0][1:], (self.aapl.pk, 8, to_micros(81), 2, 1))
+        self.assertEqual(
+            [(row['period'], row['symbol'], row['volume'], row['notional']) for row in rollup_summary()],
+            [(row['period'], row['symbol'], row['volume'], row['notional']) for row in ticker_summary()],
+        )
+
+
+class ConnectionStatsTests(TestCase):
+    """ Checks that the connection hooks installed at startup time connections and count queries."""
+
+    def setUp(self):
+        token_cache.clear()
+        connection_stats.clear()
+        self.addCleanup(connection_stats.clear)
+
+    def open_connection(self):
+        wrapper = connections.create_connection('default')
+        self.addCleanup(wrapper.close)
+        wrapper.connect()
+        return wrapper
+
+    def test_install_wraps_connect_once(self):
+        connect = BaseDatabaseWrapper.connect
+        self.assertTrue(connect.timed)
+        install()
+        self.assertIs(BaseDatabaseWrapper.connect, connect)
+
+    def test_new_connections_are_timed_and_their_queries_counted(self):
+        for _ in range(2):
+            wrapper = self.open_connection()
+        self.assertIn(record_query, wrapper.execute_wrappers)
+        stats = connection_stats.stats()['default']
+        self.assertEqual(stats['connections_opened'], 2)
+        self.assertGreaterEqual(stats['wait_ms_max'], stats['wait_ms_p50'])
+
+        timings = RequestTimings()
+        token = current_request.set(timings)
+        try:
+            with wrapper.cursor() as cursor:
+                cursor.execute('SELECT 1')
+                cursor.execute('SELECT 2')
+        finally:
+            current_request.reset(token)
+        self.assertEqual(timings.queries, 2)
+        self.assertGreater(timings.query_time, 0)
+
+    def test_stats_endpoint_reports_every_alias(self):
+        self.open_connection()
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {generate_jwt(User.objects.create(username="reader"))}'}
+        body = self.client.get('/db-connections/', **headers).json()
+        self.assertEqual(set(body), set(connections))
+        self.assertEqual(body['default']['connections_opened'], 1)
+        self.assertIsNotNone(body['default']['wait_ms_p99'])
+        self.assertIsNone(body['default']['pool'])
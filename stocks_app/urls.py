@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import views, async_views
 from .views import *
 
 urlpatterns = [
@@ -11,6 +11,23 @@ urlpatterns = [
     path('stock/<str:ticker>/', Get_StockView.as_view(), name='get_stock'),
     path('stocks/', Get_AllStocksView.as_view(), name='get_all_stocks'),
     path('add-transaction/', Add_TransactionView.as_view(), name='add_transaction'),
+    path('add-transactions/bulk/', Add_BulkTransactionsView.as_view(), name='add_transactions_bulk'),
     path('transactions/<str:username>/<str:start_time>/<str:end_time>/', Get_TransactionsByDateView.as_view()),
-    path('transactions/<str:username>/', Get_TransactionsView.as_view(), name='get_transactions')
+    path('transactions/<str:username>/', Get_TransactionsView.as_view(), name='get_transactions'),
+    path('positions/<str:username>/', Get_PositionsView.as_view(), name='get_positions'),
+    path('analytics/<str:username>/', Get_AnalyticsView.as_view(), name='get_analytics'),
+    path('summary/tickers/', Get_TickerSummaryView.as_view(), name='get_ticker_summary'),
+    path('summary/users/', Get_UserCashFlowView.as_view(), name='get_user_cash_flow'),
+    path('orders/', Add_OrderView.as_view(), name='add_order'),
+    path('orders/<int:order_id>/cancel/', Cancel_OrderView.as_view(), name='cancel_order'),
+    path('sequencer/', Get_SequencerStatsView.as_view(), name='get_sequencer_stats'),
+    path('db-connections/', Get_ConnectionStatsView.as_view(), name='get_connection_stats'),
+    path('metrics/', Get_MetricsView.as_view(), name='get_metrics'),
+    path('async/user/<str:username>/', async_views.GetUser_ByUsernameView.as_view(), name='async_get_user_by_username'),
+    path('async/stock/<str:ticker>/', async_views.Get_StockView.as_view(), name='async_get_stock'),
+    path('async/stocks/', async_views.Get_AllStocksView.as_view(), name='async_get_all_stocks'),
+    path('async/add-transaction/', async_views.Add_TransactionView.as_view(), name='async_add_transaction'),
+    path('async/transactions/<str:username>/', async_views.Get_TransactionsView.as_view(),
+         name='async_get_transactions'),
+    path('async/stream/', async_views.Get_StreamView.as_view(), name='async_stream'),
 ]
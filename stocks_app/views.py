@@ -1,7 +1,21 @@
 from .forms import RegisterForm
-from .models import users, Stock, Transaction
+from .models import users, Stock, Transaction, Position
 from .authentication import jwt_required, generate_jwt
-from .serializers import usersSerializer, StockSerializer, TransactionSerializer, registerSerializer
+from .idempotency import idempotent
+from .archive import archived_transactions, reaches_archive
+from .dbpool import connection_stats
+from .metrics import registry
+from .routers import pin_to_primary, read_from_replica
+from .querybudget import query_budget
+from .pagination import TransactionCursorPagination, stream_transactions
+from .prices import price_cache, stocks_version
+from . import analytics, summaries
+from .orders import clean_order, place_order, place_orders, OrderError, MAX_BULK_ORDERS
+from .sequencer import sequencer
+from .journal import journal
+from .matching import engine
+from .money import from_micros, rows_from_micros, to_micros
+from .serializers import usersSerializer, StockSerializer, TransactionSerializer, PositionSerializer, registerSerializer
 from rest_framework.permissions import AllowAny
 from rest_framework.views import APIView
 from rest_framework.response import Response
@@ -11,7 +25,16 @@ from django.contrib.auth.hashers import make_password
 from django.contrib.auth import authenticate
 from drf_yasg.utils import swagger_auto_schema
 from django.utils.decorators import method_decorator
-from datetime import datetime
+from django.utils import timezone
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework.renderers import JSONRenderer
+from django.conf import settings
+from collections import OrderedDict
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import datetime, timedelta
+import hashlib
+import threading
 
 
 """ 
@@ -28,6 +51,7 @@ class User_RegisterView(APIView):
         This method is used to create a new user using the `POST` method.
         @:param request : which contained the user inputted data
     """
+    @method_decorator(query_budget(3))
     @swagger_auto_schema(request_body=registerSerializer)
     def post(self, request):
         form = RegisterForm(request.data)
@@ -63,6 +87,7 @@ class User_LoginView(APIView):
         This method is used to create a new user using the `POST` method.
         @:param request : which contained the user inputted data
     """
+    @method_decorator(query_budget(2))
     @swagger_auto_schema(request_body=registerSerializer)
     def post(self, request):
         username = request.data.get('username')
@@ -92,6 +117,7 @@ class Add_UserView(APIView):
         @:param request : which contained the user inputted data
     """
 
+    @method_decorator(query_budget(3))
     @method_decorator(jwt_required)
     @swagger_auto_schema(request_body=usersSerializer)
     def post(self, request):
@@ -105,7 +131,7 @@ class Add_UserView(APIView):
 
 """
 This CBV GET a user from the database based on the provided username
-it returns the user data.
+it returns the user data, or only the fields named in `?fields=`.
 """
 
 
@@ -115,12 +141,14 @@ class GetUser_ByUsernameView(APIView):
         This method is used to GET user info using the `GET` method.
         @:param request : which contained the user inputted data
     """
+    @method_decorator(query_budget(2))
     @method_decorator(jwt_required)
     @swagger_auto_schema()
     def get(self, request, username):
+        fields = usersSerializer.requested_fields(request.query_params)
         try:
-            user = users.objects.get(username=username)
-            serializer = usersSerializer(user)
+            user = users.objects.only(*usersSerializer.columns(fields)).get(username=username)
+            serializer = usersSerializer(user, fields=fields)
             return Response(serializer.data, status=status.HTTP_200_OK)
         except users.DoesNotExist:
             return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
@@ -141,6 +169,7 @@ class Add_StockView(APIView):
 
     """
 
+    @method_decorator(query_budget(3))
     @swagger_auto_schema(request_body=StockSerializer)
     @method_decorator(jwt_required)
     def post(self, request):
@@ -153,7 +182,8 @@ class Add_StockView(APIView):
 
 """
 This CBV GET a stock from the database based on the provided ticker
-and returns the stock data. Requires JWT authentication.
+and returns the stock data, or only the fields named in `?fields=`.
+Requires JWT authentication.
 """
 
 
@@ -167,42 +197,79 @@ class Get_StockView(APIView):
 
     """
 
+    @method_decorator(query_budget(2))
     @method_decorator(jwt_required)
     @swagger_auto_schema()
     def get(self, request, ticker):
+        fields = StockSerializer.requested_fields(request.query_params)
         try:
-            stock = Stock.objects.get(ticker=ticker)
-            serializer = StockSerializer(stock)
+            stock = price_cache.get(ticker=ticker)
+            serializer = StockSerializer(stock, fields=fields)
             return Response(serializer.data, status=status.HTTP_200_OK)
         except Stock.DoesNotExist:
             return Response({"error": "Stock not found"}, status=status.HTTP_404_NOT_FOUND)
 
 
 """
-This CBV GET stocks from the database and returns them.
+This CBV GET stocks from the database and returns them. Rendered bodies are
+cached per stocks-table version and answered with `304 Not Modified` when the
+client already holds the current `ETag`. Supports `?tickers=A,B` filtering
+and `?fields=ticker,price` projection.
 """
 
 
 class Get_AllStocksView(APIView):
     permission_classes = [AllowAny]
+    max_cached_responses = 256
+    responses = OrderedDict()
+    responses_lock = threading.Lock()
 
     """
-        This method is used to view all the stocks using the `POST` method.
+        This method is used to view all the stocks using the `GET` method.
         @:param request : which contained the user inputted data
     """
 
+    @method_decorator(query_budget(3))
     @swagger_auto_schema()
     @method_decorator(jwt_required)
     def get(self, request):
-        stocks = Stock.objects.all()
-        serializer = StockSerializer(stocks, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        tickers = request.query_params.get('tickers')
+        tickers = tuple(sorted({t for t in tickers.split(',') if t})) if tickers else ()
+        fields = tuple(StockSerializer.requested_fields(request.query_params))
+
+        version, modified_at = stocks_version.get()
+        variant = hashlib.md5(repr((tickers, fields)).encode()).hexdigest()[:12]
+        etag = f'"{version}-{variant}"'
+
+        if_none_match = request.headers.get('If-None-Match')
+        if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since') or '')
+        if ((if_none_match and etag in [tag.strip() for tag in if_none_match.split(',')]) or
+                (not if_none_match and if_modified_since and int(modified_at) <= if_modified_since)):
+            response = HttpResponseNotModified()
+        else:
+            key = (version, tickers, fields)
+            body = self.responses.get(key)
+            if body is None:
+                stocks = Stock.objects.order_by('id')
+                if tickers:
+                    stocks = stocks.filter(ticker__in=tickers)
+                body = JSONRenderer().render(StockSerializer(stocks, many=True, fields=fields).data)
+                with self.responses_lock:
+                    self.responses[key] = body
+                    while len(self.responses) > self.max_cached_responses:
+                        self.responses.popitem(last=False)
+            response = HttpResponse(body, content_type='application/json')
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(modified_at)
+        response['Cache-Control'] = 'no-cache'
+        return response
 
 
 """
 This CBV handles the creation of a new transaction using the `POST` method.
 It verifies the user and stock, calculates the transaction price, and updates
-the user's balance accordingly before saving the transaction.
+the user's balance and saves the transaction in a single atomic block.
 """
 
 
@@ -211,60 +278,124 @@ class Add_TransactionView(APIView):
 
     """
         This method is used to create a new transaction  `POST` method.
+        With the order sequencer enabled the order is queued on its shard and the
+        request waits for the fill, or returns `202 Accepted` at once with `?wait=false`
+        and whenever the fill takes longer than `ORDER_SEQUENCER_TIMEOUT`.
+        In write-behind mode the request returns `202 Accepted` with the journal
+        sequence number once the order is on disk. A retry carrying the same
+        `Idempotency-Key` header gets the first response back without a second fill.
         @:param request : which contained the user inputted data
     """
 
+    @method_decorator(query_budget(14))
     @swagger_auto_schema(request_body=TransactionSerializer)
     @method_decorator(jwt_required)
+    @method_decorator(pin_to_primary)
+    @method_decorator(idempotent)
     def post(self, request):
-        user_id = request.data.get('user')
-        ticker = request.data.get('ticker')
-        transaction_type = request.data.get('transaction_type')
-        transaction_volume = request.data.get('transaction_volume')
+        try:
+            order = clean_order(request.data)
+            if getattr(settings, 'ORDER_WRITE_BEHIND_ENABLED', False):
+                sequence = journal.submit(order)[0].result()
+                return Response({"status": "journaled", "sequence": sequence}, status=status.HTTP_202_ACCEPTED)
+            if not getattr(settings, 'ORDER_SEQUENCER_ENABLED', True):
+                trade = place_order(*order)
+            else:
+                shard, future = sequencer.submit(order)
+                if request.query_params.get('wait', '').lower() in ('0', 'false', 'no'):
+                    return Response({"status": "queued", "shard": shard}, status=status.HTTP_202_ACCEPTED)
+                trade = future.result(timeout=getattr(settings, 'ORDER_SEQUENCER_TIMEOUT', 5.0))
+        except OrderError as e:
+            return Response({"error": e.message}, status=e.status_code)
+        except FutureTimeoutError:
+            return Response({"status": "queued", "shard": shard}, status=status.HTTP_202_ACCEPTED)
+        except OSError:
+            return Response({"error": "The order journal is not writable."},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        serializer = TransactionSerializer(trade)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-        if user_id is None or ticker is None:
-            return Response({"error": "User ID and ticker are required."}, status=400)
 
-        try:
-            user = users.objects.get(pk=user_id)
-            stock = Stock.objects.get(pk=ticker)
-        except users.DoesNotExist:
-            return Response({"error": "User not found."}, status=status.HTTP_404_NOT_FOUND)
-        except Stock.DoesNotExist:
-            return Response({"error": "Stock not found."}, status=status.HTTP_404_NOT_FOUND)
+"""
+This CBV handles a batch of new transactions using the `POST` method.
+All orders are filled in one database transaction and the response holds
+one result per submitted order, in the same order.
+"""
 
-        transaction_price = stock.price * int(transaction_volume)
 
-        if transaction_type == 'buy' and user.balance < transaction_price:
-            return Response({"error": "You don't have enough balance to perform the transaction."},
+class Add_BulkTransactionsView(APIView):
+    permission_classes = [AllowAny]
+
+    """
+        This method is used to create many transactions at once using the `POST` method.
+        @:param request : which contained a list of orders
+    """
+
+    @method_decorator(query_budget(14))
+    @swagger_auto_schema(request_body=TransactionSerializer(many=True))
+    @method_decorator(jwt_required)
+    @method_decorator(pin_to_primary)
+    @method_decorator(idempotent)
+    def post(self, request):
+        orders = request.data
+        if not isinstance(orders, list):
+            return Response({"error": "A list of orders is required."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(orders) > MAX_BULK_ORDERS:
+            return Response({"error": f"At most {MAX_BULK_ORDERS} orders can be submitted at once."},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        if transaction_type == 'buy':
-            user.balance -= transaction_price
-        elif transaction_type == 'sell':
-            user.balance += transaction_price
+        placed = place_orders(orders)
+        trades = iter(TransactionSerializer(
+            [result for result in placed if not isinstance(result, OrderError)], many=True
+        ).data)
 
-        user.save()
+        results = []
+        for result in placed:
+            if isinstance(result, OrderError):
+                results.append({"status": result.status_code, "error": result.message})
+            else:
+                results.append({"status": status.HTTP_201_CREATED, "transaction": next(trades)})
 
-        transaction_data = {
-            'user': user.id,
-            'ticker': stock.id,
-            'transaction_type': transaction_type,
-            'transaction_volume': transaction_volume,
-            'transaction_price': transaction_price
-        }
+        filled = sum(1 for result in results if result["status"] == status.HTTP_201_CREATED)
+        return Response({"filled": filled, "rejected": len(results) - filled, "results": results},
+                        status=status.HTTP_200_OK)
 
-        serializer = TransactionSerializer(data=transaction_data)
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+"""
+Answers a history request with one keyset page, or a streamed export when `?export=` is given.
+Archived months of the user are read back first, only when the archive index has rows of the user in the range.
+Only the columns named in `?fields=` are fetched and returned.
+"""
+
+
+def transaction_history_response(request, transactions, filename, user_id=None, start=None, end=None):
+    fields = TransactionSerializer.requested_fields(request.query_params)
+    export = request.query_params.get('export')
+    paginator = TransactionCursorPagination()
+    # Exports ignore the cursor, pages only need the archive when it has rows after it.
+    after = paginator.get_position(request.query_params) if export is None else None
+    archived = None
+    if user_id is not None and reaches_archive(start, end, user_id=user_id, after=after):
+        def archived(after=None):
+            return archived_transactions(user_id=user_id, start=start, end=end, after=after)
+
+    if export is not None:
+        if export not in ('ndjson', 'csv'):
+            return Response({"error": "Export must be 'ndjson' or 'csv'."}, status=status.HTTP_400_BAD_REQUEST)
+        return stream_transactions(transactions, export, filename, archived=archived and archived(), fields=fields)
+
+    # The cursor is built from the last row's position, so those columns are always loaded.
+    transactions = transactions.only(*TransactionSerializer.columns(fields), 'created_at')
+    page = paginator.paginate_queryset(transactions, request, archived=archived)
+    serializer = TransactionSerializer(page, many=True, fields=fields)
+    return paginator.get_paginated_response(serializer.data)
 
 
 """
 This CBV fetches transactions for a user between two dates, using the
-`GET` method. Requires JWT authentication.
+`GET` method. Results are paged by cursor, or streamed with `?export=ndjson|csv`.
+Requires JWT authentication.
 """
 
 
@@ -279,23 +410,26 @@ class Get_TransactionsByDateView(APIView):
         @:param end_time : which represents the ending time of the transaction
     """
 
+    @method_decorator(query_budget(5))
     @swagger_auto_schema()
     @method_decorator(jwt_required)
+    @method_decorator(read_from_replica)
     def get(self, request, username, start_time, end_time):
         try:
-            start_date = datetime.strptime(start_time, '%Y-%m-%d')
-            end_date = datetime.strptime(end_time, '%Y-%m-%d')
+            start_date = timezone.make_aware(datetime.strptime(start_time, '%Y-%m-%d'))
+            end_date = timezone.make_aware(datetime.strptime(end_time, '%Y-%m-%d')) + timedelta(days=1)
 
             user = users.objects.get(username=username)
 
+            # Half-open range on the raw timestamp so the (user, created_at) index is usable.
             transactions = Transaction.objects.filter(
                 user=user,
-                created_at__date__gte=start_date,
-                created_at__date__lte=end_date
+                created_at__gte=start_date,
+                created_at__lt=end_date
             )
 
-            serializer = TransactionSerializer(transactions, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return transaction_history_response(request, transactions, f'{username}-{start_time}-{end_time}',
+                                                user_id=user.id, start=start_date, end=end_date)
 
         except users.DoesNotExist:
             return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
@@ -305,6 +439,7 @@ class Get_TransactionsByDateView(APIView):
 
 """
 This CBV fetches all transactions for a specific user using the `GET` method.
+Results are paged by cursor, or streamed with `?export=ndjson|csv`.
 """
 
 
@@ -317,9 +452,290 @@ class Get_TransactionsView(APIView):
         @:param username : which represents the username of the user
     """
 
+    @method_decorator(query_budget(5))
     @swagger_auto_schema()
     @method_decorator(jwt_required)
+    @method_decorator(read_from_replica)
     def get(self, request, username):
         transactions = Transaction.objects.filter(user__username=username)
-        serializer = TransactionSerializer(transactions, many=True)
+        user_id = users.objects.filter(username=username).values_list('id', flat=True).first()
+        return transaction_history_response(request, transactions, username, user_id=user_id)
+
+
+"""
+This CBV fetches the current holdings of a user using the `GET` method.
+Holdings are read from the `Position` table, so the cost does not grow
+with the number of trades the user has made.
+"""
+
+
+class Get_PositionsView(APIView):
+    permission_classes = [AllowAny]
+
+    """
+        This method is used to view the positions held by a user using the `GET` method.
+        @:param request : which contained the user inputted data
+        @:param username : which represents the username of the user
+    """
+
+    @method_decorator(query_budget(3))
+    @swagger_auto_schema()
+    @method_decorator(jwt_required)
+    @method_decorator(read_from_replica)
+    def get(self, request, username):
+        try:
+            user = users.objects.get(username=username)
+        except users.DoesNotExist:
+            return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        positions = Position.objects.filter(user=user).exclude(quantity=0).select_related('stock')
+        serializer = PositionSerializer(positions, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+""" Reads the optional `?start=YYYY-MM-DD&end=YYYY-MM-DD` window as a half-open datetime range."""
+
+
+def date_window(request):
+    start_time = request.query_params.get('start')
+    end_time = request.query_params.get('end')
+    start_date = timezone.make_aware(datetime.strptime(start_time, '%Y-%m-%d')) if start_time else None
+    end_date = timezone.make_aware(datetime.strptime(end_time, '%Y-%m-%d')) + timedelta(days=1) if end_time else None
+    return start_date, end_date
+
+
+"""
+This CBV reports portfolio analytics of a user using the `GET` method:
+turnover, VWAP, realized and unrealized gains per ticker over an optional
+`?start=YYYY-MM-DD&end=YYYY-MM-DD` window. Requires JWT authentication.
+"""
+
+
+class Get_AnalyticsView(APIView):
+    permission_classes = [AllowAny]
+
+    """
+        This method is used to view the portfolio analytics of a user using the `GET` method.
+        @:param request : which contained the user inputted data
+        @:param username : which represents the username of the user
+    """
+
+    @method_decorator(query_budget(5))
+    @swagger_auto_schema()
+    @method_decorator(jwt_required)
+    @method_decorator(read_from_replica)
+    def get(self, request, username):
+        if analytics.np is None:
+            return Response({"error": "Analytics require NumPy to be installed."},
+                            status=status.HTTP_501_NOT_IMPLEMENTED)
+        try:
+            start_date, end_date = date_window(request)
+            user = users.objects.get(username=username)
+        except users.DoesNotExist:
+            return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
+        except ValueError:
+            return Response({"error": "Invalid date format"}, status=status.HTTP_400_BAD_REQUEST)
+
+        report = analytics.portfolio_analytics(user, start_date, end_date)
+        return Response(dict(user=username, start=request.query_params.get('start'),
+                             end=request.query_params.get('end'), **report), status=status.HTTP_200_OK)
+
+
+"""
+This CBV reports traded volume, notional and buy/sell counts per ticker and
+per day or hour using the `GET` method. The totals are computed by one grouped
+SQL query, or read from the daily rollup table with `?source=rollup`.
+"""
+
+
+class Get_TickerSummaryView(APIView):
+    permission_classes = [AllowAny]
+
+    """
+        This method is used to view the per-ticker totals using the `GET` method.
+        @:param request : which contained `start`, `end`, `interval` and `source`
+    """
+
+    @method_decorator(query_budget(2))
+    @swagger_auto_schema()
+    @method_decorator(jwt_required)
+    @method_decorator(read_from_replica)
+    def get(self, request):
+        interval = request.query_params.get('interval', 'day')
+        source = request.query_params.get('source', 'ledger')
+        if interval not in summaries.TRUNCATIONS:
+            return Response({"error": "Interval must be 'day' or 'hour'."}, status=status.HTTP_400_BAD_REQUEST)
+        if source not in ('ledger', 'rollup') or (source == 'rollup' and interval != 'day'):
+            return Response({"error": "Source must be 'ledger', or 'rollup' for daily totals."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            start_date, end_date = date_window(request)
+        except ValueError:
+            return Response({"error": "Invalid date format"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if source == 'rollup':
+            rows = summaries.rollup_summary(start_date, end_date)
+        else:
+            rows = summaries.ticker_summary(start_date, end_date, interval)
+        return Response(rows_from_micros(list(rows), ['notional']), status=status.HTTP_200_OK)
+
+
+"""
+This CBV reports the net cash flow of every user, or of one user with
+`?username=`, using the `GET` method. Computed by one grouped SQL query.
+"""
+
+
+class Get_UserCashFlowView(APIView):
+    permission_classes = [AllowAny]
+
+    """
+        This method is used to view the cash flow per user using the `GET` method.
+        @:param request : which contained `start`, `end` and `username`
+    """
+
+    @method_decorator(query_budget(2))
+    @swagger_auto_schema()
+    @method_decorator(jwt_required)
+    @method_decorator(read_from_replica)
+    def get(self, request):
+        try:
+            start_date, end_date = date_window(request)
+        except ValueError:
+            return Response({"error": "Invalid date format"}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows = summaries.user_cash_flow(start_date, end_date, request.query_params.get('username'))
+        return Response(rows_from_micros(list(rows), ['bought', 'sold', 'net_cash_flow']),
+                        status=status.HTTP_200_OK)
+
+
+"""
+This CBV hands a limit or market order to the matching engine using the `POST` method.
+The order is checked against the balance or holdings of the user, matched, and
+flushed with its fills before the response is sent.
+"""
+
+
+class Add_OrderView(APIView):
+    permission_classes = [AllowAny]
+
+    """
+        This method is used to place an order on the book using the `POST` method.
+        Without `price` the order is a market order, whatever it cannot fill is cancelled.
+        @:param request : which contained the order fields of `add-transaction/` and an optional `price`
+    """
+
+    @method_decorator(query_budget(16))
+    @swagger_auto_schema()
+    @method_decorator(jwt_required)
+    @method_decorator(pin_to_primary)
+    def post(self, request):
+        try:
+            user_id, ticker_id, side, quantity = clean_order(request.data)
+            price = request.data.get('price')
+            if price is not None:
+                try:
+                    price = to_micros(price)
+                except ValueError:
+                    return Response({"error": "Price must be a number."}, status=status.HTTP_400_BAD_REQUEST)
+            # An order that cannot be saved is taken back and answered with 503.
+            order, fills = engine.start().place(user_id, ticker_id, side, quantity, price)
+        except OrderError as e:
+            return Response({"error": e.message}, status=e.status_code)
+
+        return Response({
+            "id": order.id,
+            "status": order.status,
+            "remaining": order.remaining,
+            "fills": [{"order": resting.id, "price": from_micros(fill_price), "quantity": fill_quantity}
+                      for resting, fill_price, fill_quantity in fills],
+        }, status=status.HTTP_201_CREATED)
+
+
+"""
+This CBV cancels a resting order of the matching engine using the `POST` method.
+"""
+
+
+class Cancel_OrderView(APIView):
+    permission_classes = [AllowAny]
+
+    """
+        This method is used to cancel an order that is still on the book using the `POST` method.
+        An order that was already filled or cancelled is reported with `cancelled` false.
+        @:param request : the incoming request
+        @:param order_id : which represents the id of the order
+    """
+
+    @method_decorator(query_budget(6))
+    @swagger_auto_schema()
+    @method_decorator(jwt_required)
+    @method_decorator(pin_to_primary)
+    def post(self, request, order_id):
+        cancelled = engine.start().cancel(order_id)
+        if cancelled:
+            engine.flush()
+        return Response({"id": order_id, "cancelled": cancelled}, status=status.HTTP_200_OK)
+
+
+"""
+This CBV reports the queue depth and fill counters of every order sequencer
+shard using the `GET` method.
+"""
+
+
+class Get_SequencerStatsView(APIView):
+    permission_classes = [AllowAny]
+
+    """
+        This method is used to view the order sequencer metrics using the `GET` method.
+        @:param request : the incoming request
+    """
+
+    @method_decorator(query_budget(1))
+    @swagger_auto_schema()
+    @method_decorator(jwt_required)
+    def get(self, request):
+        return Response(sequencer.stats(), status=status.HTTP_200_OK)
+
+
+"""
+This CBV reports how many database connections each alias opened and how
+long opening them, or waiting for a pooled one, took.
+"""
+
+
+class Get_ConnectionStatsView(APIView):
+    permission_classes = [AllowAny]
+
+    """
+        This method is used to view the database connection metrics using the `GET` method.
+        @:param request : the incoming request
+    """
+
+    @method_decorator(query_budget(1))
+    @swagger_auto_schema()
+    @method_decorator(jwt_required)
+    def get(self, request):
+        return Response(connection_stats.stats(), status=status.HTTP_200_OK)
+
+
+"""
+This CBV serves the request, query and phase histograms of this process in
+the Prometheus text format. It is left unauthenticated for the scraper, so
+expose it on an internal network only.
+"""
+
+
+class Get_MetricsView(APIView):
+    permission_classes = [AllowAny]
+
+    """
+        This method is used to scrape the metrics using the `GET` method.
+        @:param request : the incoming request
+    """
+
+    @method_decorator(query_budget(0))
+    @swagger_auto_schema(auto_schema=None)
+    def get(self, request):
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
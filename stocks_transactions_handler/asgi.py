@@ -9,8 +9,32 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from django.core.handlers.asgi import ASGIHandler
+from django.urls import reverse
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'stocks_transactions_handler.settings')
 
-application = get_asgi_application()
+
+class StreamingASGIHandler(ASGIHandler):
+    """
+    Django's ASGI handler, except that event streams are not run in a
+    per-request thread-sensitive context. That context gives every request
+    its own thread for the sync signal receivers and ORM calls, kept until
+    the response ends, so each open stream would hold an idle thread. Their
+    few sync calls go to asgiref's one shared thread instead.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.stream_path = reverse('async_stream')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == self.stream_path:
+            await self.handle(scope, receive, send)
+        else:
+            await super().__call__(scope, receive, send)
+
+
+django.setup(set_prefix=False)
+application = StreamingASGIHandler()
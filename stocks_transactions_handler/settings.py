@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/5.1/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
+import os
 from datetime import timedelta
 from pathlib import Path
 
@@ -61,9 +62,92 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.BasicAuthentication',
 
-    ]
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'stocks_app.metrics.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
+# Per-route request, query and phase histograms served at metrics/. With
+# PROFILE_SAMPLE_RATE = N every Nth sync request is profiled with 'cprofile' or
+# 'pyinstrument' and written to PROFILE_DIR; 0 turns sampling off.
+METRICS_ENABLED = True
+PROFILE_SAMPLE_RATE = int(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILER = os.environ.get('PROFILER', 'cprofile')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', str(BASE_DIR / 'profiles'))
+
+# Every view has a maximum number of queries per request. QUERY_BUDGET_MODE is
+# 'raise' (tests), 'warn' (logs) or 'off'. With QUERY_N_PLUS_ONE_THRESHOLD = N
+# any SQL shape repeated N times in one request is logged with its call sites;
+# this walks the stack on every query, so it is off unless the environment
+# variable of the same name is set. test_settings turns it on.
+QUERY_BUDGET_MODE = 'warn' if DEBUG else 'off'
+QUERY_N_PLUS_ONE_THRESHOLD = int(os.environ['QUERY_N_PLUS_ONE_THRESHOLD']) if os.environ.get(
+    'QUERY_N_PLUS_ONE_THRESHOLD') else None
+
+# Server-sent price and fill events at async/stream/, fanned out in process.
+# A stream more than STREAM_QUEUE_SIZE fills behind is closed; idle streams get
+# a heartbeat every STREAM_HEARTBEAT seconds and end after STREAM_MAX_AGE.
+STREAMS_ENABLED = True
+STREAM_QUEUE_SIZE = 256
+STREAM_HEARTBEAT = 15.0
+STREAM_MAX_AGE = 3600.0
+STREAM_MAX_SUBSCRIBERS = 20000
+
+# Keyset pagination and streaming export of the transaction history endpoints
+TRANSACTIONS_PAGE_SIZE = 100
+TRANSACTIONS_MAX_PAGE_SIZE = 1000
+TRANSACTIONS_EXPORT_CHUNK_SIZE = 2000
+
+# Whole months of transactions older than TRANSACTIONS_HOT_MONTHS are moved to
+# gzip files in TRANSACTIONS_ARCHIVE_DIR by the archive_transactions command.
+# On Postgres the table is partitioned by month, and the command keeps
+# TRANSACTIONS_PARTITIONS_AHEAD future partitions created.
+TRANSACTIONS_ARCHIVE_DIR = os.environ.get('TRANSACTIONS_ARCHIVE_DIR', str(BASE_DIR / 'archive'))
+TRANSACTIONS_HOT_MONTHS = 12
+TRANSACTIONS_PARTITIONS_AHEAD = 3
+
+# In-process cache of verified JWTs used by `jwt_required`. Saving a user only
+# drops its cached tokens in the same process, so other workers keep accepting
+# them for at most JWT_CACHE_TTL seconds.
+JWT_CACHE_ENABLED = True
+JWT_CACHE_MAX_ENTRIES = 10000
+JWT_CACHE_TTL = 60
+
+# Read-through Stock price cache. PRICE_CACHE_BACKEND names an entry of CACHES
+# shared by all workers; None keeps only the in-process tier, and the stocks/
+# ETag version is then read from the database.
+PRICE_CACHE_ENABLED = True
+PRICE_CACHE_BACKEND = None
+PRICE_CACHE_MAX_STALENESS = 1.0
+
+# Per-shard order queues drained by one worker thread each, used by add-transaction/.
+# Orders are sharded by 'user' or 'ticker'; a request waits at most
+# ORDER_SEQUENCER_TIMEOUT seconds for its fill before getting 202 Accepted.
+ORDER_SEQUENCER_ENABLED = True
+ORDER_SEQUENCER_SHARDS = 4
+ORDER_SEQUENCER_SHARD_KEY = 'user'
+ORDER_SEQUENCER_BATCH_SIZE = 100
+ORDER_SEQUENCER_TIMEOUT = 5.0
+
+# Write-behind mode: add-transaction/ answers once the order is fsynced to the
+# journal, and a background flusher applies batches of up to
+# ORDER_JOURNAL_BATCH_SIZE orders or ORDER_JOURNAL_MAX_DELAY seconds per commit.
+# Give every server process its own journal path.
+ORDER_WRITE_BEHIND_ENABLED = False
+ORDER_JOURNAL_PATH = os.environ.get('ORDER_JOURNAL_PATH', str(BASE_DIR / 'orders.journal'))
+ORDER_JOURNAL_BATCH_SIZE = 500
+ORDER_JOURNAL_MAX_DELAY = 0.005
+ORDER_JOURNAL_MAX_BYTES = 64 * 1024 * 1024
+ORDER_JOURNAL_FSYNC = True
+
+# Responses to order requests sent with an Idempotency-Key header are replayed
+# for retries within IDEMPOTENCY_KEY_TTL seconds.
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+IDEMPOTENCY_CACHE_MAX_ENTRIES = 10000
+IDEMPOTENCY_WAIT_TIMEOUT = 10.0
+
 SIMPLE_JWT = {
     'SIGNING_KEY': SECRET_KEY,
     'ALGORITHM': 'HS256',
@@ -71,6 +155,7 @@ SIMPLE_JWT = {
 }
 
 MIDDLEWARE = [
+    'stocks_app.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -105,6 +190,13 @@ WSGI_APPLICATION = 'stocks_transactions_handler.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# Connections are kept open for DB_CONN_MAX_AGE seconds and checked before
+# reuse. With DB_POOL=1 Django's psycopg pool is used instead (it requires
+# CONN_MAX_AGE = 0 and the psycopg[pool] package). Every sequencer shard and
+# the journal flusher hold one connection for the life of the process, so
+# leave room for them in DB_POOL_MAX_SIZE.
+DB_POOL = os.environ.get('DB_POOL', '0') == '1'
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.postgresql",
@@ -113,9 +205,41 @@ DATABASES = {
         "PASSWORD": "5571",
         "HOST": "localhost",
         "PORT": "5433",
+        "CONN_MAX_AGE": 0 if DB_POOL else int(os.environ.get('DB_CONN_MAX_AGE', '60')),
+        "CONN_HEALTH_CHECKS": os.environ.get('DB_CONN_HEALTH_CHECKS', '1') == '1',
+        "OPTIONS": {
+            "pool": {
+                "min_size": int(os.environ.get('DB_POOL_MIN_SIZE', '4')),
+                "max_size": int(os.environ.get('DB_POOL_MAX_SIZE', '20')),
+                "timeout": float(os.environ.get('DB_POOL_TIMEOUT', '10')),
+            },
+        } if DB_POOL else {},
     }
 }
 
+# With DB_SQLITE_PATH set the default database is that SQLite file instead, so
+# the benchmark suite can run without a PostgreSQL server.
+if os.environ.get('DB_SQLITE_PATH'):
+    DATABASES['default'] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.environ['DB_SQLITE_PATH'],
+        "OPTIONS": {"transaction_mode": "IMMEDIATE", "timeout": 20},
+    }
+
+# Read replicas of the default database, one per host in DB_REPLICA_HOSTS
+# (comma separated). History, position, analytics and summary reads and the
+# admin change lists go to a replica; a user's reads stay on the primary for
+# REPLICA_PIN_SECONDS after they place an order. REPLICA_PIN_CACHE_BACKEND
+# names an entry of CACHES shared by all workers; None pins per process.
+REPLICA_DATABASES = []
+for index, host in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(',')), start=1):
+    DATABASES[f'replica{index}'] = {**DATABASES['default'], 'HOST': host.strip(), 'TEST': {'MIRROR': 'default'}}
+    REPLICA_DATABASES.append(f'replica{index}')
+
+DATABASE_ROUTERS = ['stocks_app.routers.ReplicaRouter']
+REPLICA_PIN_SECONDS = 5.0
+REPLICA_PIN_CACHE_BACKEND = None
+
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
 AUTH_PASSWORD_VALIDATORS = [
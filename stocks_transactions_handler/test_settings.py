@@ -0,0 +1,29 @@
+"""
+Settings for the test suite: the project settings with an in-memory SQLite
+database, so `python manage.py test` runs without a PostgreSQL server. Set
+DJANGO_SETTINGS_MODULE to run the suite against PostgreSQL instead.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    },
+    # A second, separate database for the router tests. It is only created for
+    # tests that list it in `databases`, and only they enable it as a replica.
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    },
+}
+REPLICA_DATABASES = []
+
+# Orders are filled on the request thread, inside each test's transaction.
+ORDER_SEQUENCER_ENABLED = False
+
+# Views over their query budget fail the test, and repeated query shapes are
+# logged with their call sites.
+QUERY_BUDGET_MODE = 'raise'
+QUERY_N_PLUS_ONE_THRESHOLD = 5